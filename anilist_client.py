@@ -0,0 +1,158 @@
+import threading
+import random
+import time
+
+from constants import (
+    URL,
+    HTTP_POOL_SIZE,
+    REQUEST_TIMEOUT,
+    RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_BURST,
+    MAX_RETRIES,
+    RETRY_BACKOFF_BASE,
+    RETRY_BACKOFF_CAP
+)
+
+session = None
+session_lock = threading.Lock()
+
+# Token bucket shared by every thread that talks to AniList
+rate_limit_lock = threading.Lock()
+requests_per_minute = RATE_LIMIT_PER_MINUTE
+tokens = RATE_LIMIT_BURST
+last_refill = time.monotonic()
+blocked_until = 0.0
+
+
+def get_session():
+    global session
+
+    # Pages are fetched from several threads at once, so only one of them should create the session
+    with session_lock:
+        if session is None:
+            session = create_session()
+
+    return session
+
+
+def create_session():
+    # requests is only imported once a request is actually made, which keeps commands that never reach
+    # AniList quick to start
+    import requests
+
+    from requests.adapters import HTTPAdapter
+
+    new_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+
+    new_session.mount("https://", adapter)
+    new_session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Content-Type": "application/json",
+        "Connection": "keep-alive"
+    })
+
+    return new_session
+
+
+def post_query(query, variables):
+    import requests
+
+    for attempt in range(MAX_RETRIES + 1):
+        wait_for_token()
+
+        try:
+            response = get_session().post(
+                URL, json={"query": query, "variables": variables}, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        record_rate_limit(response.headers)
+
+        if response.status_code != 429 and response.status_code < 500:
+            break
+
+        if attempt == MAX_RETRIES:
+            response.raise_for_status()
+
+        retry_after = response.headers.get("Retry-After")
+
+        if response.status_code == 429 and retry_after:
+            # Every other thread has to hold off as well, otherwise they would just get a 429 too
+            block_requests(float(retry_after))
+        else:
+            time.sleep(backoff_delay(attempt))
+
+    payload = response.json()
+
+    # AniList still sends back data for errors such as a missing media (404), which callers can handle
+    if not response.ok and not payload.get("data"):
+        response.raise_for_status()
+
+    return payload
+
+
+def wait_for_token():
+    global tokens, last_refill
+
+    while True:
+        with rate_limit_lock:
+            now = time.monotonic()
+            tokens = min(RATE_LIMIT_BURST, tokens +
+                         (now - last_refill) * requests_per_minute / 60)
+            last_refill = now
+
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                return
+            else:
+                wait = (1 - tokens) * 60 / requests_per_minute
+
+        time.sleep(wait)
+
+
+def record_rate_limit(headers):
+    global requests_per_minute, tokens
+
+    limit = headers.get("X-RateLimit-Limit")
+    remaining = headers.get("X-RateLimit-Remaining")
+
+    with rate_limit_lock:
+        if limit:
+            requests_per_minute = int(limit)
+
+        if remaining is not None:
+            # The server's count is the source of truth, since other clients may share the same limit
+            tokens = min(tokens, int(remaining))
+
+    if remaining is not None and int(remaining) == 0:
+        reset = headers.get("X-RateLimit-Reset")
+        block_requests(int(reset) - time.time() if reset else 60)
+
+
+def block_requests(seconds):
+    global blocked_until
+
+    # A little jitter stops all the waiting threads from retrying at exactly the same moment
+    seconds = max(seconds, 0) + random.uniform(0, 1)
+
+    with rate_limit_lock:
+        blocked_until = max(blocked_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt):
+    return random.uniform(0.5, 1) * min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** attempt)
+
+
+def request_errors():
+    # Only evaluated once an exception has been raised, so catching request errors doesn't import requests
+    from requests import RequestException
+
+    return RequestException
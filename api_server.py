@@ -0,0 +1,270 @@
+import json
+import time
+import sqlite3
+import threading
+import traceback
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from constants import (
+    VALID_STATUSES,
+    VALID_GENRES,
+    VALID_FORMATS,
+    VALID_MEDIA_STATUSES,
+    MEDIA_CACHE_TTLS,
+    DEFAULT_MEDIA_CACHE_TTL,
+    MEDIA_CACHE_MAX_ENTRIES,
+    ID_BATCH_SIZE,
+    HTTP_KEEP_ALIVE_TIMEOUT,
+    HTTP_PAGE_LIMIT,
+    API_ERROR_MSG
+)
+from helpers import get_watch_list_page, get_multiple_anime
+from sql_queries import watch_list_sorts
+from anilist_client import request_errors
+from batch import validate_change, apply_changes
+from project import recommend_variables, pick_recommendations, get_recommendation_details
+
+# Anime details (with the time they expire) shared by every request, in front of the media cache in the database
+details_cache = {}
+details_lock = threading.Lock()
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    def __init__(self, address, db_path, workers):
+        super().__init__(address, ApiRequestHandler)
+        self.db_path = db_path
+        # Every client connection gets its own thread, so a keep-alive client waiting between requests doesn't hold
+        # anyone else up, but only this many requests are worked on at the same time
+        self.workers = threading.BoundedSemaphore(workers)
+        # A request hands its database connection back when it is done, so there is at most one for each worker.
+        # Each one is only ever used by one thread at a time
+        self.idle_connections = []
+        self.connections_lock = threading.Lock()
+
+    def take_connection(self):
+        with self.connections_lock:
+            if self.idle_connections:
+                return self.idle_connections.pop()
+
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def return_connection(self, db):
+        with self.connections_lock:
+            self.idle_connections.append(db)
+
+    def server_close(self):
+        super().server_close()
+
+        with self.connections_lock:
+            for db in self.idle_connections:
+                db.close()
+
+            self.idle_connections.clear()
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets a client send many requests over one connection, for as long as it isn't idle for too long
+    protocol_version = "HTTP/1.1"
+    timeout = HTTP_KEEP_ALIVE_TIMEOUT
+    # The headers and the body are written separately, and Nagle's algorithm would hold the body back until the
+    # client acknowledges the headers, adding around 40ms to every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def do_PATCH(self):
+        self.respond("PATCH")
+
+    def do_DELETE(self):
+        self.respond("DELETE")
+
+    def respond(self, method):
+        url = urlsplit(self.path)
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            body = None
+
+        with self.server.workers:
+            db = self.server.take_connection()
+
+            try:
+                status, payload = handle_api_request(db, method, url.path, parse_qs(url.query), body)
+            except request_errors():
+                status, payload = 502, {"error": API_ERROR_MSG}
+            except Exception:
+                self.log_error("%s", traceback.format_exc())
+                status, payload = 500, {"error": "Something went wrong while handling the request"}
+            finally:
+                self.server.return_connection(db)
+
+        data = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code="-", size="-"):
+        # Logging every request would slow the server down under load, so only errors are logged
+        pass
+
+
+def serve_api(db_path, port, workers):
+    server = PooledHTTPServer(("127.0.0.1", port), db_path, workers)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def handle_api_request(db, method, path, query, body):
+    if not isinstance(body, dict):
+        return 400, {"error": "The request body has to be a JSON object"}
+
+    match method, path.strip("/").split("/"):
+        case "GET", ["watchlist"]:
+            return list_watch_list(db, query)
+        case "POST", ["watchlist"]:
+            return change_watch_list(db, {**body, "action": "add"})
+        case "PATCH", ["watchlist", media_id]:
+            return change_watch_list(db, {**body, "action": "update", "media_id": media_id})
+        case "DELETE", ["watchlist", media_id]:
+            return change_watch_list(db, {"action": "delete", "media_id": media_id})
+        case "GET", ["recommend"]:
+            return recommend(db, query)
+        case _, ["watchlist"] | ["watchlist", _] | ["recommend"]:
+            return 405, {"error": f"{method} isn't allowed for {path}"}
+
+    return 404, {"error": f"Nothing is found at {path}"}
+
+
+def list_watch_list(db, query):
+    try:
+        status = query_value(query, "status", str.upper, VALID_STATUSES)
+        sort = query_value(query, "sort", str.lower, list(watch_list_sorts)) or "score"
+        min_score = query_value(query, "min_score", int)
+        after = query_value(query, "after", int)
+        limit = query_value(query, "limit", int)
+    except ValueError as error:
+        return 400, {"error": str(error)}
+
+    if limit is not None and limit < 1:
+        return 400, {"error": "The limit has to be above 0"}
+
+    # Larger pages are cut down to the default, so one request can't look up the details of the whole watch list
+    limit = min(limit or HTTP_PAGE_LIMIT, HTTP_PAGE_LIMIT)
+
+    entries = get_watch_list_page(db, status, min_score, sort, limit, after)
+
+    if entries is None:
+        return 404, {"error": f"No watch list entry with id {after}"}
+
+    has_next_page = len(entries) > limit
+    entries = entries[:limit]
+    anime = get_cached_details(db, [entry[2] for entry in entries])
+
+    return 200, {
+        "entries": [
+            {"id": id, "title": title, "media_id": media_id, "score": score, "status": status, "anime": anime.get(media_id)}
+            for id, title, media_id, score, status in entries
+        ],
+        "next_after": entries[-1][0] if has_next_page else None
+    }
+
+
+def change_watch_list(db, row):
+    change, error = validate_change(row)
+
+    if error:
+        return 400, {"error": error}
+
+    media_id = change["media_id"]
+    report = apply_changes(db, [change])
+
+    if report["not_found"]:
+        return 404, {"error": f"No anime with id {media_id} was found on AniList"}
+    if report["skipped"]:
+        return 409, {"error": f"Anime {media_id} is already in the watch list"}
+    if not any(report.values()):
+        return 404, {"error": f"Anime {media_id} isn't in the watch list"}
+
+    return 201 if change["action"] == "add" else 200, report
+
+
+def recommend(db, query):
+    try:
+        genres = query_list(query, "genres", str.title, VALID_GENRES)
+        formats = query_list(query, "formats", str.upper, VALID_FORMATS)
+        weighted_by = query_list(query, "weighted", str.lower, ["score", "popularity"])
+        status = query_value(query, "status", str.upper, VALID_MEDIA_STATUSES)
+        min_score = query_value(query, "min_score", int)
+        max_episodes = query_value(query, "max_episodes", int)
+        count = min(max(query_value(query, "count", int) or 1, 1), ID_BATCH_SIZE)
+        sample = query_value(query, "sample", str.lower, ["true", "false"]) == "true"
+        diverse = query_value(query, "diverse", str.lower, ["true", "false"]) == "true"
+    except ValueError as error:
+        return 400, {"error": str(error)}
+
+    variables = recommend_variables(genres, min_score, max_episodes, formats, status)
+    candidates, offline = pick_recommendations(db, variables, sample, weighted_by or None, count, diverse)
+
+    return 200, {"recommendations": get_recommendation_details(db, candidates, offline) if candidates else []}
+
+
+def query_value(query, name, convert=str, valid_values=None):
+    if name not in query:
+        return None
+
+    try:
+        value = convert(query[name][-1])
+    except ValueError:
+        raise ValueError(f"Invalid value for {name}: {query[name][-1]!r}") from None
+
+    if valid_values is not None and value not in valid_values:
+        raise ValueError(f"Invalid value for {name}: {query[name][-1]!r}. Valid values: {valid_values}")
+
+    return value
+
+
+def query_list(query, name, convert, valid_values):
+    # Lists can be given as genres=Action,Drama or as genres=Action&genres=Drama
+    values = [value for values in query.get(name, []) for value in values.split(",") if value]
+
+    return [query_value({name: [value]}, name, convert, valid_values) for value in values]
+
+
+def get_cached_details(db, ids):
+    now = time.time()
+
+    with details_lock:
+        anime = {id: details_cache[id][1] for id in ids if id in details_cache and details_cache[id][0] > now}
+
+    missing_ids = [id for id in ids if id not in anime]
+
+    if missing_ids:
+        fetched_anime = get_multiple_anime(missing_ids, db)
+
+        with details_lock:
+            for id, media in fetched_anime.items():
+                details_cache.pop(id, None)
+                details_cache[id] = (now + MEDIA_CACHE_TTLS.get(media.get("status"), DEFAULT_MEDIA_CACHE_TTL), media)
+
+            # The oldest details are dropped first, since the cache keeps them in the order they were added
+            while len(details_cache) > MEDIA_CACHE_MAX_ENTRIES:
+                details_cache.pop(next(iter(details_cache)))
+
+        anime.update(fetched_anime)
+
+    return anime
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+
+from itertools import groupby
+from constants import VALID_STATUSES, BATCH_ACTIONS
+from graphql_queries import get_query
+from helpers import get_anime_batches, get_anime_title
+from sql_queries import import_anime_query, batch_update_query, batch_delete_query
+
+
+def read_changes(text):
+    text = text.strip()
+
+    if not text:
+        return []
+    if text[0] == "[":
+        return json.loads(text)
+    if text[0] == "{":
+        # JSON Lines, with one change per line
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    # Empty CSV cells leave that value out, the same as a JSON change without the key
+    return [{key: value for key, value in row.items() if value != ""} for row in csv.DictReader(io.StringIO(text))]
+
+
+def validate_change(row):
+    action = str(row.get("action", "")).lower()
+
+    if action not in BATCH_ACTIONS:
+        return None, f"unknown action {row.get("action")!r}"
+
+    try:
+        change = {"action": action, "media_id": int(row["media_id"])}
+    except (KeyError, TypeError, ValueError):
+        return None, "a numeric media_id is required"
+
+    if "status" in row:
+        change["status"] = str(row["status"]).upper()
+
+        if change["status"] not in VALID_STATUSES:
+            return None, f"invalid status {row["status"]!r}"
+
+    if "score" in row:
+        try:
+            change["score"] = None if row["score"] is None else int(row["score"])
+        except (TypeError, ValueError):
+            return None, f"invalid score {row["score"]!r}"
+
+        if change["score"] is not None and not 0 <= change["score"] <= 100:
+            return None, f"invalid score {row["score"]!r}"
+
+    if action == "update" and "status" not in change and "score" not in change:
+        return None, "an update needs a status or a score"
+
+    if action == "add":
+        change.setdefault("status", "PLAN TO WATCH")
+        change.setdefault("score", None)
+
+    return change, None
+
+
+def validate_changes(rows):
+    changes = []
+    errors = []
+
+    for number, row in enumerate(rows, start=1):
+        change, error = validate_change(row) if isinstance(row, dict) else (None, "each change must be an object")
+
+        if error:
+            errors.append(f"Entry {number}: {error}")
+        else:
+            changes.append(change)
+
+    return changes, errors
+
+
+def apply_changes(db, changes):
+    add_ids = list(dict.fromkeys(change["media_id"] for change in changes if change["action"] == "add"))
+    # Titles for every added anime are fetched 50 ids at a time before anything is written
+    titles = {
+        anime["id"]: get_anime_title(anime["title"])
+        for anime in get_anime_batches(get_query("import_ids"), add_ids)
+    }
+    report = {"added": 0, "skipped": 0, "updated": 0, "deleted": 0, "not_found": 0}
+
+    # Consecutive changes with the same action are applied with one executemany, keeping the order they were
+    # given in, and the whole batch is committed (or rolled back) together
+    with db:
+        for action, group in groupby(changes, key=lambda change: change["action"]):
+            group = list(group)
+
+            match action:
+                case "add":
+                    found = [change for change in group if change["media_id"] in titles]
+                    report["not_found"] += len(group) - len(found)
+                    cursor = db.executemany(import_anime_query, [
+                        (change["media_id"], titles[change["media_id"]], change["score"], change["status"])
+                        for change in found
+                    ])
+                    report["added"] += cursor.rowcount
+                    report["skipped"] += len(found) - cursor.rowcount
+                case "update":
+                    cursor = db.executemany(batch_update_query, [
+                        ("status" in change, change.get("status"), "score" in change, change.get("score"), change["media_id"])
+                        for change in group
+                    ])
+                    report["updated"] += cursor.rowcount
+                case "delete":
+                    cursor = db.executemany(batch_delete_query, [(change["media_id"],) for change in group])
+                    report["deleted"] += cursor.rowcount
+
+    return report
@@ -0,0 +1,179 @@
+import os
+import json
+import zlib
+import random
+import tempfile
+import threading
+import numpy as np
+
+from constants import VALID_GENRES, VALID_FORMATS, VALID_MEDIA_STATUSES, CANDIDATE_INDEX_DIR, STUDIO_BUCKETS, SAMPLE_ATTEMPTS
+from catalog import get_sync_state
+from sql_queries import catalog_index_query
+
+COLUMNS = {
+    "ids": np.int32,
+    "scores": np.int16,
+    "popularity": np.int32,
+    "episodes": np.int32,
+    "genres": np.uint32,
+    "formats": np.uint8,
+    "statuses": np.uint8,
+    "studios": np.uint64
+}
+
+# Keeps the index loaded for the rest of the process once it has been read from disk
+loaded_index = None
+# Stops the API server's threads from rebuilding the index files at the same time
+index_lock = threading.Lock()
+
+
+def get_candidate_index(db):
+    global loaded_index
+
+    catalog_version = get_catalog_version(db)
+
+    with index_lock:
+        if loaded_index is None or loaded_index["version"] != catalog_version:
+            loaded_index = load_candidate_index()
+
+        # The index is rebuilt whenever the catalog has been synced since the index was saved
+        if loaded_index is None or loaded_index["version"] != catalog_version:
+            build_candidate_index(db)
+            loaded_index = load_candidate_index()
+
+        return loaded_index
+
+
+def build_candidate_index(db):
+    rows = db.execute(catalog_index_query).fetchall()
+    columns = {
+        "ids": [row[0] for row in rows],
+        # Missing scores and episode counts are stored as -1, so they never pass a score or episode filter
+        "scores": [-1 if row[1] is None else row[1] for row in rows],
+        "popularity": [row[2] or 0 for row in rows],
+        "episodes": [-1 if row[3] is None else row[3] for row in rows],
+        "genres": [to_bitmask(json.loads(row[6]), VALID_GENRES) for row in rows],
+        "formats": [to_bitmask([row[4]], VALID_FORMATS) for row in rows],
+        "statuses": [to_bitmask([row[5]], VALID_MEDIA_STATUSES) for row in rows],
+        "studios": [studio_bitmask(json.loads(row[7] or "[]")) for row in rows]
+    }
+
+    os.makedirs(CANDIDATE_INDEX_DIR, exist_ok=True)
+
+    for name, dtype in COLUMNS.items():
+        replace_index_file(f"{name}.npy", lambda file: np.save(file, np.array(columns[name], dtype=dtype)))
+
+    # Replaced last, so an index that was only partly saved is never mistaken for a current one
+    version = json.dumps({"version": get_catalog_version(db)}).encode()
+    replace_index_file("version.json", lambda file: file.write(version))
+
+
+def replace_index_file(name, write):
+    # Other processes can have the old file memory mapped, and writing over it in place would crash them with a
+    # bus error. The new file is written next to it and then takes its name, so the old one stays intact for them
+    descriptor, temp_path = tempfile.mkstemp(dir=CANDIDATE_INDEX_DIR, suffix=".tmp")
+
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            write(file)
+
+        os.replace(temp_path, os.path.join(CANDIDATE_INDEX_DIR, name))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_candidate_index():
+    try:
+        with open(os.path.join(CANDIDATE_INDEX_DIR, "version.json"), "r") as file:
+            index = json.load(file)
+
+        # Memory mapping means only the pages of each column that are actually used get read from disk
+        for name in COLUMNS:
+            index[name] = np.load(os.path.join(CANDIDATE_INDEX_DIR, f"{name}.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        # A missing or unreadable index is built again, the same as an outdated one
+        return None
+
+    # Columns from two different builds are never used together
+    if len({len(index[name]) for name in COLUMNS}) != 1:
+        return None
+
+    return index
+
+
+def get_catalog_version(db):
+    return get_sync_state(db, "high_water_mark")
+
+
+def filter_candidate_index(index, variables):
+    mask = np.ones(len(index["ids"]), dtype=bool)
+
+    if variables.get("genre_in"):
+        # AniList's genre_in only matches anime that have every one of the genres
+        genres = to_bitmask(variables["genre_in"], VALID_GENRES)
+        mask &= (index["genres"] & genres) == genres
+    if variables.get("format_in"):
+        mask &= (index["formats"] & to_bitmask(variables["format_in"], VALID_FORMATS)) != 0
+    if variables.get("status"):
+        mask &= index["statuses"] == to_bitmask([variables["status"]], VALID_MEDIA_STATUSES)
+    if variables.get("averageScore_greater"):
+        mask &= index["scores"] > variables["averageScore_greater"]
+    if variables.get("episodes_lesser"):
+        mask &= (index["episodes"] >= 0) & (index["episodes"] < variables["episodes_lesser"])
+
+    return np.flatnonzero(mask)
+
+
+def filter_out_watched_positions(index, positions, watched_ids):
+    if not watched_ids:
+        return positions
+
+    return positions[~np.isin(index["ids"][positions], list(watched_ids))]
+
+
+def sample_unwatched_positions(index, positions, watched_ids, count, attempts=SAMPLE_ATTEMPTS):
+    picked = []
+
+    # Like the sampled recommend mode online, random matches are drawn again whenever they are watched (or already
+    # picked), so the watch list never has to be checked against every match
+    for _ in range(attempts * count):
+        position = int(positions[random.randrange(len(positions))])
+
+        if int(index["ids"][position]) not in watched_ids and position not in picked:
+            picked.append(position)
+
+        if len(picked) == count:
+            return picked
+
+    return None
+
+
+def find_index_positions(index, ids):
+    # Rows are saved in media id order, so ids can be looked up with a binary search
+    ids = np.asarray(ids, dtype=np.int32)
+    positions = np.searchsorted(index["ids"], ids)
+    found = positions < len(index["ids"])
+    found[found] = index["ids"][positions[found]] == ids[found]
+
+    return positions[found]
+
+
+def candidate_at(index, position):
+    score = int(index["scores"][position])
+
+    return {
+        "id": int(index["ids"][position]),
+        "averageScore": score if score >= 0 else None,
+        "popularity": int(index["popularity"][position])
+    }
+
+
+def to_bitmask(values, valid_values):
+    # Values that aren't one of the valid options (such as genres that can't be filtered on) are left out
+    return sum(1 << valid_values.index(value) for value in set(values) if value in valid_values)
+
+
+def studio_bitmask(studio_edges):
+    # There are too many studios to give each one its own bit, so their names are hashed into a fixed number of bits
+    return sum({1 << (zlib.crc32(edge["node"]["name"].encode()) % STUDIO_BUCKETS) for edge in studio_edges})
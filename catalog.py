@@ -0,0 +1,149 @@
+import json
+import time
+
+from constants import PAGE_SIZE, SQL_VARIABLE_BATCH_SIZE
+from graphql_queries import get_query
+from helpers import get_page
+from sql_queries import (
+    upsert_catalog_anime_query,
+    catalog_anime_query,
+    catalog_anime_batch_query,
+    catalog_search_query,
+    sync_state_query,
+    set_sync_state_query,
+    delete_sync_state_query
+)
+
+
+def sync_catalog(db):
+    high_water_mark = get_sync_state(db, "high_water_mark")
+
+    if high_water_mark is None:
+        return full_sync(db)
+
+    return incremental_sync(db, int(high_water_mark))
+
+
+def full_sync(db):
+    query = get_query("catalog_sync")
+    # An interrupted crawl carries on from the last page that was saved
+    page_num = int(get_sync_state(db, "checkpoint_page") or 0) + 1
+    # Anime on pages that were already crawled can be updated before the crawl ends, so the next sync picks up
+    # every change made since the crawl started, rather than since the newest update it happened to see
+    started_at = int(get_sync_state(db, "checkpoint_started_at") or time.time())
+    synced_count = 0
+
+    while True:
+        page = get_page(query, {"sort": ["ID"]}, page_num)
+
+        save_catalog_anime(db, page["media"])
+        synced_count += len(page["media"])
+
+        if not page["pageInfo"]["hasNextPage"]:
+            break
+
+        # The checkpoint is committed along with the page, so a saved page is never requested again
+        set_sync_state(db, "checkpoint_page", page_num)
+        set_sync_state(db, "checkpoint_started_at", started_at)
+        db.commit()
+        page_num += 1
+
+    set_sync_state(db, "high_water_mark", started_at)
+    db.execute(delete_sync_state_query, ("checkpoint_page",))
+    db.execute(delete_sync_state_query, ("checkpoint_started_at",))
+    db.commit()
+
+    return synced_count
+
+
+def incremental_sync(db, high_water_mark):
+    query = get_query("catalog_sync")
+    page_num = 1
+    newest_update = high_water_mark
+    synced_count = 0
+
+    # Pages shift as anime keep getting updated, so an interrupted incremental sync starts again from the
+    # first page. The high-water mark is only moved once every change since the last sync has been saved
+    while True:
+        page = get_page(query, {"sort": ["UPDATED_AT_DESC"]}, page_num)
+        changed_anime = [anime for anime in page["media"] if anime["updatedAt"] > high_water_mark]
+
+        save_catalog_anime(db, changed_anime)
+        db.commit()
+        synced_count += len(changed_anime)
+        newest_update = max([newest_update, *(anime["updatedAt"] for anime in changed_anime)])
+
+        if len(changed_anime) < len(page["media"]) or not page["pageInfo"]["hasNextPage"]:
+            break
+
+        page_num += 1
+
+    set_sync_state(db, "high_water_mark", newest_update)
+    db.commit()
+
+    return synced_count
+
+
+def save_catalog_anime(db, anime):
+    db.executemany(upsert_catalog_anime_query, [catalog_record(media) for media in anime])
+
+
+def catalog_record(anime):
+    return (
+        anime["id"],
+        anime["title"]["english"],
+        anime["title"]["userPreferred"],
+        anime["averageScore"],
+        anime["popularity"],
+        anime["episodes"],
+        anime["format"],
+        anime["status"],
+        json.dumps(anime["genres"]),
+        anime["updatedAt"],
+        json.dumps(anime)
+    )
+
+
+def is_catalog_synced(db):
+    return get_sync_state(db, "high_water_mark") is not None
+
+
+def get_sync_state(db, key):
+    row = db.execute(sync_state_query, (key,)).fetchone()
+
+    return row[0] if row else None
+
+
+def set_sync_state(db, key, value):
+    db.execute(set_sync_state_query, (key, str(value)))
+
+
+def get_catalog_anime(db, id):
+    row = db.execute(catalog_anime_query, (id,)).fetchone()
+
+    return json.loads(row[0]) if row else None
+
+
+def get_catalog_anime_batch(db, ids):
+    anime = []
+
+    for start in range(0, len(ids), SQL_VARIABLE_BATCH_SIZE):
+        batch = ids[start:start + SQL_VARIABLE_BATCH_SIZE]
+        query = catalog_anime_batch_query.format(placeholders=", ".join("?" * len(batch)))
+        anime.extend(json.loads(row[0]) for row in db.execute(query, batch))
+
+    return anime
+
+
+def iter_catalog_pages(db, name):
+    pattern = "%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    cursor = db.execute(catalog_search_query, (pattern, pattern))
+
+    # Pages are handed out the same way as iter_pages, so the add flow doesn't care where results come from
+    while True:
+        rows = cursor.fetchmany(PAGE_SIZE)
+        yield [json.loads(row[0]) for row in rows]
+
+        if len(rows) < PAGE_SIZE:
+            return
+
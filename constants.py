@@ -52,16 +52,145 @@ VALID_FORMATS = [
 
 URL = 'https://graphql.anilist.co'
 
+# Watch list statuses used by MyAnimeList exports, which give them either as text or as a number
+MAL_STATUSES = {
+    "Watching": "WATCHING",
+    "Completed": "COMPLETED",
+    "On-Hold": "ON HOLD",
+    "Dropped": "DROPPED",
+    "Plan to Watch": "PLAN TO WATCH",
+    "1": "WATCHING",
+    "2": "COMPLETED",
+    "3": "ON HOLD",
+    "4": "DROPPED",
+    "6": "PLAN TO WATCH"
+}
+
+# Changes the batch mode can make to the watch list
+BATCH_ACTIONS = ["add", "update", "delete"]
+
+# Watch list statuses used by AniList exports
+ANILIST_STATUSES = {
+    "CURRENT": "WATCHING",
+    "REPEATING": "WATCHING",
+    "COMPLETED": "COMPLETED",
+    "PAUSED": "ON HOLD",
+    "DROPPED": "DROPPED",
+    "PLANNING": "PLAN TO WATCH"
+}
+# What an AniList score is multiplied by to put it on the 100 point scale the watch list uses, for each score format
+ANILIST_SCORE_SCALES = {
+    "POINT_100": 1,
+    "POINT_10_DECIMAL": 10,
+    "POINT_10": 10,
+    "POINT_5": 20,
+    "POINT_3": 100 / 3
+}
+
+# AniList caps the number of media returned per page at 50
+PAGE_SIZE = 50
+ID_BATCH_SIZE = PAGE_SIZE
+# Random picks made by the sampled recommend mode before falling back to fetching every page
+SAMPLE_ATTEMPTS = 10
+# Rows the streaming table renderer measures its column widths on, and the widest a column can be
+TABLE_SAMPLE_ROWS = ID_BATCH_SIZE
+MAX_COLUMN_WIDTH = 50
+# How long (in seconds) the pool of anime matching a set of recommend criteria is reused by the weighted recommend mode
+CANDIDATE_POOL_TTL = 24 * 60 * 60
+# Folder holding the columns of the local candidate index, which is rebuilt after every sync
+CANDIDATE_INDEX_DIR = "anime_index"
+# The SQLite database every mode reads and writes
+DB_PATH = "anime.db"
+# Socket the serve mode listens on next to anime.db, the modes it runs for other processes, and the most output
+# (in characters) it holds before sending it on
+DAEMON_SOCKET_PATH = "anime.sock"
+FORWARDED_MODES = ["watchlist", "recommend", "similar"]
+DAEMON_OUTPUT_BUFFER = 64 * 1024
+# Defaults for the api mode's HTTP server: its port, its worker threads, how long (in seconds) an idle keep-alive
+# connection holds on to a worker, and the most watch list entries returned at once
+HTTP_PORT = 8000
+HTTP_WORKERS = 8
+HTTP_KEEP_ALIVE_TIMEOUT = 5
+HTTP_PAGE_LIMIT = 50
+# Number of bits studio names are hashed into, for both the candidate index and the ranking feature vectors
+STUDIO_BUCKETS = 64
+# Number of anime listed by the ranked recommend mode and the similar mode
+RANK_COUNT = 10
+# Random anime the diverse recommend mode chooses its most varied picks from. One batch, so their details take one request
+DIVERSITY_SHORTLIST = ID_BATCH_SIZE
+# Balance between an anime's score (1) and how different it is from the anime already picked (0) for diverse picks
+DIVERSITY_TRADE_OFF = 0.3
+# Episode count that is given the same weight as a single genre in the similar mode's feature vectors
+EPISODE_SCALE = 100
+# Random-projection LSH for the similar mode. Each table hashes an anime into one of 2 ** LSH_BITS buckets
+LSH_TABLES = 32
+LSH_BITS = 12
+# Seeds the random hyperplanes, so an anime always lands in the same buckets and the index can be updated in place
+LSH_SEED = 2024
+# Most watch list ids sent to AniList to be excluded from recommendations. Any others are filtered out locally
+MAX_EXCLUDED_IDS = 500
+# Maximum number of pages requested from AniList at the same time
+PAGE_CONCURRENCY = 4
+# Kept above PAGE_CONCURRENCY so parallel page requests never wait on a free connection
+HTTP_POOL_SIZE = 10
+# (connect, read) timeouts in seconds for requests to AniList
+REQUEST_TIMEOUT = (5, 30)
+# AniList allows around 90 requests per minute. The bucket refills at this rate and is corrected by the X-RateLimit headers
+RATE_LIMIT_PER_MINUTE = 90
+RATE_LIMIT_BURST = 10
+# Retries for 429 and 5xx responses, backing off exponentially (in seconds) between attempts
+MAX_RETRIES = 5
+RETRY_BACKOFF_BASE = 1
+RETRY_BACKOFF_CAP = 30
+
+# How long cached media metadata stays fresh (in seconds), based on the airing status of the anime
+MEDIA_CACHE_TTLS = {
+    "FINISHED": 90 * 24 * 60 * 60,
+    "CANCELLED": 90 * 24 * 60 * 60,
+    "HIATUS": 7 * 24 * 60 * 60,
+    "NOT_YET_RELEASED": 24 * 60 * 60,
+    "RELEASING": 6 * 60 * 60
+}
+DEFAULT_MEDIA_CACHE_TTL = 24 * 60 * 60
+MEDIA_CACHE_MAX_ENTRIES = 5000
+# Keeps the number of bound parameters per statement below SQLite's limit
+SQL_VARIABLE_BATCH_SIZE = 500
+
 WATCH_LIST_EMPTY_MSG = "Watchlist is currently empty"
+NO_MATCHING_ENTRIES_MSG = "No entries in your watch list match the given flags"
 MULTIPLE_FLAGS_ERR_MSG = "Multiple flags added for the watchlist mode. Only one flag is allowed"
 NO_RECOMMENDATIONS_FOUND_MSG = "No anime found with current options. Try narrowing down the criteria given"
 NO_UNIQUE_RECOMMENDATION_FOUND_MSG = "All anime that match the given criteria are included in your watch list"
+NO_RATED_ANIME_MSG = "Give a score to some of the anime in your watch list to get ranked recommendations"
+NO_SIMILAR_ANIME_MSG = "No unwatched anime similar to this one were found in the local catalog"
+CATALOG_NOT_SYNCED_MSG = "The similar mode searches the local catalog. Run the sync mode first"
 CANCEL_DELETE_MSG = "Cancelling delete process"
+CANCEL_UPDATE_MSG = "Cancelling update process"
+NO_MORE_RESULTS_MSG = "There are no more results for this anime"
+SYNC_STARTED_MSG = "Syncing the anime catalog from AniList. This can take a few minutes the first time"
+DUPLICATES_REMOVED_MSG = "Removed {count} duplicate watch list entries, keeping the newest entry for each anime"
+API_ERROR_MSG = "Unable to get a response from AniList right now. Try again in a few minutes"
 
 INVALID_SCORE_MSG = "Invalid Score Provided"
 INVALID_OPTION_MSG = "Please provide a valid option"
+INVALID_SELECTION_MSG = "Please provide the numbers of the anime to add separated by commas, 'all' or 'none'"
 INVALID_CONFIRMATION_MSG = "Invalid response given. Valid responses: ['y', 'yes', 'n', 'no']"
-INVALID_WATCH_LIST_FLAG_MSG = "A recommend flag was provided for the watchlist mode. Valid watchlist mode flags: ['-l', '--list', '-a', '--add', '-u', '--update', '-d', '--delete']"
-INVALID_RECOMMEND_FLAG_MSG = "A watchlist flag was provided for the recommend mode. Valid recommend mode flags: ['-g', '--genres', '-ms', '--min-score', '-me', '--max-episodes', '-f', '--formats', '-s', '--status']"
+INVALID_WATCH_LIST_FLAG_MSG = "A recommend flag was provided for the watchlist mode. Valid watchlist mode flags: ['-l', '--list', '-a', '--add', '-u', '--update', '-d', '--delete', '-ws', '--watch-status', '-ms', '--min-score', '-so', '--sort', '--limit', '--after']"
+LIST_ONLY_FLAG_MSG = "The ['-ws', '--watch-status', '-ms', '--min-score', '-so', '--sort', '--limit', '--after'] flags can only be used with -l"
+INVALID_LIMIT_MSG = "The --limit flag needs a number above 0"
+INVALID_RECOMMEND_FLAG_MSG = "A flag for another mode was provided for the recommend mode. Valid recommend mode flags: ['-g', '--genres', '-ms', '--min-score', '-me', '--max-episodes', '-f', '--formats', '-s', '--status', '-sa', '--sample', '-w', '--weighted', '-c', '--count', '-dv', '--diverse', '-r', '--rank']"
+INVALID_SYNC_FLAG_MSG = "The sync mode doesn't take any flags"
+INVALID_SIMILAR_FLAG_MSG = "The similar mode doesn't take any flags"
+INVALID_SERVE_FLAG_MSG = "The serve mode doesn't take any flags"
+DAEMON_STARTED_MSG = f"Serving the watchlist, recommend and similar modes on {DAEMON_SOCKET_PATH}. Press Ctrl+C to stop"
+DAEMON_DISCONNECTED_MSG = "The serve process stopped before the command finished"
+INVALID_API_FLAG_MSG = "The api mode only takes the ['--port'] and ['--workers'] flags"
+INVALID_WORKERS_MSG = "The --workers flag needs a number above 0"
+INVALID_BATCH_FLAG_MSG = "The batch mode reads its changes from stdin and doesn't take any flags"
+INVALID_BATCH_MSG = "Nothing was changed, because of these invalid entries:"
+EMPTY_BATCH_MSG = "No changes were given on stdin"
+MEDIA_ID_FLAG_MSG = "The ['-id', '--media-id'] flag needs one of -a, -u or -d, and the ['-sc', '--score'] flag needs -id"
+INVALID_IMPORT_FLAG_MSG = "The import mode only takes the ['-fi', '--file'] flag, which is required"
+INVALID_IMPORT_FILE_MSG = "The file couldn't be read as a MyAnimeList XML export or an AniList JSON export"
 INVALID_PROPERTIES_MSG = f"Invalid property provided. Valid Properties: {list(map(lambda property: property.lower(), VALID_PROPERTIES))}"
 INVALID_STATUS_MSG = f"Invalid status provided. Valid statuses: {list(map(lambda status: status.lower(), VALID_STATUSES))}"
\ No newline at end of file
@@ -0,0 +1,156 @@
+import io
+import os
+import sys
+import json
+import socket
+import traceback
+
+from types import SimpleNamespace
+from constants import DAEMON_SOCKET_PATH, DAEMON_OUTPUT_BUFFER, DAEMON_DISCONNECTED_MSG
+from helpers import formatted_score, formatted_status
+
+
+def serve(db, run_command, socket_path=DAEMON_SOCKET_PATH):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # A socket file left behind by a serve process that was killed would stop the new one from binding
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server.bind(socket_path)
+    server.listen()
+    terminal = None
+
+    try:
+        # Commands are run one at a time, since they all share the process's stdout, stdin and database connection
+        while True:
+            connection, _ = server.accept()
+
+            with connection, connection.makefile("rwb") as stream:
+                terminal = handle_connection(db, run_command, stream, terminal)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def handle_connection(db, run_command, stream, terminal):
+    request = read_message(stream)
+
+    if request is None:
+        return terminal
+
+    if request["terminal"] != terminal:
+        clear_color_caches()
+
+    output, input_stream = socket_streams(stream, request["terminal"])
+    stdout, stdin = sys.stdout, sys.stdin
+    sys.stdout, sys.stdin = output, input_stream
+
+    try:
+        run_command(db, request["argv"])
+    except SystemExit:
+        pass
+    except Exception:
+        # One failed command shouldn't take every later command down with it
+        traceback.print_exc(file=output)
+    finally:
+        sys.stdout, sys.stdin = stdout, stdin
+
+    try:
+        output.flush()
+        send_message(stream, {"done": True})
+    except OSError:
+        # The client went away before the command finished
+        pass
+
+    return request["terminal"]
+
+
+def clear_color_caches():
+    # Colored labels are cached, so they are built again whenever the colors a client can show change
+    formatted_score.cache_clear()
+    formatted_status.cache_clear()
+
+    # termcolor 2.5 and later also cache whether stdout can show colors. Until it is imported, nothing is cached
+    can_colorize = getattr(sys.modules.get("termcolor.termcolor"), "can_colorize", None)
+
+    if hasattr(can_colorize, "cache_clear"):
+        can_colorize.cache_clear()
+
+
+def socket_streams(stream, terminal):
+    buffer = []
+
+    def write(text):
+        buffer.append(text)
+
+        if sum(map(len, buffer)) > DAEMON_OUTPUT_BUFFER:
+            flush()
+
+        return len(text)
+
+    def flush():
+        # Output is sent in chunks rather than one message per print, and always before the client is asked for input
+        if buffer:
+            send_message(stream, {"output": "".join(buffer)})
+            buffer.clear()
+
+    def readline():
+        flush()
+        send_message(stream, {"read": True})
+        reply = read_message(stream)
+
+        return reply["line"] if reply else ""
+
+    def fileno():
+        # termcolor and others only fall back to isatty for io.UnsupportedOperation, the error io streams raise here
+        raise io.UnsupportedOperation("The output is sent over a socket")
+
+    output = SimpleNamespace(write=write, flush=flush, fileno=fileno, isatty=lambda: terminal)
+    input_stream = SimpleNamespace(readline=readline, fileno=fileno, isatty=lambda: terminal)
+
+    return output, input_stream
+
+
+def forward_command(argv, output=None, input_stream=None, socket_path=DAEMON_SOCKET_PATH):
+    output = output or sys.stdout
+    input_stream = input_stream or sys.stdin
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # Without a serve process to forward to, the command is run by this process instead
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return False
+
+    with client, client.makefile("rwb") as stream:
+        try:
+            send_message(stream, {"argv": argv, "terminal": output.isatty()})
+
+            while (message := read_message(stream)) and "done" not in message:
+                if "output" in message:
+                    output.write(message["output"])
+                    output.flush()
+                elif "read" in message:
+                    send_message(stream, {"line": input_stream.readline()})
+        except OSError:
+            message = None
+
+        if message is None:
+            print(DAEMON_DISCONNECTED_MSG, file=output)
+
+    return True
+
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+
+    return json.loads(line) if line else None
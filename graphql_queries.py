@@ -0,0 +1,53 @@
+import os
+import re
+
+from functools import cache
+
+QUERIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries")
+
+# Each use of the API gets its own operation, which only selects the fragments it displays
+QUERY_FILES = {
+    "add_search": "media_pages.graphql",
+    "recommend_candidates": "media_candidates.graphql",
+    "rank_candidates": "media_rank_candidates.graphql",
+    "rank_details": "media_rank_ids.graphql",
+    "list_detail": "media.graphql",
+    "list_details": "media_ids.graphql",
+    "detail_card": "media_details.graphql",
+    "detail_cards": "media_details_ids.graphql",
+    "catalog_sync": "media_sync.graphql",
+    "import_ids": "media_import.graphql"
+}
+
+
+@cache
+def get_query(name):
+    operation = read_query_file(QUERY_FILES[name])
+    fragments = get_fragments()
+
+    return "\n".join([operation, *(fragments[fragment] for fragment in used_fragments(operation, fragments))])
+
+
+@cache
+def get_fragments():
+    fragments_file = read_query_file("fragments.graphql")
+    definitions = re.split(r"\n\s*\n(?=fragment )", fragments_file.strip())
+
+    return {re.match(r"fragment (\w+)", definition).group(1): definition for definition in definitions}
+
+
+def used_fragments(text, fragments, found=None):
+    found = found if found is not None else []
+
+    # Fragments can spread other fragments, so keep following them until every one of them is found
+    for name in re.findall(r"\.\.\.(\w+)", text):
+        if name not in found:
+            found.append(name)
+            used_fragments(fragments[name], fragments, found)
+
+    return found
+
+
+def read_query_file(file_name):
+    with open(os.path.join(QUERIES_DIR, file_name), "r") as file:
+        return file.read().strip()
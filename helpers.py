@@ -1,36 +1,126 @@
-import requests
 import random
+import json
+import time
 import re
 
-from termcolor import colored
-from tabulate import tabulate
-from constants import URL
-from sql_queries import watch_list_query
+from functools import cache
+from table_renderer import print_table
+from anilist_client import post_query
+from graphql_queries import get_query
+from constants import (
+    PAGE_SIZE,
+    ID_BATCH_SIZE,
+    SAMPLE_ATTEMPTS,
+    MAX_EXCLUDED_IDS,
+    PAGE_CONCURRENCY,
+    MEDIA_CACHE_TTLS,
+    DEFAULT_MEDIA_CACHE_TTL,
+    MEDIA_CACHE_MAX_ENTRIES,
+    SQL_VARIABLE_BATCH_SIZE
+)
+from sql_queries import (
+    watch_list_entry_query,
+    watch_list_page_query,
+    watch_list_status_condition,
+    watch_list_min_score_condition,
+    watch_list_sorts,
+    watch_list_query,
+    cached_media_query,
+    touch_cached_media_query,
+    upsert_cached_media_query,
+    evict_cached_media_query
+)
+
+def paginated_response(query, variables, concurrency=PAGE_CONCURRENCY):
+    from concurrent.futures import ThreadPoolExecutor
+
+    first_page = get_page(query, variables, 1)
+    data = first_page["media"]
+    last_page = first_page["pageInfo"]["lastPage"]
+
+    # The first page tells us how many pages there are, so the rest can be requested in parallel.
+    # executor.map yields the pages in the order they were requested, regardless of when they finish
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        pages = list(executor.map(lambda page_num: get_page(
+            query, variables, page_num), range(2, last_page + 1)))
+
+    for page in pages:
+        data.extend(page["media"])
+
+    # lastPage can fall behind when new anime are added mid-crawl, so finish off any remaining pages
+    page = pages[-1] if pages else first_page
+    page_num = last_page
+
+    while page["pageInfo"]["hasNextPage"]:
+        page_num += 1
+        page = get_page(query, variables, page_num)
+        data.extend(page["media"])
+
+    return data
 
-def paginated_response(query, variables):
-    data = []
+
+def iter_pages(query, variables):
     page_num = 1
 
-    first_response = requests.post(URL, json={"query": query, "variables": {
-                                   "page": page_num, **variables}}).json()
-    data.extend(first_response["data"]["Page"]["media"])
+    # Pages are only requested as the caller asks for them, so the first page can be shown straight away
+    while True:
+        page = get_page(query, variables, page_num)
+        yield page["media"]
 
-    has_next_page = first_response["data"]["Page"]["pageInfo"]["hasNextPage"]
+        if not page["pageInfo"]["hasNextPage"]:
+            return
 
-    while has_next_page:
         page_num += 1
-        response = requests.post(URL, json={"query": query, "variables": {
-                                 "page": page_num, **variables}}).json()
 
-        data.extend(response["data"]["Page"]["media"])
-        has_next_page = response["data"]["Page"]["pageInfo"]["hasNextPage"]
 
-    return data
+def get_page(query, variables, page_num):
+    response = post_query(query, {"page": page_num, **variables})
+
+    return response["data"]["Page"]
+
+
+def get_total_anime(query, variables):
+    # A single item page is enough to read the total number of matches
+    return get_page(query, {**variables, "perPage": 1}, 1)["pageInfo"]["total"]
+
+
+def sample_unwatched_anime(query, variables, total, watched_ids, attempts=SAMPLE_ATTEMPTS):
+    pages = {}
+
+    # Picking a random position and trying again whenever it lands on a watched anime
+    # keeps every unwatched anime equally likely to be chosen
+    for _ in range(attempts):
+        position = random.randrange(total)
+        page_num = position // PAGE_SIZE + 1
+
+        if page_num not in pages:
+            pages[page_num] = get_page(query, variables, page_num)["media"]
+
+        page = pages[page_num]
+
+        # The total can shrink between requests, leaving the position past the end of the page
+        if position % PAGE_SIZE >= len(page):
+            continue
+
+        anime = page[position % PAGE_SIZE]
+
+        if anime["id"] not in watched_ids:
+            return anime
+
+    return None
+
+
+def get_watched_anime_ids(db):
+    return {row[2] for row in db.execute(watch_list_query)}
 
-def filter_out_watched_anime(db, all_anime):
-    watch_list_anime_ids = [row[2] for row in db.execute(watch_list_query)]
 
-    return list(filter(lambda anime: anime["id"] not in watch_list_anime_ids, all_anime))
+def get_excluded_ids(watched_ids):
+    # Very long watch lists would make the query too large, so only part of it is excluded by AniList
+    return sorted(watched_ids)[:MAX_EXCLUDED_IDS]
+
+
+def filter_out_watched_anime(watched_ids, all_anime):
+    return [anime for anime in all_anime if anime["id"] not in watched_ids]
 
 def get_all_watch_list_anime(db):
     cursor = db.execute(watch_list_query)
@@ -38,25 +128,147 @@ def get_all_watch_list_anime(db):
     return [row for row in cursor]
 
 
+def get_watch_list_page(db, status=None, min_score=None, sort="score", limit=None, after=None):
+    order, after_condition = watch_list_sorts[sort]
+    conditions = []
+    values = []
+
+    if status:
+        conditions.append(watch_list_status_condition)
+        values.append(status)
+    if min_score is not None:
+        conditions.append(watch_list_min_score_condition)
+        values.append(min_score)
+    if after is not None:
+        after_entry = db.execute(watch_list_entry_query, (after,)).fetchone()
+
+        if after_entry is None:
+            return None
+
+        conditions.append(after_condition)
+        values.extend(keyset_values(sort, after_entry))
+
+    where = f"WHERE {" AND ".join(conditions)}" if conditions else ""
+    query = watch_list_page_query.format(where=where, order=order)
+
+    # One extra entry is read to know whether there is another page. A limit of -1 reads every entry
+    return [row for row in db.execute(query, (*values, -1 if limit is None else limit + 1))]
+
+
+def keyset_values(sort, entry):
+    id, title, _, score, _ = entry
+
+    match sort:
+        case "score":
+            score = -1 if score is None else score
+            return [score, score, id]
+        case "title":
+            return [title, title, id]
+        case "added":
+            return [id]
+
+
 def view_watch_list_simple(records):
-    table_records = [table_record_for_viewing(
-        index, row) for index, row in enumerate(records)]
+    table_records = (table_record_for_viewing(
+        index, row) for index, row in enumerate(records))
     table_headers = ["", "Name", "Status", "Score"]
 
-    print(tabulate(table_records, headers=table_headers,
-          tablefmt="presto"), end="\n\n")
+    print_table(table_records, table_headers, end="\n\n")
+
+
+def get_single_anime(id, db=None):
+    if db:
+        cached_anime = get_cached_anime(db, [id])
+
+        if id in cached_anime:
+            return cached_anime[id]
+
+    query = get_query("list_detail")
+
+    response = post_query(query, {"id": id})
+    anime = response["data"]["Media"]
+
+    if db and anime:
+        cache_anime(db, [anime])
 
+    return anime
 
-def get_single_anime(id):
-    with open('./queries/media.graphql', 'r') as file:
-        query = file.read()
 
-    response = requests.post(
-        URL, json={"query": query, "variables": {"id": id}}).json()
+def get_anime_details(id):
+    query = get_query("detail_card")
 
-    return response["data"]["Media"]
+    return post_query(query, {"id": id})["data"]["Media"]
 
+
+def get_multiple_anime(ids, db=None):
+    query = get_query("list_details")
+
+    unique_ids = list(dict.fromkeys(ids))
+    anime = get_cached_anime(db, unique_ids) if db else {}
+    missing_ids = [id for id in unique_ids if id not in anime]
+    fetched_anime = get_anime_batches(query, missing_ids)
+
+    if db and fetched_anime:
+        cache_anime(db, fetched_anime)
+
+    anime.update({media["id"]: media for media in fetched_anime})
+
+    return anime
+
+
+def get_anime_batches(query, ids, id_variable="id_in"):
+    anime = []
+
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        response = post_query(query, {id_variable: batch})
+
+        anime.extend(response["data"]["Page"]["media"])
+
+    return anime
+
+
+def get_cached_anime(db, ids):
+    now = time.time()
+    cached_rows = []
+
+    for start in range(0, len(ids), SQL_VARIABLE_BATCH_SIZE):
+        batch = ids[start:start + SQL_VARIABLE_BATCH_SIZE]
+        placeholders = ", ".join("?" for _ in batch)
+        cursor = db.execute(cached_media_query.format(
+            placeholders=placeholders), (*batch, now))
+
+        cached_rows.extend(cursor)
+
+    # Refreshing the access time is what keeps frequently listed anime out of the LRU eviction
+    db.executemany(touch_cached_media_query, [(now, row[0]) for row in cached_rows])
+    db.commit()
+
+    return {row[0]: json.loads(row[1]) for row in cached_rows}
+
+
+def cache_anime(db, anime):
+    now = time.time()
+    records = [
+        (
+            media["id"],
+            json.dumps(media),
+            now + MEDIA_CACHE_TTLS.get(media.get("status"), DEFAULT_MEDIA_CACHE_TTL),
+            now
+        )
+        for media in anime
+    ]
+
+    db.executemany(upsert_cached_media_query, records)
+    db.execute(evict_cached_media_query, (MEDIA_CACHE_MAX_ENTRIES,))
+    db.commit()
+
+# Only a handful of scores and statuses exist, so each colored label is only built once
+@cache
 def formatted_score(score):
+    # termcolor is imported by the functions that color text, so commands that print nothing don't wait for it
+    from termcolor import colored
+
     result = "⭐️"
 
     if not score:
@@ -85,6 +297,8 @@ def get_anime_title(title_object):
 
 
 def formatted_recommended_anime(anime):
+    from termcolor import colored
+
     title = get_anime_title(anime["title"])
     score = formatted_score(anime["averageScore"])
     episodes = anime["episodes"]
@@ -128,6 +342,47 @@ def get_random_anime(list_of_anime):
     return list_of_anime[random_index]
 
 
+def get_random_sample(list_of_anime, count):
+    # Sampling positions works for NumPy arrays of index positions as well as lists of anime
+    random_indexes = random.sample(range(len(list_of_anime)), min(count, len(list_of_anime)))
+
+    return [list_of_anime[index] for index in random_indexes]
+
+
+def parse_selection(answer, count):
+    answer = answer.strip().lower()
+
+    if answer in ["all", "a"]:
+        return list(range(1, count + 1))
+    if answer in ["", "none", "n", "no"]:
+        return []
+
+    selection = []
+
+    try:
+        for part in answer.split(","):
+            # A range such as 7-20 picks every number from the first to the last
+            first, _, last = part.partition("-")
+            first, last = int(first), int(last or first)
+
+            # A reversed range such as 20-7 would pick nothing, leaving the rest of the selection to go ahead without it
+            if last < first:
+                return None
+
+            selection.extend(range(first, last + 1))
+    except ValueError:
+        return None
+
+    if len(selection) == 0:
+        return None
+
+    if any(number <= 0 or number > count for number in selection):
+        return None
+
+    # Picking the same anime twice only adds it once
+    return list(dict.fromkeys(selection))
+
+
 def format_record_for_watch_list(anime, anime_details, index):
     return [
         index + 1,
@@ -142,7 +397,10 @@ def format_record_for_watch_list(anime, anime_details, index):
     ]
 
 
+@cache
 def formatted_status(status):
+    from termcolor import colored
+
     match status:
         case "COMPLETED":
             return f"✅{colored(status.lower(), 'green')}"
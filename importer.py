@@ -0,0 +1,117 @@
+import gzip
+import json
+import time
+import xml.etree.ElementTree as ElementTree
+
+from constants import VALID_STATUSES, MAL_STATUSES, ANILIST_STATUSES, ANILIST_SCORE_SCALES
+from graphql_queries import get_query
+from helpers import get_anime_batches, get_anime_title
+from sql_queries import import_anime_query
+
+
+def import_watch_list(db, path):
+    start_time = time.perf_counter()
+    entries = read_import_file(path)
+
+    if entries is None:
+        return None
+
+    resolved_entries = resolve_import_entries(entries)
+    changes_before = db.total_changes
+
+    # Every entry goes in with a single statement and a single commit
+    with db:
+        db.executemany(import_anime_query, resolved_entries)
+
+    added_count = db.total_changes - changes_before
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "total": len(entries),
+        "added": added_count,
+        "skipped": len(resolved_entries) - added_count,
+        "not_found": len(entries) - len(resolved_entries),
+        "seconds": elapsed,
+        "per_second": len(entries) / elapsed if elapsed else 0
+    }
+
+
+def read_import_file(path):
+    opener = gzip.open if path.endswith(".gz") else open
+
+    try:
+        with opener(path, "rb") as file:
+            content = file.read()
+    except OSError:
+        return None
+
+    try:
+        if content.lstrip()[:1] in [b"{", b"["]:
+            return parse_anilist_export(json.loads(content))
+
+        return parse_mal_export(ElementTree.fromstring(content))
+    except (ValueError, ElementTree.ParseError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def parse_mal_export(root):
+    entries = []
+
+    for anime in root.iter("anime"):
+        status = MAL_STATUSES.get(anime.findtext("my_status", "").strip())
+
+        if status is None:
+            continue
+
+        score = int(anime.findtext("my_score", "0") or 0)
+        entries.append({
+            "mal_id": int(anime.findtext("series_animedb_id")),
+            # MyAnimeList scores go up to 10, and 0 means the anime wasn't scored
+            "score": score * 10 if score else None,
+            "status": status
+        })
+
+    return entries
+
+
+def parse_anilist_export(data):
+    # Accepts the MediaListCollection response AniList exports, with or without its data wrapper
+    data = data.get("data", data)
+    data = data.get("MediaListCollection", data)
+    # Scores are saved in whichever format the user picked, so an export without it can't be imported correctly
+    scale = ANILIST_SCORE_SCALES[data["user"]["mediaListOptions"]["scoreFormat"]]
+    entries = []
+
+    for entry in [entry for media_list in data["lists"] for entry in media_list["entries"]]:
+        status = ANILIST_STATUSES.get(entry.get("status"), entry.get("status"))
+        score = entry.get("score") or None
+
+        if status not in VALID_STATUSES:
+            continue
+
+        entries.append({
+            "id": entry.get("mediaId") or entry["media"]["id"],
+            "score": None if score is None else round(score * scale),
+            "status": status
+        })
+
+    return entries
+
+
+def resolve_import_entries(entries):
+    query = get_query("import_ids")
+    anilist_ids = list(dict.fromkeys(entry["id"] for entry in entries if "id" in entry))
+    mal_ids = list(dict.fromkeys(entry["mal_id"] for entry in entries if "mal_id" in entry))
+    # Ids are checked against AniList 50 at a time, instead of one request per entry
+    found_anime = get_anime_batches(query, anilist_ids) + get_anime_batches(query, mal_ids, "idMal_in")
+    anime_by_id = {anime["id"]: anime for anime in found_anime}
+    anime_by_mal_id = {anime["idMal"]: anime for anime in found_anime if anime["idMal"]}
+    resolved_entries = []
+
+    for entry in entries:
+        anime = anime_by_id.get(entry.get("id")) or anime_by_mal_id.get(entry.get("mal_id"))
+
+        if anime:
+            resolved_entries.append((anime["id"], get_anime_title(anime["title"]), entry["score"], entry["status"]))
+
+    return resolved_entries
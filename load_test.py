@@ -0,0 +1,104 @@
+import sys
+import time
+import argparse
+import threading
+import http.client
+
+from urllib.parse import urlsplit
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="load_test", description="Send requests to the api mode's HTTP server and report how fast it answers them")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8000/watchlist",
+                        help="the endpoint to request (http://127.0.0.1:8000/watchlist by default)")
+    parser.add_argument("-n", "--requests", action="store", type=int, default=2000,
+                        help="the total number of requests to send (2000 by default)")
+    parser.add_argument("-c", "--concurrency", action="store", type=int, default=8,
+                        help="the number of clients sending requests at the same time (8 by default)")
+
+    args = parser.parse_args()
+    report = run_load_test(args.url, args.requests, args.concurrency)
+
+    print(format_report(report))
+
+    if report["errors"]:
+        sys.exit(1)
+
+
+def run_load_test(url, request_count, concurrency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    # Each client takes the next request number until they have all been sent
+    remaining = iter(range(request_count))
+
+    def client():
+        url_parts = urlsplit(url)
+        # Every client keeps one connection open for all of its requests, like a browser would
+        connection = http.client.HTTPConnection(url_parts.hostname, url_parts.port or 80)
+        path = url_parts.path + (f"?{url_parts.query}" if url_parts.query else "")
+
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+
+            start_time = time.perf_counter()
+
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                error = None if response.status < 500 else f"HTTP {response.status}"
+            except (OSError, http.client.HTTPException) as exception:
+                error = str(exception) or type(exception).__name__
+                connection.close()
+
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+
+                if error:
+                    errors.append(error)
+
+        connection.close()
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "per_second": len(latencies) / elapsed if elapsed else 0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99)
+    }
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+
+    # Nearest-rank percentile: the smallest value that at least this percent of the values are at or below
+    rank = max(-(-len(sorted_values) * percent // 100), 1)
+
+    return sorted_values[int(rank) - 1]
+
+
+def format_report(report):
+    return (f"{report["requests"]} requests in {report["seconds"]:.2f}s ({report["errors"]} errors)\n"
+            f"Requests per second: {report["per_second"]:.0f}\n"
+            f"Latency p50: {report["p50"] * 1000:.2f}ms, p99: {report["p99"] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+from constants import DUPLICATES_REMOVED_MSG
+from sql_queries import (
+    user_version_query,
+    set_user_version_query,
+    enable_wal_query,
+    create_table_query,
+    create_media_cache_table_query,
+    create_catalog_table_query,
+    create_sync_state_table_query,
+    create_candidate_pool_table_query,
+    create_similarity_table_query,
+    create_similarity_bucket_index_query,
+    create_catalog_updated_at_index_query,
+    merge_duplicate_anime_query,
+    delete_duplicate_anime_query,
+    create_watch_list_media_id_index_query,
+    create_watch_list_score_index_query,
+    create_watch_list_status_index_query,
+    drop_watch_list_score_index_query,
+    drop_watch_list_status_index_query,
+    create_watch_list_sorted_score_index_query,
+    create_watch_list_title_index_query,
+    create_watch_list_status_score_index_query,
+    create_watch_list_status_title_index_query,
+    create_watch_list_status_added_index_query
+)
+
+# Each migration moves the database up one schema version. New migrations are only ever added to the end
+MIGRATIONS = [
+    # Databases created before migrations existed already have some of these tables, hence IF NOT EXISTS
+    [
+        create_table_query,
+        create_media_cache_table_query,
+        create_catalog_table_query,
+        create_sync_state_table_query,
+        create_candidate_pool_table_query,
+        create_similarity_table_query,
+        create_similarity_bucket_index_query,
+        create_catalog_updated_at_index_query
+    ],
+    [
+        merge_duplicate_anime_query,
+        delete_duplicate_anime_query,
+        create_watch_list_media_id_index_query,
+        create_watch_list_score_index_query,
+        create_watch_list_status_index_query
+    ],
+    # One index for each sort of the watch list, with and without a status filter
+    [
+        drop_watch_list_score_index_query,
+        drop_watch_list_status_index_query,
+        create_watch_list_sorted_score_index_query,
+        create_watch_list_title_index_query,
+        create_watch_list_status_score_index_query,
+        create_watch_list_status_title_index_query,
+        create_watch_list_status_added_index_query
+    ]
+]
+
+
+def migrate(db):
+    version = db.execute(user_version_query).fetchone()[0]
+
+    if version >= len(MIGRATIONS):
+        return
+
+    # WAL lets the watch list be read while it is being written to. The setting is saved in the database file,
+    # and it can't be changed inside a transaction
+    db.execute(enable_wal_query)
+
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        # A migration that fails part way is rolled back, so it runs again from the start next time
+        with db:
+            db.execute("BEGIN")
+
+            for statement in statements:
+                cursor = db.execute(statement)
+
+                if statement == delete_duplicate_anime_query and cursor.rowcount > 0:
+                    print(DUPLICATES_REMOVED_MSG.format(count=cursor.rowcount))
+
+            db.execute(set_user_version_query.format(version=number))
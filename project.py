@@ -1,18 +1,30 @@
+import sys
 import sqlite3
 import argparse
+import json
+import csv
 
-
-from tabulate import tabulate
-from sql_queries import create_table_query, add_anime_query, watch_list_query, update_query, delete_query
+from table_renderer import print_table
+from graphql_queries import get_query
+from sql_queries import add_anime_query, update_query, delete_query
+from migrations import migrate
 from constants import (
     VALID_FORMATS,
     VALID_GENRES,
     VALID_PROPERTIES,
     VALID_STATUSES,
     VALID_MEDIA_STATUSES,
+    PAGE_SIZE,
+    ID_BATCH_SIZE,
+    RANK_COUNT,
+    DIVERSITY_SHORTLIST,
     INVALID_OPTION_MSG,
+    INVALID_SELECTION_MSG,
     INVALID_CONFIRMATION_MSG,
     WATCH_LIST_EMPTY_MSG,
+    NO_MATCHING_ENTRIES_MSG,
+    LIST_ONLY_FLAG_MSG,
+    INVALID_LIMIT_MSG,
     INVALID_WATCH_LIST_FLAG_MSG,
     INVALID_RECOMMEND_FLAG_MSG,
     INVALID_PROPERTIES_MSG,
@@ -20,30 +32,112 @@ from constants import (
     INVALID_SCORE_MSG,
     NO_RECOMMENDATIONS_FOUND_MSG,
     NO_UNIQUE_RECOMMENDATION_FOUND_MSG,
+    NO_RATED_ANIME_MSG,
+    NO_SIMILAR_ANIME_MSG,
+    CATALOG_NOT_SYNCED_MSG,
     CANCEL_DELETE_MSG,
-    MULTIPLE_FLAGS_ERR_MSG
+    NO_MORE_RESULTS_MSG,
+    MULTIPLE_FLAGS_ERR_MSG,
+    API_ERROR_MSG,
+    INVALID_SYNC_FLAG_MSG,
+    INVALID_SIMILAR_FLAG_MSG,
+    INVALID_IMPORT_FLAG_MSG,
+    INVALID_SERVE_FLAG_MSG,
+    INVALID_API_FLAG_MSG,
+    INVALID_WORKERS_MSG,
+    HTTP_PORT,
+    HTTP_WORKERS,
+    DB_PATH,
+    DAEMON_STARTED_MSG,
+    FORWARDED_MODES,
+    CANCEL_UPDATE_MSG,
+    INVALID_BATCH_FLAG_MSG,
+    INVALID_BATCH_MSG,
+    EMPTY_BATCH_MSG,
+    MEDIA_ID_FLAG_MSG,
+    INVALID_IMPORT_FILE_MSG,
+    SYNC_STARTED_MSG
 )
 from helpers import (
-    get_single_anime,
+    get_multiple_anime,
     paginated_response,
+    iter_pages,
+    get_total_anime,
+    sample_unwatched_anime,
+    get_watched_anime_ids,
+    get_excluded_ids,
+    get_anime_details,
+    get_anime_batches,
+    formatted_score,
     format_response_for_add,
     get_anime_title,
     formatted_recommended_anime,
     get_random_anime,
+    get_random_sample,
+    parse_selection,
     format_record_for_watch_list,
     filter_out_watched_anime,
     get_all_watch_list_anime,
+    get_watch_list_page,
     view_watch_list_simple,
 )
+from catalog import (
+    sync_catalog,
+    is_catalog_synced,
+    get_catalog_anime,
+    get_catalog_anime_batch,
+    iter_catalog_pages
+)
+from anilist_client import request_errors
+from daemon import serve, forward_command
+from batch import read_changes, validate_changes, apply_changes
+from weighted_sampling import get_candidate_pool, candidate_weights, pick_weighted
+
+# numpy, tabulate, requests and the modules built on them take longer to import than most commands take to run,
+# so they are only imported by the functions that need them
 
 
 def main():
-    conn = sqlite3.connect("anime.db")
-    conn.execute(create_table_query)
+    args = get_args()
+
+    # When the serve mode is running, it runs the command with its caches and connections already warm
+    if args.mode in FORWARDED_MODES and forward_command(sys.argv[1:]):
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn)
+    run_command(conn, args)
+    conn.close()
+
+
+def run_command(db, args):
+    try:
+        match args.mode:
+            case "watchlist":
+                handle_watch_list(db, args)
+            case "recommend":
+                handle_recommend(db, args)
+            case "sync":
+                handle_sync(db, args)
+            case "similar":
+                handle_similar(db, args)
+            case "import":
+                handle_import(db, args)
+            case "batch":
+                handle_batch(db, args)
+            case "serve":
+                handle_serve(db, args)
+            case "api":
+                handle_api(db, args)
+    except request_errors():
+        print(API_ERROR_MSG)
+
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser(
         prog="WatchListRecommender", description="Add / Update your own anime watch list & reccommend new anime to watch")
     parser.add_argument("mode", choices=[
-                        "watchlist", "recommend"], help="The feature mode you'd like to access", metavar="mode {watchlist,recommend}")
+                        "watchlist", "recommend", "sync", "similar", "import", "batch", "serve", "api"], help="The feature mode you'd like to access", metavar="mode {watchlist,recommend,sync,similar,import,batch,serve,api}")
     parser.add_argument("-l", "--list", action="store_true",
                         help="watchlist: view your currentl watch list")
     parser.add_argument("-a", "--add", action="store_true",
@@ -52,52 +146,202 @@ def main():
                         help="watchlist: kicks off process to update an entry in your watchlist")
     parser.add_argument("-d", "--delete", action="store_true",
                         help="watchlist: kicks off process to delete and entry in your watchlist")
+    parser.add_argument("-id", "--media-id", action="store", type=int,
+                        help="watchlist -a/-u/-d: the AniList id of the anime to change, without any prompts")
+    parser.add_argument("-sc", "--score", action="store", type=int,
+                        help="watchlist -a/-u -id: the score to give the anime (0-100)")
+    parser.add_argument("-fi", "--file", action="store",
+                        help="import: the MyAnimeList XML or AniList JSON export to add to your watch list")
+    parser.add_argument("--port", action="store", type=int,
+                        help=f"api: the port the HTTP API listens on ({HTTP_PORT} by default)")
+    parser.add_argument("--workers", action="store", type=int,
+                        help=f"api: the number of requests the HTTP API handles at once ({HTTP_WORKERS} by default)")
+    parser.add_argument("-ws", "--watch-status", action="store", type=str.upper, choices=VALID_STATUSES,
+                        help="watchlist -l: only list the entries with this status")
+    parser.add_argument("-so", "--sort", action="store", type=str.lower, choices=["score", "title", "added"],
+                        help="watchlist -l: the order the entries are listed in (score by default)")
+    parser.add_argument("--limit", action="store", type=int,
+                        help="watchlist -l: the most entries to list at once")
+    parser.add_argument("--after", action="store", type=int,
+                        help="watchlist -l: only list the entries after the entry with this id, given at the end of each page")
     parser.add_argument("-g", "--genres", action="extend", nargs="*", choices=VALID_GENRES,
                         type=str.title, help="recommend: the genres for the anime")
     parser.add_argument("-ms", "--min-score", action="store", nargs="?",
-                        type=int, help="recommend: the minimum scorevof the anime (1-100)")
+                        type=int, help="recommend: the minimum scorevof the anime (1-100). watchlist -l: the minimum score of the entries")
     parser.add_argument("-me", "--max-episodes", action="store", nargs="?", type=int,
                         help="recommend: the maximum amount of episode the anime is allowed to have")
     parser.add_argument("-f", "--formats", action="extend", nargs="*", choices=VALID_FORMATS,
                         type=str.upper, help="recommend: the media formats for the anime")
     parser.add_argument("-s", "--status", action="store", nargs="?", type=str.upper, choices=VALID_MEDIA_STATUSES,
                         help="recommend: the status of the anime")
+    parser.add_argument("-sa", "--sample", action="store_true",
+                        help="recommend: pick from a few random pages instead of downloading every anime that matches")
+    parser.add_argument("-w", "--weighted", action="extend", nargs="*", choices=["score", "popularity"], type=str.lower,
+                        help="recommend: pick anime with a higher score and/or popularity more often (score by default)")
+    parser.add_argument("-c", "--count", action="store", type=int, default=None,
+                        help="recommend: the number of anime to recommend at once")
+    parser.add_argument("-dv", "--diverse", action="store_true",
+                        help="recommend: make the recommended anime as different from each other as possible")
+    parser.add_argument("-r", "--rank", action="store_true",
+                        help="recommend: list the anime that are most similar to the anime you scored highly")
 
-    args = parser.parse_args()
-    
-    match args.mode:
-        case "watchlist":
-            handle_watch_list(conn, args)
-        case "recommend":
-            handle_recommend(conn, args)
-
-    conn.close()
+    return parser.parse_args(argv)
 
 
 def handle_recommend(db, args):
-    if args.list or args.update or args.add or args.delete:
+    if (args.list or args.update or args.add or args.delete or args.watch_status or args.sort or args.limit is not None or args.after is not None
+            or args.media_id is not None or args.score is not None or args.file or args.port is not None or args.workers is not None):
         return print(INVALID_RECOMMEND_FLAG_MSG)
+    if args.rank:
+        return get_ranked_anime(
+            db=db,
+            genres=args.genres,
+            min_score=args.min_score,
+            max_episodes=args.max_episodes,
+            formats=args.formats,
+            status=args.status,
+            count=max(args.count or RANK_COUNT, 1)
+        )
     get_recommended_anime(
         db=db,
         genres=args.genres,
         min_score=args.min_score,
         max_episodes=args.max_episodes,
         formats=args.formats,
-        status=args.status
+        status=args.status,
+        sample=args.sample,
+        # -w on its own gives an empty list, which still turns weighting on
+        weighted_by=None if args.weighted is None else args.weighted or ["score"],
+        count=max(args.count or 1, 1),
+        diverse=args.diverse
     )
 
 
-def handle_watch_list(db, args):
+def handle_sync(db, args):
+    # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
+    if any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] != "mode"):
+        return print(INVALID_SYNC_FLAG_MSG)
+
+    from candidate_index import build_candidate_index
+    from similarity_index import update_similarity_index
+
+    print(SYNC_STARTED_MSG)
+    synced_count = sync_catalog(db)
+    build_candidate_index(db)
+    update_similarity_index(db)
+    print(f"Synced {synced_count} anime into the local catalog")
+
+
+def handle_similar(db, args):
+    # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
+    if any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] != "mode"):
+        return print(INVALID_SIMILAR_FLAG_MSG)
+
+    find_similar_anime(db)
+
+
+def handle_serve(db, args):
+    # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
+    if any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] != "mode"):
+        return print(INVALID_SERVE_FLAG_MSG)
+
+    print(DAEMON_STARTED_MSG)
+    serve(db, lambda db, argv: run_command(db, get_args(argv)))
+
+
+def handle_api(db, args):
+    # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
+    if any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] not in ["mode", "port", "workers"]):
+        return print(INVALID_API_FLAG_MSG)
+    elif args.workers is not None and args.workers < 1:
+        return print(INVALID_WORKERS_MSG)
+
+    from api_server import serve_api
+
+    port = args.port or HTTP_PORT
+    workers = args.workers or HTTP_WORKERS
+
+    print(f"Serving the HTTP API on http://127.0.0.1:{port} with {workers} workers. Press Ctrl+C to stop")
+    serve_api(DB_PATH, port, workers)
+
+
+def handle_batch(db, args):
+    # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
+    if any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] != "mode"):
+        return print(INVALID_BATCH_FLAG_MSG)
+
+    try:
+        rows = read_changes(sys.stdin.read())
+    except (ValueError, csv.Error) as error:
+        return print(f"{INVALID_BATCH_MSG}\n{error}")
+
+    apply_batch(db, rows)
+
+
+def apply_batch(db, rows):
+    if len(rows) == 0:
+        return print(EMPTY_BATCH_MSG)
+
+    changes, errors = validate_changes(rows)
+
+    # A batch with any invalid change isn't applied at all, so it can be fixed and run again as a whole
+    if errors:
+        return print("\n".join([INVALID_BATCH_MSG, *errors]))
+
+    report = apply_changes(db, changes)
+
+    print(f"Added {report["added"]}, updated {report["updated"]} and deleted {report["deleted"]} anime")
+
+    if report["skipped"]:
+        print(f"Skipped {report["skipped"]} anime that were already in your watch list")
+    if report["not_found"]:
+        print(f"Skipped {report["not_found"]} anime that couldn't be found on AniList")
+
+
+def handle_import(db, args):
     # The first arg of args._get_kwargs() is the argument's name and the second is the value of the argument
-    argument_count = len(list(filter(lambda argument: argument[1] not in [False, None], args._get_kwargs())))
-    
-    if args.genres or args.formats or args.status or args.min_score or args.max_episodes:
+    if not args.file or any(argument[1] not in [False, None] for argument in args._get_kwargs() if argument[0] not in ["mode", "file"]):
+        return print(INVALID_IMPORT_FLAG_MSG)
+
+    from importer import import_watch_list
+
+    report = import_watch_list(db, args.file)
+
+    if report is None:
+        return print(INVALID_IMPORT_FILE_MSG)
+
+    print(f"Imported {report["added"]} of {report["total"]} anime in {report["seconds"]:.1f}s "
+          f"({report["per_second"]:.0f} entries per second)")
+
+    if report["skipped"]:
+        print(f"Skipped {report["skipped"]} anime that were already in your watch list")
+    if report["not_found"]:
+        print(f"Skipped {report["not_found"]} anime that couldn't be found on AniList")
+
+
+def handle_watch_list(db, args):
+    action_count = len([flag for flag in [args.list, args.add, args.update, args.delete] if flag])
+    list_flags = [args.min_score, args.sort, args.limit, args.after]
+
+    if args.genres or args.formats or args.status or args.max_episodes or args.sample or args.rank or args.weighted is not None or args.count or args.diverse:
         return print(INVALID_WATCH_LIST_FLAG_MSG)
-    elif argument_count > 2:
+    elif action_count > 1:
         return print(MULTIPLE_FLAGS_ERR_MSG)
+    elif not args.list and (any(flag is not None for flag in list_flags) or (args.watch_status and args.media_id is None)):
+        return print(LIST_ONLY_FLAG_MSG)
+    elif args.limit is not None and args.limit < 1:
+        return print(INVALID_LIMIT_MSG)
+    elif (args.media_id is not None and (args.list or action_count == 0)) or (args.score is not None and args.media_id is None):
+        return print(MEDIA_ID_FLAG_MSG)
+
+    if args.media_id is not None:
+        # With a media id, the change is made straight away instead of going through the prompts
+        action = "add" if args.add else "update" if args.update else "delete"
+        row = {"action": action, "media_id": args.media_id, "status": args.watch_status, "score": args.score}
+        return apply_batch(db, [{key: value for key, value in row.items() if value is not None}])
 
     if args.list:
-        view_watch_list(db)
+        view_watch_list(db, args.watch_status, args.min_score, args.sort or "score", args.limit, args.after)
     elif args.add:
         add_anime_to_watch_list(db)
     elif args.update:
@@ -106,7 +350,7 @@ def handle_watch_list(db, args):
         delete_anime_in_watch_list(db)
 
 
-def get_recommended_anime(db, genres, min_score, max_episodes, formats, status):
+def recommend_variables(genres, min_score, max_episodes, formats, status):
     variables = {
         "genre_in": genres,
         "averageScore_greater": min_score,
@@ -115,23 +359,24 @@ def get_recommended_anime(db, genres, min_score, max_episodes, formats, status):
         "status": status or "FINISHED"
     }
 
-    filtered_variables = {key: value for key,
-                          value in variables.items() if value}
+    return {key: value for key, value in variables.items() if value}
 
-    with open("./queries/media_pages.graphql") as file:
-        query = file.read()
 
-    response = paginated_response(query, filtered_variables)
+def get_recommended_anime(db, genres, min_score, max_episodes, formats, status, sample=False, weighted_by=None,
+                          count=1, diverse=False):
+    filtered_variables = recommend_variables(genres, min_score, max_episodes, formats, status)
+    candidates, offline = pick_recommendations(db, filtered_variables, sample, weighted_by, count, diverse)
 
-    if len(response) == 0:
-        return print(NO_RECOMMENDATIONS_FOUND_MSG)
+    if not candidates:
+        return
 
-    filtered_response = filter_out_watched_anime(db, response)
+    if count > 1:
+        return add_recommended_anime(db, candidates, offline)
 
-    if len(filtered_response) == 0:
-        return print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+    # Candidates only carry their id, score and popularity. The full details are only loaded for the chosen anime
+    candidate = candidates[0]
+    random_anime = get_catalog_anime(db, candidate["id"]) if offline else get_anime_details(candidate["id"])
 
-    random_anime = get_random_anime(filtered_response)
     recommended_anime = formatted_recommended_anime(random_anime)
     print(recommended_anime)
 
@@ -150,54 +395,442 @@ def get_recommended_anime(db, genres, min_score, max_episodes, formats, status):
             print(INVALID_CONFIRMATION_MSG)
 
 
-def view_watch_list(db):
-    cursor = db.execute(watch_list_query)
-    anime = [row for row in cursor]
+def pick_recommendations(db, variables, sample=False, weighted_by=None, count=1, diverse=False):
+    watched_ids = get_watched_anime_ids(db)
+
+    offline = is_catalog_synced(db)
+    # Diverse picks are the most varied anime out of a larger random shortlist
+    pick_count = max(count, DIVERSITY_SHORTLIST) if diverse else count
+
+    if offline:
+        candidates = get_catalog_candidates(db, variables, watched_ids, weighted_by, pick_count, sample)
+    elif weighted_by:
+        candidates = get_weighted_candidates(db, variables, watched_ids, weighted_by, pick_count)
+    else:
+        candidates = get_online_candidates(variables, watched_ids, sample, pick_count)
+
+    if candidates and diverse:
+        candidates = diversify_candidates(db, candidates, count, offline)
+
+    return candidates, offline
+
+
+def get_recommendation_details(db, candidates, offline):
+    ids = [candidate["id"] for candidate in candidates]
+    # Every recommendation's details come from a single catalog query or a single batch request
+    details = get_catalog_anime_batch(db, ids) if offline else get_anime_batches(get_query("detail_cards"), ids)
+    details_by_id = {anime["id"]: anime for anime in details}
+
+    return [details_by_id[id] for id in ids if id in details_by_id]
+
+
+def add_recommended_anime(db, candidates, offline):
+    recommended_anime = get_recommendation_details(db, candidates, offline)
+
+    for index, anime in enumerate(recommended_anime):
+        print(f"{index + 1}.{formatted_recommended_anime(anime)}")
+
+    while True:
+        selection = parse_selection(input(
+            "Which of these anime would you like to add to your watch list? (e.g. 1,3, all or none) "), len(recommended_anime))
+
+        if selection is not None:
+            break
+
+        print(INVALID_SELECTION_MSG)
+
+    if len(selection) == 0:
+        return
+
+    selected_anime = [recommended_anime[number - 1] for number in selection]
+
+    # All of the chosen anime are added in one transaction
+    with db:
+        db.executemany(add_anime_query, [
+            (anime["id"], get_anime_title(anime["title"]), None, "PLAN TO WATCH") for anime in selected_anime
+        ])
+
+    print(f"Added {", ".join(get_anime_title(anime["title"]) for anime in selected_anime)} to your watch list")
+
+
+def random_candidates(candidates, count):
+    if count == 1:
+        return [get_random_anime(candidates)]
+
+    return get_random_sample(candidates, count)
+
+
+def diversify_candidates(db, candidates, count, offline):
+    from candidate_index import get_candidate_index, find_index_positions
+    from ranking import diversify, feature_matrix_from_anime, feature_matrix_from_index
+
+    ids = [candidate["id"] for candidate in candidates]
+
+    if offline:
+        index = get_candidate_index(db)
+        features = feature_matrix_from_index(index, find_index_positions(index, ids))
+    else:
+        # The candidate queries only select ids, scores and popularity, so the shortlist's genres and studios
+        # are fetched in one batch
+        features_by_id = {anime["id"]: anime for anime in get_anime_batches(get_query("rank_details"), ids)}
+        candidates = [candidate for candidate in candidates if candidate["id"] in features_by_id]
+        features = feature_matrix_from_anime([features_by_id[candidate["id"]] for candidate in candidates])
+
+    relevance = [(candidate["averageScore"] or 0) / 100 for candidate in candidates]
+
+    return [candidates[position] for position in diversify(features, relevance, count)]
+
+
+def get_online_candidates(variables, watched_ids, sample, count=1):
+    query = get_query("recommend_candidates")
+    query_variables = {**variables,
+                       "id_not_in": get_excluded_ids(watched_ids)} if watched_ids else variables
+
+    if sample:
+        total = get_total_anime(query, query_variables)
+
+        if total == 0:
+            print(no_recommendations_msg(query, variables, watched_ids))
+            return None
+
+        candidates = []
+
+        while len(candidates) < count:
+            # Anime that were already picked are skipped just like watched ones
+            candidate = sample_unwatched_anime(
+                query, query_variables, total, watched_ids | {anime["id"] for anime in candidates})
+
+            if not candidate:
+                break
+
+            candidates.append(candidate)
+
+        if len(candidates) == count:
+            return candidates
+
+    # Without sampling, or when every sampled anime was already watched, go through every match
+    response = paginated_response(query, query_variables)
+
+    if len(response) == 0:
+        print(no_recommendations_msg(query, variables, watched_ids))
+        return None
+
+    filtered_response = filter_out_watched_anime(watched_ids, response)
+
+    if len(filtered_response) == 0:
+        print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+        return None
+
+    return random_candidates(filtered_response, count)
+
+
+def get_weighted_candidates(db, variables, watched_ids, weighted_by, count=1):
+    # The pool leaves watched anime in, so it can be reused however the watch list changes
+    pool = get_candidate_pool(db, get_query("recommend_candidates"), variables)
+
+    if len(pool) == 0:
+        print(NO_RECOMMENDATIONS_FOUND_MSG)
+        return None
+
+    weights = candidate_weights([anime["averageScore"] for anime in pool],
+                                [anime["popularity"] for anime in pool], weighted_by)
+    pool_key = (json.dumps(variables, sort_keys=True), *weighted_by)
+    candidates = pick_weighted_candidates(pool_key, [anime["id"] for anime in pool], weights, watched_ids, count)
+
+    if len(candidates) == 0:
+        print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+        return None
+
+    return [pool[position] for position in candidates]
+
+
+def get_catalog_candidates(db, variables, watched_ids, weighted_by=None, count=1, sample=False):
+    from candidate_index import (
+        get_candidate_index,
+        filter_candidate_index,
+        filter_out_watched_positions,
+        sample_unwatched_positions,
+        candidate_at,
+        get_catalog_version
+    )
+
+    index = get_candidate_index(db)
+    positions = filter_candidate_index(index, variables)
+
+    if len(positions) == 0:
+        print(NO_RECOMMENDATIONS_FOUND_MSG)
+        return None
+
+    if weighted_by:
+        # Missing scores are saved as -1 in the index, which candidate_weights treats like any other missing score
+        weights = candidate_weights(index["scores"][positions].tolist(),
+                                    index["popularity"][positions].tolist(), weighted_by)
+        pool_key = (get_catalog_version(db), json.dumps(variables, sort_keys=True), *weighted_by)
+        candidates = pick_weighted_candidates(pool_key, index["ids"][positions], weights, watched_ids, count)
+
+        if len(candidates) == 0:
+            print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+            return None
+
+        return [candidate_at(index, int(positions[position])) for position in candidates]
+
+    sampled_positions = sample_unwatched_positions(index, positions, watched_ids, count) if sample else None
+
+    # When most of the matches have been watched, sampling falls back to going through every match
+    if sampled_positions:
+        return [candidate_at(index, position) for position in sampled_positions]
+
+    unwatched_positions = filter_out_watched_positions(index, positions, watched_ids)
+
+    if len(unwatched_positions) == 0:
+        print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+        return None
+
+    return [candidate_at(index, int(position)) for position in random_candidates(unwatched_positions, count)]
+
+
+def pick_weighted_candidates(pool_key, ids, weights, watched_ids, count):
+    positions = []
+
+    while len(positions) < count:
+        # Anime that were already picked are skipped just like watched ones
+        position = pick_weighted(pool_key, ids, weights, watched_ids | {int(ids[picked]) for picked in positions})
+
+        if position is None:
+            break
+
+        positions.append(position)
+
+    return positions
+
+
+def get_ranked_anime(db, genres, min_score, max_episodes, formats, status, count=RANK_COUNT):
+    variables = recommend_variables(genres, min_score, max_episodes, formats, status)
+    watch_list = get_all_watch_list_anime(db)
+    watched_ids = {row[2] for row in watch_list}
+    rated_scores = {row[2]: row[3] for row in watch_list if row[3] is not None}
+
+    if len(rated_scores) == 0:
+        return print(NO_RATED_ANIME_MSG)
+
+    if is_catalog_synced(db):
+        ranked_data = get_catalog_rank_data(db, variables, watched_ids, rated_scores)
+    else:
+        ranked_data = get_online_rank_data(variables, watched_ids, rated_scores)
+
+    if not ranked_data:
+        return
+
+    load_anime, candidate_features, rated_features, scores = ranked_data
+
+    if len(rated_features) == 0:
+        return print(NO_RATED_ANIME_MSG)
+
+    from tabulate import tabulate
+    from ranking import build_profile, rank_by_similarity
+
+    # One matrix product scores every candidate against the profile at once
+    profile = build_profile(rated_features, scores)
+    top_positions, similarities = rank_by_similarity(candidate_features, profile, count)
+    table_headers = ["", "Name", "Score", "Match"]
+    table_records = [
+        [index + 1, get_anime_title(anime["title"]), formatted_score(anime["averageScore"]), f"{similarity:.0%}"]
+        for index, (anime, similarity) in enumerate(zip(load_anime(top_positions), similarities))
+    ]
+
+    print(tabulate(table_records, headers=table_headers, tablefmt="presto"))
+
+
+def get_online_rank_data(variables, watched_ids, rated_scores):
+    from ranking import feature_matrix_from_anime
+
+    query = get_query("rank_candidates")
+    query_variables = {**variables,
+                       "id_not_in": get_excluded_ids(watched_ids)} if watched_ids else variables
+    response = paginated_response(query, query_variables)
+
+    if len(response) == 0:
+        print(no_recommendations_msg(query, variables, watched_ids))
+        return None
+
+    candidates = filter_out_watched_anime(watched_ids, response)
+
+    if len(candidates) == 0:
+        print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+        return None
+
+    rated_anime = get_anime_batches(get_query("rank_details"), list(rated_scores))
+
+    def load_anime(top_positions):
+        return [candidates[position] for position in top_positions]
+
+    return (
+        load_anime,
+        feature_matrix_from_anime(candidates),
+        feature_matrix_from_anime(rated_anime),
+        [rated_scores[anime["id"]] for anime in rated_anime]
+    )
+
+
+def get_catalog_rank_data(db, variables, watched_ids, rated_scores):
+    from candidate_index import get_candidate_index, filter_candidate_index, filter_out_watched_positions, find_index_positions
+    from ranking import feature_matrix_from_index
+
+    index = get_candidate_index(db)
+    positions = filter_candidate_index(index, variables)
+
+    if len(positions) == 0:
+        print(NO_RECOMMENDATIONS_FOUND_MSG)
+        return None
+
+    positions = filter_out_watched_positions(index, positions, watched_ids)
+
+    if len(positions) == 0:
+        print(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+        return None
+
+    rated_positions = find_index_positions(index, list(rated_scores))
+
+    # Only the anime that make it into the top results are read from the catalog
+    def load_anime(top_positions):
+        return [get_catalog_anime(db, int(index["ids"][positions[position]])) for position in top_positions]
+
+    return (
+        load_anime,
+        feature_matrix_from_index(index, positions),
+        feature_matrix_from_index(index, rated_positions),
+        [rated_scores[int(id)] for id in index["ids"][rated_positions]]
+    )
+
+
+def find_similar_anime(db, count=RANK_COUNT):
+    if not is_catalog_synced(db):
+        return print(CATALOG_NOT_SYNCED_MSG)
+
+    anime = get_all_watch_list_anime(db)
 
     if len(anime) == 0:
         return print(WATCH_LIST_EMPTY_MSG)
 
-    anime_details = [get_single_anime(row[2]) for row in anime]
-    table_headers = ["", "Name", "Status", "Score",
-                     "Type", "Episodes", "Released", "Season", "Studio"]
+    view_watch_list_simple(anime)
+
+    while True:
+        error_msg = INVALID_OPTION_MSG
+
+        try:
+            anime_num = int(
+                input("Which of the following entries would you like to find similar anime for? ").strip())
+
+            if anime_num > len(anime) or anime_num <= 0:
+                print(error_msg)
+                continue
+
+            break
+        except ValueError:
+            print(error_msg)
+
+    print()
+
+    from tabulate import tabulate
+    from similarity_index import update_similarity_index, get_similar_anime
+
+    # Catalogs synced before the similar mode existed get their index built here the first time
+    update_similarity_index(db)
+
+    media_id = anime[anime_num - 1][2]
+    media = get_catalog_anime(db, media_id) or get_anime_details(media_id)
+    similar_anime = get_similar_anime(db, media, {row[2] for row in anime}, count)
+
+    if len(similar_anime) == 0:
+        return print(NO_SIMILAR_ANIME_MSG)
+
+    table_headers = ["", "Name", "Score", "Match"]
     table_records = [
-        format_record_for_watch_list(record, anime_details[index], index)
-        for index, record in enumerate(anime)
+        [index + 1, get_anime_title(similar["title"]), formatted_score(similar["averageScore"]), f"{similarity:.0%}"]
+        for index, (similar, similarity) in enumerate(similar_anime)
     ]
 
     print(tabulate(table_records, headers=table_headers, tablefmt="presto"))
 
 
+def no_recommendations_msg(query, variables, watched_ids):
+    # Watched anime are excluded by AniList, so check whether anything matches without that exclusion
+    if watched_ids and get_total_anime(query, variables) > 0:
+        return NO_UNIQUE_RECOMMENDATION_FOUND_MSG
+
+    return NO_RECOMMENDATIONS_FOUND_MSG
+
+
+def view_watch_list(db, status=None, min_score=None, sort="score", limit=None, after=None):
+    # Only the requested page is read from the database, and only its anime have their details looked up
+    anime = get_watch_list_page(db, status, min_score, sort, limit, after)
+
+    if anime is None:
+        return print(f"No watch list entry with id {after}")
+
+    if len(anime) == 0:
+        filtered = status or min_score is not None or after is not None
+        return print(NO_MATCHING_ENTRIES_MSG if filtered else WATCH_LIST_EMPTY_MSG)
+
+    has_next_page = limit is not None and len(anime) > limit
+    anime = anime[:limit]
+
+    table_headers = ["", "Name", "Status", "Score",
+                     "Type", "Episodes", "Released", "Season", "Studio"]
+
+    print_table(watch_list_records(db, anime), table_headers)
+
+    if has_next_page:
+        print(f"Add --after {anime[-1][0]} to see the next page")
+
+
+def watch_list_records(db, anime):
+    # Details are looked up one batch at a time, so the first rows are printed before the rest have been fetched
+    for start in range(0, len(anime), ID_BATCH_SIZE):
+        batch = anime[start:start + ID_BATCH_SIZE]
+        anime_details = get_multiple_anime([row[2] for row in batch], db)
+
+        for index, record in enumerate(batch, start=start):
+            yield format_record_for_watch_list(record, anime_details[record[2]], index)
+
+
 def add_anime_to_watch_list(db):
-    with open("./queries/media_pages.graphql", "r") as file:
-        query = file.read()
+    query = get_query("add_search")
 
     while True:
         name = input("What is the name of the anime? ").strip()
 
         variables = {"search": name}
-        records = paginated_response(query, variables)
+        pages = iter_catalog_pages(db, name) if is_catalog_synced(db) else iter_pages(query, variables)
+        records = next(pages, [])
 
         if len(records) == 0:
             print(f"No anime found with name {name}")
             continue
 
-        table_headers = ["", "Name", "Score", "Release Date"]
-        table_records = [
-            format_response_for_add(index, record)
-            for index, record in enumerate(records)
-        ]
-
-        print(tabulate(table_records, headers=table_headers,
-              tablefmt="presto"), end="\n\n")
+        print_search_results(records)
         break
 
     while True:
         error_msg = INVALID_OPTION_MSG
+        # A full page means AniList may have more results for the name
+        more_results_hint = "(m for more results) " if len(records) % PAGE_SIZE == 0 else ""
+        answer = input(
+            f"Which of the following matches the anime {name}? {more_results_hint}").strip()
+
+        if answer.lower() in ["m", "more"]:
+            next_records = next(pages, [])
+
+            if len(next_records) == 0:
+                print(NO_MORE_RESULTS_MSG)
+                continue
+
+            print_search_results(next_records, start=len(records))
+            records.extend(next_records)
+            continue
 
         try:
-            anime_index = int(input(
-                f"Which of the following matches the anime {name}? ").strip())
+            anime_index = int(answer)
 
             if anime_index <= 0 or anime_index > len(records):
                 print(error_msg)
@@ -239,12 +872,29 @@ def add_anime_to_watch_list(db):
     media_id = anime["id"]
     title = get_anime_title(anime["title"])
 
-    db.execute(add_anime_query, (media_id, title, score, status))
-    db.commit()
+    try:
+        db.execute(add_anime_query, (media_id, title, score, status))
+        db.commit()
+    except sqlite3.IntegrityError:
+        # The unique index on media_id stops the same anime from being added twice
+        return print(f"{title} is already in your watch list")
 
     print(f"Added {title} to watch list")
 
 
+def print_search_results(records, start=0):
+    from tabulate import tabulate
+
+    table_headers = ["", "Name", "Score", "Release Date"]
+    table_records = [
+        format_response_for_add(index, record)
+        for index, record in enumerate(records, start=start)
+    ]
+
+    print(tabulate(table_records, headers=table_headers,
+          tablefmt="presto"), end="\n\n")
+
+
 def delete_anime_in_watch_list(db):
     anime = get_all_watch_list_anime(db)
 
@@ -253,39 +903,17 @@ def delete_anime_in_watch_list(db):
 
     view_watch_list_simple(anime)
 
-    while True:
-        error_msg = INVALID_OPTION_MSG
-
-        try:
-            anime_num = int(
-                input("Which of the following entries would you like to delete? ").strip())
+    entries_to_delete = select_watch_list_entries(anime, "delete")
+    names = entry_names(entries_to_delete)
 
-            if anime_num > len(anime) or anime_num <= 0:
-                print(error_msg)
-                continue
-
-            break
-        except ValueError:
-            print(error_msg)
+    if not confirm(f"Are you sure you want to delete your {"entry" if len(entries_to_delete) == 1 else "entries"} for {names}? "):
+        return print(CANCEL_DELETE_MSG)
 
-    while True:
-        entry_to_delete = anime[anime_num - 1]
-        anime_name = entry_to_delete[1]
+    # Every selected entry is deleted with one statement and one commit
+    db.executemany(delete_query, [(entry[0],) for entry in entries_to_delete])
+    db.commit()
 
-        confirmed_response = input(f"Are you sure you want to delete your entry for {
-                                   anime_name}? ").lower()
-
-        if confirmed_response in ["y", "yes"]:
-            db.execute(delete_query, (entry_to_delete[0],))
-            db.commit()
-
-            print(f"Successfully deleted {anime_name} from your watch list")
-            break
-        elif confirmed_response in ["n", "no"]:
-            print(CANCEL_DELETE_MSG)
-            break
-        else:
-            print(INVALID_CONFIRMATION_MSG)
+    print(f"Successfully deleted {names} from your watch list")
 
 
 def update_anime_in_watch_list(db):
@@ -296,20 +924,7 @@ def update_anime_in_watch_list(db):
 
     view_watch_list_simple(anime)
 
-    while True:
-        error_msg = INVALID_OPTION_MSG
-
-        try:
-            anime_num = int(
-                input("Which of the following entries would you like to update? ").strip())
-
-            if anime_num > len(anime) or anime_num <= 0:
-                print(error_msg)
-                continue
-
-            break
-        except ValueError:
-            print(error_msg)
+    entries_to_update = select_watch_list_entries(anime, "update")
 
     while True:
         column = input(
@@ -342,19 +957,56 @@ def update_anime_in_watch_list(db):
                         continue
                 except ValueError:
                     print(error_msg)
+                    continue
 
         break
 
     print()
 
-    anime_to_update = anime[anime_num - 1]
-
-    db.execute(update_query.format(column=column.lower()),
-               (new_value, anime_to_update[0]))
+    if len(entries_to_update) == 1:
+        anime_to_update = entries_to_update[0]
+        success_msg = f"Successfully updated {anime_to_update[1]}'s {column.lower()} to {new_value}"
+    elif confirm(f"Are you sure you want to change the {column.lower()} of {entry_names(entries_to_update)} to {new_value}? "):
+        success_msg = f"Successfully updated the {column.lower()} of {len(entries_to_update)} entries to {new_value}"
+    else:
+        return print(CANCEL_UPDATE_MSG)
+
+    # Every selected entry is updated with one statement and one commit
+    db.executemany(update_query.format(column=column.lower()),
+                   [(new_value, entry[0]) for entry in entries_to_update])
     db.commit()
 
-    print(
-        f"Successfully updated {anime_to_update[1]}'s {column.lower()} to {new_value}")
+    print(success_msg)
+
+
+def select_watch_list_entries(anime, action):
+    while True:
+        selection = parse_selection(input(
+            f"Which of the following entries would you like to {action}? (e.g. 2 or 1,4,7-20) "), len(anime))
+
+        if selection:
+            return [anime[number - 1] for number in selection]
+
+        print(INVALID_OPTION_MSG)
+
+
+def entry_names(entries):
+    if len(entries) == 1:
+        return entries[0][1]
+
+    return f"these {len(entries)} anime ({", ".join(entry[1] for entry in entries)})"
+
+
+def confirm(question):
+    while True:
+        confirmed_response = input(question).lower()
+
+        if confirmed_response in ["y", "yes"]:
+            return True
+        elif confirmed_response in ["n", "no"]:
+            return False
+
+        print(INVALID_CONFIRMATION_MSG)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import numpy as np
+
+from constants import VALID_GENRES, VALID_FORMATS, STUDIO_BUCKETS, EPISODE_SCALE, DIVERSITY_TRADE_OFF
+from candidate_index import to_bitmask, studio_bitmask
+
+
+def feature_matrix(genres, formats, studios):
+    # Each anime becomes one row of 0s and 1s: a column per genre, per format and per studio bucket
+    return np.hstack([
+        unpack_bits(genres, len(VALID_GENRES)),
+        unpack_bits(formats, len(VALID_FORMATS)),
+        unpack_bits(studios, STUDIO_BUCKETS)
+    ]).astype(np.float32)
+
+
+def feature_matrix_from_index(index, positions):
+    return feature_matrix(index["genres"][positions], index["formats"][positions], index["studios"][positions])
+
+
+def feature_matrix_from_anime(anime):
+    return feature_matrix(
+        [to_bitmask(media["genres"], VALID_GENRES) for media in anime],
+        [to_bitmask([media["format"]], VALID_FORMATS) for media in anime],
+        [studio_bitmask(media["studios"]["edges"]) for media in anime]
+    )
+
+
+def similarity_matrix_from_anime(anime):
+    # Episode counts are log scaled so a long running show isn't dozens of times further away than a short one
+    episodes = np.log1p([media["episodes"] or 0 for media in anime]) / np.log1p(EPISODE_SCALE)
+    scores = np.array([media["averageScore"] or 0 for media in anime]) / 100
+
+    return np.hstack([
+        feature_matrix_from_anime(anime),
+        episodes.reshape(-1, 1),
+        scores.reshape(-1, 1)
+    ]).astype(np.float32)
+
+
+def unpack_bits(masks, width):
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1, 1)
+
+    return (masks >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+
+
+def build_profile(rated_features, scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    # Centering on the average score lets anime rated below it push the profile away from their features
+    weights = scores - scores.mean()
+
+    if np.allclose(weights, 0):
+        weights = scores / 100
+
+    return weights @ rated_features
+
+
+def rank_by_similarity(candidate_features, profile, count):
+    norms = np.linalg.norm(candidate_features, axis=1) * np.linalg.norm(profile)
+    similarities = np.divide(candidate_features @ profile, norms,
+                             out=np.zeros(len(candidate_features), dtype=np.float32), where=norms > 0)
+    count = min(count, len(similarities))
+
+    # Only the top results need to be in order, so partition first and sort just those
+    top_positions = np.argpartition(-similarities, count - 1)[:count]
+    top_positions = top_positions[np.argsort(-similarities[top_positions], kind="stable")]
+
+    return top_positions, similarities[top_positions]
+
+
+def diversify(features, relevance, count, trade_off=DIVERSITY_TRADE_OFF):
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    unit_features = np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+    similarities = unit_features @ unit_features.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    # Maximal marginal relevance: start from the best anime, then keep adding the anime whose score most
+    # outweighs how close it is to the anime that were already picked
+    selected = [int(np.argmax(relevance))]
+    closest_similarity = similarities[selected[0]].copy()
+
+    while len(selected) < min(count, len(features)):
+        marginal_relevance = trade_off * relevance - (1 - trade_off) * closest_similarity
+        marginal_relevance[selected] = -np.inf
+        selected.append(int(np.argmax(marginal_relevance)))
+        closest_similarity = np.maximum(closest_similarity, similarities[selected[-1]])
+
+    return selected
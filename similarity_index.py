@@ -0,0 +1,67 @@
+import json
+import numpy as np
+
+from functools import cache
+from constants import PAGE_SIZE, LSH_TABLES, LSH_BITS, LSH_SEED
+from catalog import get_sync_state, set_sync_state, get_catalog_anime_batch
+from ranking import similarity_matrix_from_anime, rank_by_similarity
+from sql_queries import catalog_changed_query, upsert_similarity_bucket_query, similarity_candidates_query
+
+
+def update_similarity_index(db):
+    indexed_at = int(get_sync_state(db, "similarity_indexed_at") or 0)
+    # Only anime that changed since the index was last updated are hashed again
+    cursor = db.execute(catalog_changed_query, (indexed_at,))
+
+    while True:
+        anime = [json.loads(row[0]) for row in cursor.fetchmany(PAGE_SIZE)]
+
+        if len(anime) == 0:
+            break
+
+        buckets = lsh_buckets(similarity_matrix_from_anime(anime))
+        db.executemany(upsert_similarity_bucket_query, [
+            (media["id"], table_num, int(bucket))
+            for media, media_buckets in zip(anime, buckets)
+            for table_num, bucket in enumerate(media_buckets)
+        ])
+        indexed_at = max(indexed_at, *(media["updatedAt"] for media in anime))
+
+    set_sync_state(db, "similarity_indexed_at", indexed_at)
+    db.commit()
+
+
+def get_similar_anime(db, anime, excluded_ids, count):
+    features = similarity_matrix_from_anime([anime])
+    candidate_ids = [id for id in get_bucket_neighbours(db, lsh_buckets(features)[0])
+                     if id not in excluded_ids and id != anime["id"]]
+
+    if len(candidate_ids) == 0:
+        return []
+
+    # Only anime sharing a bucket with this one are compared exactly, instead of the whole catalog
+    candidates = get_catalog_anime_batch(db, candidate_ids)
+    top_positions, similarities = rank_by_similarity(similarity_matrix_from_anime(candidates), features[0], count)
+
+    return [(candidates[position], similarity) for position, similarity in zip(top_positions, similarities)]
+
+
+def get_bucket_neighbours(db, buckets):
+    conditions = " OR ".join(["(table_num = ? AND bucket = ?)"] * len(buckets))
+    values = [value for table_num, bucket in enumerate(buckets) for value in (table_num, int(bucket))]
+
+    return [row[0] for row in db.execute(similarity_candidates_query.format(conditions=conditions), values)]
+
+
+def lsh_buckets(features):
+    # Each bit records which side of a random hyperplane an anime falls on, so anime pointing in a similar
+    # direction share most of their bits and usually land in the same bucket in at least one of the tables
+    bits = (features @ get_hyperplanes(features.shape[1]).T) > 0
+    bits = bits.reshape(len(features), LSH_TABLES, LSH_BITS)
+
+    return bits @ (1 << np.arange(LSH_BITS))
+
+
+@cache
+def get_hyperplanes(dimensions):
+    return np.random.default_rng(LSH_SEED).standard_normal((LSH_TABLES * LSH_BITS, dimensions)).astype(np.float32)
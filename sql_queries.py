@@ -9,11 +9,177 @@ create_table_query = """
     );
 """
 
+create_media_cache_table_query = """
+  CREATE TABLE IF NOT EXISTS media_cache
+    (
+      media_id INTEGER PRIMARY KEY NOT NULL,
+      data TEXT NOT NULL,
+      expires_at REAL NOT NULL,
+      accessed_at REAL NOT NULL
+    );
+"""
+
+create_catalog_table_query = """
+  CREATE TABLE IF NOT EXISTS anime_catalog
+    (
+      media_id INTEGER PRIMARY KEY NOT NULL,
+      title_english TEXT,
+      title_user_preferred TEXT,
+      average_score INTEGER,
+      popularity INTEGER,
+      episodes INTEGER,
+      format VARCHAR(20),
+      status VARCHAR(20),
+      genres TEXT NOT NULL,
+      updated_at INTEGER NOT NULL,
+      data TEXT NOT NULL
+    );
+"""
+
+create_sync_state_table_query = """
+  CREATE TABLE IF NOT EXISTS sync_state
+    (
+      key VARCHAR(50) PRIMARY KEY NOT NULL,
+      value TEXT NOT NULL
+    );
+"""
+
+create_candidate_pool_table_query = """
+  CREATE TABLE IF NOT EXISTS candidate_pools
+    (
+      pool_key TEXT PRIMARY KEY NOT NULL,
+      data TEXT NOT NULL,
+      expires_at REAL NOT NULL
+    );
+"""
+
+create_similarity_table_query = """
+  CREATE TABLE IF NOT EXISTS similarity_buckets
+    (
+      media_id INTEGER NOT NULL,
+      table_num INTEGER NOT NULL,
+      bucket INTEGER NOT NULL,
+      PRIMARY KEY (media_id, table_num)
+    );
+"""
+
+create_similarity_bucket_index_query = "CREATE INDEX IF NOT EXISTS similarity_bucket ON similarity_buckets (table_num, bucket);"
+create_catalog_updated_at_index_query = "CREATE INDEX IF NOT EXISTS anime_catalog_updated_at ON anime_catalog (updated_at);"
+
+user_version_query = "PRAGMA user_version;"
+set_user_version_query = "PRAGMA user_version = {version};"
+enable_wal_query = "PRAGMA journal_mode = WAL;"
+
+# The newest entry for each anime is kept, so the unique index below can be created on lists with duplicates.
+# It takes the score of the newest older entry that has one, if it hasn't been scored itself
+merge_duplicate_anime_query = """
+  UPDATE watch_list SET score = (
+    SELECT older.score FROM watch_list AS older
+    WHERE older.media_id = watch_list.media_id AND older.score IS NOT NULL
+    ORDER BY older.id DESC LIMIT 1
+  )
+  WHERE score IS NULL AND id IN (SELECT MAX(id) FROM watch_list GROUP BY media_id HAVING COUNT(*) > 1);
+"""
+delete_duplicate_anime_query = """
+  DELETE FROM watch_list WHERE id NOT IN (SELECT MAX(id) FROM watch_list GROUP BY media_id);
+"""
+create_watch_list_media_id_index_query = "CREATE UNIQUE INDEX IF NOT EXISTS watch_list_media_id ON watch_list (media_id);"
+# Both indexes hold every column of the watch list, so listing it never has to read the table itself
+create_watch_list_score_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_score ON watch_list (score DESC, title, media_id, status);
+"""
+create_watch_list_status_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_status ON watch_list (status, score DESC, title, media_id);
+"""
+
+# Unscored entries are sorted as -1, so every watch list sort is over a column that is never NULL
+drop_watch_list_score_index_query = "DROP INDEX IF EXISTS watch_list_score;"
+drop_watch_list_status_index_query = "DROP INDEX IF EXISTS watch_list_status;"
+create_watch_list_sorted_score_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_score ON watch_list (IFNULL(score, -1) DESC, id, title, media_id, status, score);
+"""
+create_watch_list_title_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_title ON watch_list (title, id, media_id, status, score);
+"""
+create_watch_list_status_score_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_status_score ON watch_list (status, IFNULL(score, -1) DESC, id, title, media_id, score);
+"""
+create_watch_list_status_title_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_status_title ON watch_list (status, title, id, media_id, score);
+"""
+create_watch_list_status_added_index_query = """
+  CREATE INDEX IF NOT EXISTS watch_list_status_added ON watch_list (status, id, title, media_id, score);
+"""
+
 add_anime_query = """
   INSERT INTO watch_list (media_id, title, score, status)
   VALUES (?, ?, ?, ?);
 """
 
-watch_list_query = "SELECT * FROM watch_list ORDER BY score DESC;"
+# Entries already in the watch list are skipped through the unique index on media_id
+import_anime_query = """
+  INSERT OR IGNORE INTO watch_list (media_id, title, score, status)
+  VALUES (?, ?, ?, ?);
+"""
+
+# Each flag says whether that column is being changed, so one statement covers every kind of update in a batch
+batch_update_query = """
+  UPDATE watch_list
+  SET status = CASE WHEN ? THEN ? ELSE status END, score = CASE WHEN ? THEN ? ELSE score END
+  WHERE media_id = ?;
+"""
+batch_delete_query = "DELETE FROM watch_list WHERE media_id = ?;"
+
+watch_list_query = "SELECT * FROM watch_list ORDER BY IFNULL(score, -1) DESC, id;"
+watch_list_entry_query = "SELECT * FROM watch_list WHERE id = ?;"
+watch_list_page_query = "SELECT * FROM watch_list {where} ORDER BY {order} LIMIT ?;"
+watch_list_status_condition = "status = ?"
+watch_list_min_score_condition = "IFNULL(score, -1) >= ?"
+# How each sort orders the watch list, and the keyset condition for the entries that come after a given entry.
+# The conditions are written as a range on the first column of the order, so SQLite can seek straight to them
+watch_list_sorts = {
+    "score": ("IFNULL(score, -1) DESC, id", "IFNULL(score, -1) <= ? AND (IFNULL(score, -1) < ? OR id > ?)"),
+    "title": ("title, id", "title >= ? AND (title > ? OR id > ?)"),
+    "added": ("id", "id > ?")
+}
 update_query = "UPDATE watch_list SET {column} = ? WHERE id = ?;"
-delete_query = "DELETE FROM watch_list WHERE id = ?;"
\ No newline at end of file
+delete_query = "DELETE FROM watch_list WHERE id = ?;"
+
+cached_media_query = "SELECT media_id, data FROM media_cache WHERE media_id IN ({placeholders}) AND expires_at > ?;"
+touch_cached_media_query = "UPDATE media_cache SET accessed_at = ? WHERE media_id = ?;"
+upsert_cached_media_query = """
+  INSERT OR REPLACE INTO media_cache (media_id, data, expires_at, accessed_at)
+  VALUES (?, ?, ?, ?);
+"""
+evict_cached_media_query = """
+  DELETE FROM media_cache WHERE media_id IN
+    (SELECT media_id FROM media_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?);
+"""
+
+candidate_pool_query = "SELECT data, expires_at FROM candidate_pools WHERE pool_key = ? AND expires_at > ?;"
+upsert_candidate_pool_query = "INSERT OR REPLACE INTO candidate_pools (pool_key, data, expires_at) VALUES (?, ?, ?);"
+delete_expired_candidate_pools_query = "DELETE FROM candidate_pools WHERE expires_at <= ?;"
+
+upsert_catalog_anime_query = """
+  INSERT OR REPLACE INTO anime_catalog
+    (media_id, title_english, title_user_preferred, average_score, popularity, episodes, format, status, genres, updated_at, data)
+  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+catalog_anime_query = "SELECT data FROM anime_catalog WHERE media_id = ?;"
+catalog_anime_batch_query = "SELECT data FROM anime_catalog WHERE media_id IN ({placeholders});"
+catalog_changed_query = "SELECT data FROM anime_catalog WHERE updated_at > ? ORDER BY updated_at;"
+catalog_index_query = """
+  SELECT media_id, average_score, popularity, episodes, format, status, genres, json_extract(data, '$.studios.edges')
+  FROM anime_catalog ORDER BY media_id;
+"""
+catalog_search_query = """
+  SELECT data FROM anime_catalog
+  WHERE title_english LIKE ? ESCAPE '\\' OR title_user_preferred LIKE ? ESCAPE '\\'
+  ORDER BY popularity DESC;
+"""
+sync_state_query = "SELECT value FROM sync_state WHERE key = ?;"
+set_sync_state_query = "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?);"
+delete_sync_state_query = "DELETE FROM sync_state WHERE key = ?;"
+
+upsert_similarity_bucket_query = "INSERT OR REPLACE INTO similarity_buckets (media_id, table_num, bucket) VALUES (?, ?, ?);"
+similarity_candidates_query = "SELECT DISTINCT media_id FROM similarity_buckets WHERE {conditions};"
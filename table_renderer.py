@@ -0,0 +1,78 @@
+import re
+import sys
+import unicodedata
+
+from functools import lru_cache
+from itertools import chain, islice
+from constants import TABLE_SAMPLE_ROWS, MAX_COLUMN_WIDTH
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def print_table(records, headers, output=None, end="\n"):
+    output = output or sys.stdout
+    records = iter(records)
+    # Column widths are measured on the first rows only, so the table is written while later rows are still
+    # being produced. Any longer values further down are cut to fit
+    sample = list(islice(records, TABLE_SAMPLE_ROWS))
+    columns = list(zip(headers, *sample))
+    # Like tabulate, headers get at least two spaces of room
+    widths = [
+        min(max([display_width(header) + 2, *(display_width(cell_text(cell)) for cell in column[1:])]), MAX_COLUMN_WIDTH)
+        for header, column in zip(headers, columns)
+    ]
+    # Like tabulate, columns of numbers are aligned to the right
+    right_aligned = [
+        any(cell is not None for cell in column[1:]) and
+        all(isinstance(cell, (int, float)) for cell in column[1:] if cell is not None)
+        for column in columns
+    ]
+
+    output.write(format_row(headers, widths, right_aligned))
+    output.write("\n" + "+".join("-" * (width + 2) for width in widths))
+
+    for record in chain(sample, records):
+        output.write("\n" + format_row(record, widths, right_aligned))
+
+    output.write(end)
+    output.flush()
+
+
+def format_row(record, widths, right_aligned):
+    cells = [fit_cell(cell_text(cell), width, right) for cell, width, right in zip(record, widths, right_aligned)]
+
+    return (" " + " | ".join(cells)).rstrip()
+
+
+def fit_cell(text, width, right_aligned=False):
+    text_width = display_width(text)
+
+    # Colored cells are short labels, so only plain text ever needs cutting down
+    if text_width > width and not ANSI_ESCAPE.search(text):
+        while display_width(text) > width - 1:
+            text = text[:-1]
+
+        text += "…"
+        text_width = display_width(text)
+
+    padding = " " * max(width - text_width, 0)
+
+    return padding + text if right_aligned else text + padding
+
+
+def cell_text(cell):
+    return "" if cell is None else str(cell)
+
+
+@lru_cache(maxsize=1024)
+def display_width(text):
+    width = 0
+
+    # Color codes take up no space, and emoji take up two columns in a terminal
+    for character in ANSI_ESCAPE.sub("", text):
+        if unicodedata.combining(character) or unicodedata.category(character) in ["Mn", "Me", "Cf"]:
+            continue
+
+        width += 2 if unicodedata.east_asian_width(character) in ["W", "F"] else 1
+
+    return width
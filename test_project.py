@@ -1,8 +1,57 @@
+import sqlite3
+import subprocess
+import threading
+import sys
+import time
+import tempfile
+import io
+import os
+import re
+import json
 import unittest
+import http.client
+import requests
+import numpy as np
+import weighted_sampling
 
 from unittest.mock import Mock, call, patch
-from project import get_recommended_anime, view_watch_list, add_anime_to_watch_list, update_anime_in_watch_list, delete_anime_in_watch_list
-from sql_queries import watch_list_query, add_anime_query, update_query, delete_query
+from tabulate import tabulate
+from table_renderer import print_table, display_width
+from helpers import get_watch_list_page, formatted_status, formatted_score
+from project import get_recommended_anime, get_ranked_anime, find_similar_anime, view_watch_list, add_anime_to_watch_list, update_anime_in_watch_list, delete_anime_in_watch_list
+from helpers import get_multiple_anime, paginated_response, sample_unwatched_anime, get_excluded_ids, filter_out_watched_anime
+from anilist_client import get_session, post_query, wait_for_token
+from graphql_queries import get_query, read_query_file
+from sql_queries import (
+    watch_list_query,
+    add_anime_query,
+    update_query,
+    delete_query,
+    watch_list_page_query,
+    watch_list_sorts,
+    create_table_query,
+    create_media_cache_table_query,
+    create_catalog_table_query,
+    create_sync_state_table_query,
+    create_candidate_pool_table_query,
+    create_similarity_table_query,
+    create_similarity_bucket_index_query,
+    create_watch_list_score_index_query,
+    user_version_query
+)
+from catalog import sync_catalog, iter_catalog_pages
+from migrations import migrate, MIGRATIONS
+from importer import import_watch_list, parse_anilist_export
+from batch import read_changes, validate_changes, apply_changes
+from project import handle_batch, handle_watch_list, handle_recommend, get_args, run_command, get_catalog_candidates
+from daemon import serve, forward_command
+from api_server import PooledHTTPServer, handle_api_request
+from load_test import run_load_test
+from similarity_index import update_similarity_index, get_similar_anime
+from weighted_sampling import build_alias_table
+from ranking import build_profile, rank_by_similarity, feature_matrix_from_anime
+import candidate_index
+from candidate_index import build_candidate_index, load_candidate_index, get_candidate_index, filter_candidate_index, filter_out_watched_positions
 from constants import (
     INVALID_OPTION_MSG,
     INVALID_CONFIRMATION_MSG,
@@ -12,7 +61,21 @@ from constants import (
     INVALID_STATUS_MSG,
     NO_RECOMMENDATIONS_FOUND_MSG,
     NO_UNIQUE_RECOMMENDATION_FOUND_MSG,
-    CANCEL_DELETE_MSG
+    CANCEL_DELETE_MSG,
+    NO_MORE_RESULTS_MSG,
+    NO_RATED_ANIME_MSG,
+    INVALID_SELECTION_MSG,
+    NO_MATCHING_ENTRIES_MSG,
+    INVALID_LIMIT_MSG,
+    INVALID_RECOMMEND_FLAG_MSG,
+    DUPLICATES_REMOVED_MSG,
+    HTTP_KEEP_ALIVE_TIMEOUT,
+    INVALID_BATCH_MSG,
+    MEDIA_ID_FLAG_MSG,
+    CANCEL_UPDATE_MSG,
+    LSH_TABLES,
+    CANDIDATE_POOL_TTL,
+    TABLE_SAMPLE_ROWS
 )
 
 
@@ -94,6 +157,8 @@ class BaseWatchListTest(unittest.TestCase):
         ]
 
 
+@patch("project.get_anime_details", Mock(side_effect=lambda id: {"id": id, "title": "ERASED"}))
+@patch("project.is_catalog_synced", Mock(return_value=False))
 class TestGetRecommendedAnime(BaseWatchListTest):
     @patch("project.get_random_anime", Mock(return_value={"id": 20, "title": "ERASED"}))
     @patch("project.formatted_recommended_anime", Mock(return_value="Formatted Anime Response"))
@@ -132,7 +197,9 @@ class TestGetRecommendedAnime(BaseWatchListTest):
         get_recommended_anime(
             db=db_mock, genres=[], min_score=20, max_episodes=20, formats=[], status="")
 
-        db_mock.execute.assert_not_called()
+        db_mock.execute.assert_called_once_with(watch_list_query)
+        db_mock.commit.assert_not_called()
+        assert "id_not_in" not in mock_response.call_args.args[1]
         mock_print.assert_called_with(NO_RECOMMENDATIONS_FOUND_MSG)
 
     @patch("project.paginated_response")
@@ -212,19 +279,403 @@ class TestGetRecommendedAnime(BaseWatchListTest):
     @patch("builtins.print")
     def test_no_recommendations_found(self, mock_print):
         """Test when no recommendation is provided"""
-        get_recommended_anime(db=self.mocked_db(), genres=[],
+        get_recommended_anime(db=self.mocked_db(()), genres=[],
                               min_score=20, max_episodes=20, formats=[], status="")
 
         mock_print.assert_called_with(
             "No anime found with current options. Try narrowing down the criteria given")
 
 
+class RecommendFlags(BaseWatchListTest):
+    @patch("project.get_recommended_anime")
+    @patch("builtins.print")
+    def test_flags_of_other_modes_rejected(self, mock_print, mock_recommend):
+        """Test that flags from the watchlist, import and api modes aren't silently ignored by the recommend mode"""
+        for flags in [["-id", "5"], ["-sc", "80"], ["-fi", "animelist.xml"], ["--port", "9000"], ["-ws", "watching"]]:
+            handle_recommend(self.mocked_db(), get_args(["recommend", *flags]))
+
+        mock_recommend.assert_not_called()
+        assert mock_print.call_args_list == [call(INVALID_RECOMMEND_FLAG_MSG)] * 5
+
+
+@patch("project.get_anime_details", Mock(side_effect=lambda id: {"id": id, "title": "ERASED"}))
+@patch("project.is_catalog_synced", Mock(return_value=False))
+class ExcludeWatchedAnime(BaseWatchListTest):
+    @patch("project.get_random_anime", Mock(return_value={"id": 30, "title": "Naruto"}))
+    @patch("project.formatted_recommended_anime", Mock(return_value="Formatted Anime Response"))
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("project.paginated_response")
+    @patch("builtins.print", Mock())
+    def test_watched_ids_sent_to_api(self, mock_response):
+        """Test that anime in the watch list are excluded by the query itself"""
+        mock_response.return_value = self.mocked_api_response()[2:]
+        mocked_db_anime = [
+            (1, 'Cowboy Bebop', 10, None, 'PLAN TO WATCH'),
+            (2, 'ERASED', 20, None, 'PLAN TO WATCH')
+        ]
+
+        get_recommended_anime(db=self.mocked_db(mocked_db_anime), genres=["Action"], min_score=None,
+                              max_episodes=None, formats=[], status="")
+
+        assert mock_response.call_args.args[1]["id_not_in"] == [10, 20]
+        assert mock_response.call_args.args[1]["genre_in"] == ["Action"]
+
+    @patch("project.get_total_anime", Mock(return_value=2))
+    @patch("project.paginated_response", Mock(return_value=[]))
+    @patch("builtins.print")
+    def test_everything_excluded_by_api(self, mock_print):
+        """Test that an empty response caused by the exclusion is reported as everything being watched"""
+        mocked_db_anime = [
+            (1, 'Cowboy Bebop', 10, None, 'PLAN TO WATCH'),
+            (2, 'ERASED', 20, None, 'PLAN TO WATCH')
+        ]
+
+        get_recommended_anime(db=self.mocked_db(mocked_db_anime), genres=[], min_score=None,
+                              max_episodes=None, formats=[], status="")
+
+        mock_print.assert_called_with(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+
+    @patch("helpers.MAX_EXCLUDED_IDS", 3)
+    def test_excluded_ids_capped(self):
+        """Test that only part of a very long watch list is sent to be excluded by the API"""
+        assert get_excluded_ids({50, 40, 30, 20, 10}) == [10, 20, 30]
+
+    def test_watched_anime_filtered_out(self):
+        """Test that anime the API didn't exclude are still filtered out locally"""
+        anime = filter_out_watched_anime({10, 30}, self.mocked_api_response())
+
+        assert [media["id"] for media in anime] == [20]
+
+
+@patch("project.get_anime_details", Mock(side_effect=lambda id: {"id": id, "title": "ERASED"}))
+@patch("project.is_catalog_synced", Mock(return_value=False))
+class SampledRecommendation(BaseWatchListTest):
+    @patch("project.get_random_anime", Mock(return_value={"id": 20, "title": "ERASED"}))
+    @patch("project.formatted_recommended_anime", Mock(return_value="Formatted Anime Response"))
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("project.sample_unwatched_anime")
+    @patch("project.get_total_anime", Mock(return_value=5000))
+    @patch("project.paginated_response")
+    @patch("builtins.print")
+    def test_sampled_recommendation_skips_full_crawl(self, mock_print, mock_response, mock_sample):
+        """Test that sampling a recommendation doesn't download every page of the results"""
+        mock_sample.return_value = self.mocked_api_response()[1]
+
+        get_recommended_anime(db=self.mocked_db(()), genres=["Action"], min_score=None,
+                              max_episodes=None, formats=[], status="", sample=True)
+
+        mock_response.assert_not_called()
+        assert mock_sample.call_args.args[2] == 5000
+        mock_print.assert_called_with("Formatted Anime Response")
+
+    @patch("project.get_total_anime", Mock(return_value=0))
+    @patch("project.paginated_response")
+    @patch("builtins.print")
+    def test_sampled_recommendation_with_no_matches(self, mock_print, mock_response):
+        """Test that an empty probe ends the recommendation without any further requests"""
+        get_recommended_anime(db=self.mocked_db(()), genres=[], min_score=None,
+                              max_episodes=None, formats=[], status="", sample=True)
+
+        mock_response.assert_not_called()
+        mock_print.assert_called_with(NO_RECOMMENDATIONS_FOUND_MSG)
+
+    @patch("project.sample_unwatched_anime", Mock(return_value=None))
+    @patch("project.get_total_anime", Mock(return_value=3))
+    @patch("project.paginated_response")
+    @patch("builtins.print")
+    def test_sampled_recommendation_falls_back_to_full_crawl(self, mock_print, mock_response):
+        """Test that every match is checked when sampling only finds watched anime"""
+        mock_response.return_value = self.mocked_api_response()
+        mocked_db_anime = [
+            (1, 'Cowboy Bebop', 10, None, 'PLAN TO WATCH'),
+            (2, 'ERASED', 20, None, 'PLAN TO WATCH'),
+            (3, "Naruto", 30, None, 'PLAN TO WATCH')
+        ]
+
+        get_recommended_anime(db=self.mocked_db(mocked_db_anime), genres=[], min_score=None,
+                              max_episodes=None, formats=[], status="", sample=True)
+
+        mock_response.assert_called_once()
+        mock_print.assert_called_with(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+
+    @patch("helpers.random.randrange")
+    @patch("helpers.get_page")
+    def test_watched_anime_resampled(self, mock_page, mock_randrange):
+        """Test that a sampled anime that is already watched is swapped for another random pick"""
+        mock_page.side_effect = lambda query, variables, page_num: {
+            "media": [{"id": (page_num - 1) * 50 + index} for index in range(50)]
+        }
+        mock_randrange.side_effect = [3, 8, 75]
+
+        anime = sample_unwatched_anime("query", {}, 100, watched_ids={3, 8})
+
+        assert anime == {"id": 75}
+        assert [call.args[2] for call in mock_page.call_args_list] == [1, 2]
+
+
+@patch("project.is_catalog_synced", Mock(return_value=False))
+class TwoPhaseRecommendation(BaseWatchListTest):
+    @patch("project.get_random_anime", Mock(return_value={"id": 20, "averageScore": 78, "popularity": 1000}))
+    @patch("project.formatted_recommended_anime", Mock(return_value="Formatted Anime Response"))
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("project.paginated_response")
+    @patch("builtins.print", Mock())
+    def test_details_only_fetched_for_chosen_anime(self, mock_response):
+        """Test that candidates are listed with the lightweight query and only the chosen anime gets its full details"""
+        mock_response.return_value = [{"id": id, "averageScore": 78, "popularity": 1000} for id in [10, 20, 30]]
+
+        with patch("project.get_anime_details") as mock_details:
+            get_recommended_anime(db=self.mocked_db(()), genres=[], min_score=None,
+                                  max_episodes=None, formats=[], status="")
+
+        assert "RecommendationCandidates" in mock_response.call_args.args[0]
+        assert "description" not in mock_response.call_args.args[0]
+        mock_details.assert_called_once_with(20)
+
+
+@patch.dict("weighted_sampling.candidate_pools", clear=True)
+@patch.dict("weighted_sampling.alias_tables", clear=True)
+@patch("project.get_anime_details", Mock(side_effect=lambda id: {"id": id, "title": "ERASED"}))
+@patch("project.formatted_recommended_anime", Mock(side_effect=lambda anime: anime["id"]))
+@patch("project.is_catalog_synced", Mock(return_value=False))
+class WeightedRecommendation(BaseWatchListTest):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute(create_table_query)
+        self.db.execute(create_candidate_pool_table_query)
+
+    def tearDown(self):
+        self.db.close()
+
+    def pool_anime(self, id, score, popularity=100):
+        return {"id": id, "title": {"english": f"Anime {id}"}, "averageScore": score, "popularity": popularity}
+
+    def test_alias_table_matches_weights(self):
+        """Test that the chance of drawing each entry from an alias table is proportional to its weight"""
+        weights = [10, 1, 5, 0, 4]
+        probabilities, aliases = build_alias_table(weights)
+        chances = [probability / len(weights) for probability in probabilities]
+
+        for index, alias in enumerate(aliases):
+            if probabilities[index] < 1:
+                chances[alias] += (1 - probabilities[index]) / len(weights)
+
+        for chance, weight in zip(chances, weights):
+            self.assertAlmostEqual(chance, weight / sum(weights))
+
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("weighted_sampling.paginated_response")
+    @patch("builtins.print")
+    def test_candidate_pool_reused_for_same_criteria(self, mock_print, mock_response):
+        """Test that the anime matching a set of criteria are only downloaded once, even by a new process"""
+        mock_response.return_value = [self.pool_anime(1, 90), self.pool_anime(2, 20)]
+
+        get_recommended_anime(db=self.db, genres=["Action"], min_score=None, max_episodes=None,
+                              formats=[], status="", weighted_by=["score"])
+        # Dropping the in-memory pools means the second call has to read the pool saved to the database
+        weighted_sampling.candidate_pools.clear()
+        get_recommended_anime(db=self.db, genres=["Action"], min_score=None, max_episodes=None,
+                              formats=[], status="", weighted_by=["score"])
+
+        mock_response.assert_called_once()
+        assert mock_print.call_args_list[0].args[0] in [1, 2]
+        assert mock_print.call_args_list[1].args[0] in [1, 2]
+
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("weighted_sampling.paginated_response")
+    @patch("builtins.print")
+    def test_candidate_pool_in_memory_expires(self, mock_print, mock_response):
+        """Test that a long running process downloads a pool again once it has expired, along with its alias table"""
+        mock_response.side_effect = [[self.pool_anime(1, 90)], [self.pool_anime(2, 90), self.pool_anime(3, 90)]]
+
+        get_recommended_anime(db=self.db, genres=["Drama"], min_score=None, max_episodes=None,
+                              formats=[], status="", weighted_by=["score"])
+
+        with patch("weighted_sampling.time.time", Mock(return_value=time.time() + CANDIDATE_POOL_TTL + 1)):
+            get_recommended_anime(db=self.db, genres=["Drama"], min_score=None, max_episodes=None,
+                                  formats=[], status="", weighted_by=["score"])
+
+        assert mock_response.call_count == 2
+        assert mock_print.call_args_list[0].args[0] == 1
+        assert mock_print.call_args_list[1].args[0] in [2, 3]
+
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("weighted_sampling.paginated_response")
+    @patch("builtins.print")
+    def test_watched_anime_never_recommended(self, mock_print, mock_response):
+        """Test that a heavily weighted anime in the watch list is skipped"""
+        mock_response.return_value = [self.pool_anime(1, 100, 100000), self.pool_anime(2, 10, 1)]
+        self.db.execute(add_anime_query, (1, "Anime 1", None, "WATCHING"))
+
+        for _ in range(5):
+            get_recommended_anime(db=self.db, genres=[], min_score=None, max_episodes=None,
+                                  formats=[], status="", weighted_by=["score", "popularity"])
+
+        assert {call.args[0] for call in mock_print.call_args_list} == {2}
+
+    @patch("weighted_sampling.paginated_response")
+    @patch("builtins.print")
+    def test_every_weighted_match_watched(self, mock_print, mock_response):
+        """Test that a pool made up only of watched anime gives the no unique recommendation message"""
+        mock_response.return_value = [self.pool_anime(1, 80)]
+        self.db.execute(add_anime_query, (1, "Anime 1", None, "WATCHING"))
+
+        get_recommended_anime(db=self.db, genres=[], min_score=None, max_episodes=None,
+                              formats=[], status="", weighted_by=["score"])
+
+        mock_print.assert_called_once_with(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+
+
+@patch("project.formatted_recommended_anime", Mock(side_effect=lambda anime: anime["title"]["english"]))
+@patch("project.is_catalog_synced", Mock(return_value=False))
+class MultipleRecommendations(BaseWatchListTest):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute(create_table_query)
+
+    def tearDown(self):
+        self.db.close()
+
+    def recommended_anime(self, id, genres=["Action"], studio="Sunrise", score=70):
+        return {
+            "id": id,
+            "title": {"english": f"Anime {id}", "userPreferred": f"Anime {id}"},
+            "averageScore": score,
+            "popularity": 100,
+            "format": "TV",
+            "genres": genres,
+            "studios": {"edges": [{"node": {"name": studio}}]}
+        }
+
+    @patch("builtins.input", Mock(side_effect=["1,9", "1,3,3"]))
+    @patch("project.get_anime_batches")
+    @patch("project.paginated_response")
+    @patch("builtins.print")
+    def test_chosen_recommendations_added_together(self, mock_print, mock_response, mock_batches):
+        """Test that several anime are recommended from one crawl and the chosen ones are added at once"""
+        mock_response.return_value = [self.recommended_anime(id) for id in range(1, 6)]
+        mock_batches.side_effect = lambda query, ids: [self.recommended_anime(id) for id in reversed(ids)]
+
+        get_recommended_anime(db=self.db, genres=[], min_score=None, max_episodes=None,
+                              formats=[], status="", count=3)
+
+        mock_response.assert_called_once()
+        mock_batches.assert_called_once()
+        recommended_ids = mock_batches.call_args.args[1]
+        assert len(set(recommended_ids)) == 3
+        mock_print.assert_any_call(INVALID_SELECTION_MSG)
+        assert [row[2] for row in self.db.execute("SELECT * FROM watch_list ORDER BY id")] == [recommended_ids[0], recommended_ids[2]]
+
+    @patch("builtins.input", Mock(return_value="all"))
+    @patch("project.get_anime_batches")
+    @patch("project.paginated_response")
+    @patch("builtins.print", Mock())
+    def test_diverse_recommendations_avoid_near_duplicates(self, mock_response, mock_batches):
+        """Test that diverse recommendations don't pick anime that share the same genres and studio"""
+        mock_response.return_value = [
+            self.recommended_anime(1, score=90),
+            self.recommended_anime(2, score=89),
+            self.recommended_anime(3, ["Romance"], "Kyoto Animation", score=60)
+        ]
+        anime_by_id = {anime["id"]: anime for anime in mock_response.return_value}
+        mock_batches.side_effect = lambda query, ids: [anime_by_id[id] for id in ids]
+
+        get_recommended_anime(db=self.db, genres=[], min_score=None, max_episodes=None,
+                              formats=[], status="", count=2, diverse=True)
+
+        assert [row[2] for row in self.db.execute("SELECT * FROM watch_list ORDER BY id")] == [1, 3]
+
+
+class RankedRecommendation(BaseWatchListTest):
+    def ranked_anime(self, id, genres, studio, format="TV"):
+        return {
+            "id": id,
+            "title": {"english": f"Anime {id}", "userPreferred": f"Anime {id}"},
+            "averageScore": 70,
+            "popularity": 100,
+            "format": format,
+            "genres": genres,
+            "studios": {"edges": [{"node": {"name": studio}}]}
+        }
+
+    def test_candidates_ranked_by_similarity_to_high_scores(self):
+        """Test that candidates sharing features with highly scored anime rank above those like poorly scored anime"""
+        rated_anime = [
+            self.ranked_anime(1, ["Action", "Sci-Fi"], "Sunrise"),
+            self.ranked_anime(2, ["Romance", "Comedy"], "Kyoto Animation")
+        ]
+        candidates = [
+            self.ranked_anime(3, ["Romance"], "Kyoto Animation"),
+            self.ranked_anime(4, ["Action", "Sci-Fi"], "Sunrise"),
+            self.ranked_anime(5, ["Action"], "Bones")
+        ]
+
+        profile = build_profile(feature_matrix_from_anime(rated_anime), [95, 40])
+        top_positions, similarities = rank_by_similarity(feature_matrix_from_anime(candidates), profile, 2)
+
+        assert list(top_positions) == [1, 2]
+        assert similarities[0] > similarities[1]
+
+    def test_equal_scores_still_build_a_profile(self):
+        """Test that a watch list where every score is the same still ranks candidates"""
+        rated_anime = [self.ranked_anime(1, ["Action"], "Sunrise")]
+        candidates = [self.ranked_anime(2, ["Drama"], "Bones"), self.ranked_anime(3, ["Action"], "Sunrise")]
+
+        profile = build_profile(feature_matrix_from_anime(rated_anime), [80])
+        top_positions, _ = rank_by_similarity(feature_matrix_from_anime(candidates), profile, 5)
+
+        assert list(top_positions) == [1, 0]
+
+    @patch("project.is_catalog_synced", Mock(return_value=False))
+    @patch("project.get_anime_batches")
+    @patch("project.paginated_response")
+    @patch("tabulate.tabulate")
+    @patch("builtins.print")
+    def test_ranked_recommendations_listed(self, mock_print, mock_tabulate, mock_response, mock_batches):
+        """Test that the top unwatched matches are listed from most to least similar"""
+        mocked_db_anime = [
+            (1, 'Cowboy Bebop', 1, 95, 'COMPLETED'),
+            (2, 'Clannad', 2, 40, 'DROPPED'),
+            (3, 'Naruto', 6, None, 'PLAN TO WATCH')
+        ]
+        mock_batches.return_value = [
+            self.ranked_anime(1, ["Action", "Sci-Fi"], "Sunrise"),
+            self.ranked_anime(2, ["Romance", "Drama"], "Kyoto Animation")
+        ]
+        mock_response.return_value = [
+            self.ranked_anime(3, ["Romance"], "Kyoto Animation"),
+            self.ranked_anime(4, ["Action", "Sci-Fi"], "Sunrise"),
+            self.ranked_anime(6, ["Action", "Sci-Fi"], "Sunrise")
+        ]
+
+        get_ranked_anime(db=self.mocked_db(mocked_db_anime), genres=[], min_score=None,
+                         max_episodes=None, formats=[], status="", count=2)
+
+        table_records = mock_tabulate.call_args.args[0]
+        assert [record[1] for record in table_records] == ["Anime 4", "Anime 3"]
+        assert mock_response.call_args.args[1]["id_not_in"] == [1, 2, 6]
+        assert mock_batches.call_args.args[1] == [1, 2]
+        mock_print.assert_called_once_with(mock_tabulate())
+
+    @patch("project.paginated_response")
+    @patch("builtins.print")
+    def test_no_scored_anime(self, mock_print, mock_response):
+        """Test that ranking needs at least one scored anime in the watch list"""
+        mocked_db_anime = [(1, 'Cowboy Bebop', 1, None, 'PLAN TO WATCH')]
+
+        get_ranked_anime(db=self.mocked_db(mocked_db_anime), genres=[], min_score=None,
+                         max_episodes=None, formats=[], status="")
+
+        mock_response.assert_not_called()
+        mock_print.assert_called_once_with(NO_RATED_ANIME_MSG)
+
+
 class ViewWatchList(BaseWatchListTest):
     @patch("project.format_record_for_watch_list")
-    @patch("project.get_single_anime")
-    @patch("project.tabulate")
+    @patch("project.get_multiple_anime")
+    @patch("project.print_table")
     @patch("builtins.print")
-    def test_view_watch_list(self, mock_print, mock_tabulate, mock_single_anime, mock_formattted_record):
+    def test_view_watch_list(self, mock_print, mock_print_table, mock_multiple_anime, mock_formattted_record):
         """Test viewing the entries in the user's watch list"""
         mocked_db_anime = [
             (1, 'Cowboy Bebop', 10, None, 'PLAN TO WATCH'),
@@ -234,15 +685,18 @@ class ViewWatchList(BaseWatchListTest):
         mock_formatted_records = [f"Formatted record for {
             record[1]}" for record in mocked_db_anime]
 
-        mock_single_anime.side_effect = self.mocked_api_response()
+        mock_multiple_anime.return_value = {
+            anime["id"]: anime for anime in self.mocked_api_response()}
         mock_formattted_record.side_effect = mock_formatted_records
         db_mock = self.mocked_db(mocked_db_anime)
 
         view_watch_list(db_mock)
 
-        assert mock_formatted_records in mock_tabulate.call_args.args
-        db_mock.execute.assert_called_with(watch_list_query)
-        mock_print.assert_called_with(mock_tabulate())
+        assert list(mock_print_table.call_args.args[0]) == mock_formatted_records
+        mock_multiple_anime.assert_called_once_with([10, 20, 30], db_mock)
+        db_mock.execute.assert_called_with(
+            watch_list_page_query.format(where="", order=watch_list_sorts["score"][0]), (-1,))
+        mock_print.assert_not_called()
 
     @patch("builtins.print")
     def test_watch_list_empty(self, mock_print):
@@ -251,24 +705,1163 @@ class ViewWatchList(BaseWatchListTest):
 
         view_watch_list(db_mock)
 
-        db_mock.execute.assert_called_with(watch_list_query)
+        db_mock.execute.assert_called_once()
         mock_print.assert_called_with(WATCH_LIST_EMPTY_MSG)
 
+    def paged_watch_list(self):
+        db = sqlite3.connect(":memory:")
+        migrate(db)
+        db.executemany(add_anime_query, [
+            (10, "Cowboy Bebop", 90, "COMPLETED"),
+            (20, "ERASED", None, "WATCHING"),
+            (30, "Naruto", 70, "WATCHING"),
+            (40, "Akira", 70, "WATCHING"),
+            (50, "Monster", None, "WATCHING")
+        ])
+        self.addCleanup(db.close)
+
+        return db
+
+    @patch("project.get_multiple_anime")
+    @patch("project.print_table", Mock(side_effect=lambda records, headers: list(records)))
+    @patch("builtins.print")
+    def test_pages_follow_on_from_cursor(self, mock_print, mock_multiple_anime):
+        """Test that each page of a filtered watch list starts after the last entry of the page before"""
+        db = self.paged_watch_list()
+        mock_multiple_anime.side_effect = lambda ids, db: {id: self.mocked_api_response()[0] for id in ids}
+
+        view_watch_list(db, status="WATCHING", limit=2)
+        view_watch_list(db, status="WATCHING", limit=2, after=4)
+        view_watch_list(db, status="WATCHING", limit=2, after=5)
+
+        # Entries with the same score keep the order they were added in, and unscored entries come last
+        assert [call.args[0] for call in mock_multiple_anime.call_args_list] == [[30, 40], [20, 50]]
+        mock_print.assert_any_call("Add --after 4 to see the next page")
+        mock_print.assert_called_with(NO_MATCHING_ENTRIES_MSG)
+
+    def test_sorts_and_min_score(self):
+        """Test that the watch list can be sorted by title or by when entries were added, and filtered by score"""
+        db = self.paged_watch_list()
+
+        assert [row[1] for row in get_watch_list_page(db, sort="title", limit=2, after=1)] == ["ERASED", "Monster", "Naruto"]
+        assert [row[0] for row in get_watch_list_page(db, sort="added", after=2)] == [3, 4, 5]
+        assert [row[0] for row in get_watch_list_page(db, min_score=70)] == [1, 3, 4]
+        assert get_watch_list_page(db, after=99) is None
+
+    def test_pages_read_from_index(self):
+        """Test that every sort and status filter reads its page straight from an index, without sorting"""
+        db = self.paged_watch_list()
+
+        for sort, (order, after_condition) in watch_list_sorts.items():
+            for where in [f"WHERE {after_condition}", f"WHERE status = ? AND {after_condition}"]:
+                query = watch_list_page_query.format(where=where, order=order)
+                values = [None] * query.count("?")
+                query_plan = " ".join(row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {query}", values))
+
+                assert "SEARCH" in query_plan and "TEMP B-TREE" not in query_plan, query_plan
+
+
+class StartupTime(unittest.TestCase):
+    # The CLI is run thousands of times a day from scripts, so starting it up has to stay quick
+    IMPORT_BUDGET_MS = 100
+    RUN_BUDGET_MS = 150
+    HEAVY_MODULES = ["requests", "numpy", "tabulate", "termcolor"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.project_directory = os.path.dirname(os.path.abspath(__file__))
+        self.project_path = os.path.join(self.project_directory, "project.py")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_cli(self, *args):
+        # Run from an empty directory, so each run starts with a new, empty anime.db
+        return subprocess.run([sys.executable, *args], cwd=self.directory.name, capture_output=True, text=True,
+                              env={**os.environ, "PYTHONPATH": self.project_directory})
+
+    def imported_modules(self, *args):
+        # -X importtime writes a "self | cumulative | module" line to stderr for every module that is imported
+        lines = [line.split("|") for line in self.run_cli("-X", "importtime", *args).stderr.splitlines()
+                 if line.startswith("import time:") and "|" in line]
+
+        return {columns[2].strip(): int(columns[1]) for columns in lines if columns[1].strip().isdigit()}
+
+    def fastest_run_ms(self, *args):
+        timings = []
+
+        for _ in range(3):
+            start_time = time.perf_counter()
+            self.run_cli(*args)
+            timings.append((time.perf_counter() - start_time) * 1000)
+
+        return min(timings)
+
+    def test_heavy_modules_not_imported(self):
+        """Test that printing the help or an empty watch list doesn't import any of the slow dependencies"""
+        for args in [["--help"], ["watchlist", "-l"]]:
+            modules = self.imported_modules(self.project_path, *args)
+
+            assert "sqlite3" in modules
+            assert [module for module in self.HEAVY_MODULES if module in modules] == []
+
+    def test_import_leaves_heavy_modules_unloaded(self):
+        """Test that none of the slow dependencies are in sys.modules once the project has been imported"""
+        loaded_modules = self.run_cli("-c", "import sys, project; print(*sys.modules)").stdout.split()
+
+        assert "project" in loaded_modules
+        assert [module for module in self.HEAVY_MODULES if module in loaded_modules] == []
+
+    # Timings depend on the machine and on how busy it is, so the budgets are only checked when asked for with
+    # STARTUP_BENCHMARK=1 python -m pytest -k StartupTime
+    @unittest.skipUnless(os.environ.get("STARTUP_BENCHMARK"), "the start-up budgets only run with STARTUP_BENCHMARK set")
+    def test_import_within_budget(self):
+        """Test that importing the project and everything it imports stays within the budget"""
+        modules = self.imported_modules("-c", "import project")
+
+        assert modules["project"] / 1000 < self.IMPORT_BUDGET_MS
+
+    @unittest.skipUnless(os.environ.get("STARTUP_BENCHMARK"), "the start-up budgets only run with STARTUP_BENCHMARK set")
+    def test_commands_within_budget(self):
+        """Test that --help and an empty watchlist -l take little longer than starting the interpreter itself"""
+        interpreter_ms = self.fastest_run_ms("-c", "pass")
+
+        assert self.fastest_run_ms(self.project_path, "--help") - interpreter_ms < self.RUN_BUDGET_MS
+        assert self.fastest_run_ms(self.project_path, "watchlist", "-l") - interpreter_ms < self.RUN_BUDGET_MS
+
+
+class ServeMode(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, "anime.sock")
+        # The serve mode runs commands on its own thread here, so its connection is shared with the test's thread
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        migrate(self.db)
+        self.db.executemany(add_anime_query, [(1, "Cowboy Bebop", 90, "COMPLETED"), (2, "Trigun", None, "WATCHING")])
+        self.db.commit()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def start_serving(self):
+        threading.Thread(target=serve, daemon=True, args=(
+            self.db, lambda db, argv: run_command(db, get_args(argv)), self.socket_path)).start()
+
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def test_falls_back_without_serve_process(self):
+        """Test that a command isn't forwarded when nothing is serving on the socket"""
+        assert forward_command(["watchlist", "-l"], socket_path=self.socket_path) is False
+
+    def test_interactive_commands_forwarded(self):
+        """Test that a forwarded command's output and prompts go through the client, and later commands still work"""
+        self.start_serving()
+        output = io.StringIO()
+
+        assert forward_command(["watchlist", "-d"], output, io.StringIO("1\ny\n"), self.socket_path) is True
+        assert forward_command(["watchlist", "-l", "--limit", "0"], output, io.StringIO(), self.socket_path) is True
+
+        assert "Are you sure you want to delete your entry for Cowboy Bebop? " in output.getvalue()
+        assert output.getvalue().endswith(f"Successfully deleted Cowboy Bebop from your watch list\n{INVALID_LIMIT_MSG}\n")
+        assert self.db.execute("SELECT media_id FROM watch_list").fetchall() == [(2,)]
+
+    @patch.dict("os.environ", {"TERM": "xterm"})
+    @patch("project.get_multiple_anime")
+    def test_colors_follow_each_client(self, mock_anime):
+        """Test that each forwarded command is colored only when its client's output is a terminal"""
+        mock_anime.side_effect = lambda ids, db: {id: {"format": "TV", "episodes": 26, "startDate": {"year": 1998}, "season": "SPRING",
+                                                       "studios": {"edges": [{"node": {"name": "Sunrise"}}]}} for id in ids}
+        for name in ["NO_COLOR", "FORCE_COLOR", "ANSI_COLORS_DISABLED"]:
+            os.environ.pop(name, None)
+
+        self.start_serving()
+        outputs = [io.StringIO(), io.StringIO(), io.StringIO()]
+        outputs[0].isatty = outputs[2].isatty = lambda: True
+
+        for output in outputs:
+            forward_command(["watchlist", "-l"], output, io.StringIO(), self.socket_path)
+
+        assert ["\x1b[" in output.getvalue() for output in outputs] == [True, False, True]
+        assert all("Cowboy Bebop" in output.getvalue() for output in outputs)
+
+    def test_failed_command_reported(self):
+        """Test that an error in one command is sent to the client without stopping the serve process"""
+        self.start_serving()
+        output = io.StringIO()
+
+        with patch("project.view_watch_list", Mock(side_effect=ValueError("broken"))):
+            forward_command(["watchlist", "-l"], output, io.StringIO(), self.socket_path)
+
+        forward_command(["watchlist", "-u"], output, io.StringIO(""), self.socket_path)
+
+        assert "ValueError: broken" in output.getvalue()
+        assert "EOFError" in output.getvalue()
+
+
+@patch.dict("api_server.details_cache", clear=True)
+class ApiServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "anime.db")
+        self.db = sqlite3.connect(self.db_path)
+        migrate(self.db)
+        self.db.executemany(add_anime_query, [
+            (1, "Cowboy Bebop", 90, "COMPLETED"), (2, "Trigun", None, "WATCHING"), (3, "Akira", 70, "COMPLETED")
+        ])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def found_anime(self, query, ids, id_variable="id_in"):
+        # Id 404 doesn't exist on AniList in these tests
+        return [{"id": id, "idMal": None, "title": {"english": f"Anime {id}", "userPreferred": None}} for id in ids if id != 404]
+
+    @patch("api_server.get_multiple_anime")
+    def test_watch_list_filtered_and_paged(self, mock_anime):
+        """Test that the list endpoint filters, sorts and pages entries, and looks each anime up only once"""
+        mock_anime.side_effect = lambda ids, db: {id: {"id": id, "format": "TV"} for id in ids}
+        query = {"status": ["completed"], "sort": ["title"], "limit": ["1"]}
+
+        first_page = handle_api_request(self.db, "GET", "/watchlist", query, {})
+        second_page = handle_api_request(self.db, "GET", "/watchlist", {**query, "after": ["3"]}, {})
+        handle_api_request(self.db, "GET", "/watchlist", query, {})
+
+        assert first_page == (200, {"entries": [{"id": 3, "title": "Akira", "media_id": 3, "score": 70, "status": "COMPLETED",
+                                                 "anime": {"id": 3, "format": "TV"}}], "next_after": 3})
+        assert [entry["title"] for entry in second_page[1]["entries"]] == ["Cowboy Bebop"]
+        assert second_page[1]["next_after"] is None
+        assert mock_anime.call_args_list == [call([3], self.db), call([1], self.db)]
+
+    @patch("batch.get_anime_batches")
+    def test_watch_list_changed(self, mock_batches):
+        """Test that entries are added, updated and deleted, with the right status for each outcome"""
+        mock_batches.side_effect = self.found_anime
+
+        assert handle_api_request(self.db, "POST", "/watchlist", {}, {"media_id": 5, "status": "watching"})[0] == 201
+        assert handle_api_request(self.db, "POST", "/watchlist", {}, {"media_id": 5})[0] == 409
+        assert handle_api_request(self.db, "POST", "/watchlist", {}, {"media_id": 404})[0] == 404
+        assert handle_api_request(self.db, "PATCH", "/watchlist/2", {}, {"score": 80})[0] == 200
+        assert handle_api_request(self.db, "PATCH", "/watchlist/2", {}, {"score": 101}) == (400, {"error": "invalid score 101"})
+        assert handle_api_request(self.db, "DELETE", "/watchlist/1", {}, {})[0] == 200
+        assert handle_api_request(self.db, "DELETE", "/watchlist/1", {}, {})[0] == 404
+        assert handle_api_request(self.db, "DELETE", "/watchlist", {}, {})[0] == 405
+        assert handle_api_request(self.db, "GET", "/missing", {}, {})[0] == 404
+        assert self.db.execute("SELECT media_id, title, score, status FROM watch_list ORDER BY media_id").fetchall() == [
+            (2, "Trigun", 80, "WATCHING"), (3, "Akira", 70, "COMPLETED"), (5, "Anime 5", None, "WATCHING")
+        ]
+
+    @patch("project.is_catalog_synced", Mock(return_value=False))
+    @patch("project.get_anime_batches")
+    @patch("project.get_online_candidates")
+    def test_recommendations_returned(self, mock_candidates, mock_batches):
+        """Test that the recommend endpoint passes its criteria on and returns the details of every pick"""
+        mock_candidates.return_value = [{"id": 7, "averageScore": 80}, {"id": 8, "averageScore": 70}]
+        mock_batches.side_effect = self.found_anime
+
+        status, payload = handle_api_request(self.db, "GET", "/recommend", {
+            "genres": ["action,drama"], "formats": ["movie"], "min_score": ["60"], "count": ["2"]}, {})
+
+        assert status == 200
+        assert [anime["id"] for anime in payload["recommendations"]] == [7, 8]
+        assert mock_candidates.call_args.args == (
+            {"genre_in": ["Action", "Drama"], "averageScore_greater": 60, "format_in": ["MOVIE"], "status": "FINISHED"},
+            {1, 2, 3}, False, 2)
+        assert handle_api_request(self.db, "GET", "/recommend", {"genres": ["Cooking"]}, {})[0] == 400
+
+    @patch("api_server.HTTP_PAGE_LIMIT", 2)
+    @patch("api_server.get_multiple_anime", Mock(side_effect=lambda ids, db: {id: {"id": id} for id in ids}))
+    def test_watch_list_limit_checked(self):
+        """Test that a limit of 0 is rejected instead of being treated as the default, and large limits are capped"""
+        assert handle_api_request(self.db, "GET", "/watchlist", {"limit": ["0"]}, {})[0] == 400
+        assert handle_api_request(self.db, "GET", "/watchlist", {"limit": ["-1"]}, {})[0] == 400
+        assert len(handle_api_request(self.db, "GET", "/watchlist", {"limit": ["1000"]}, {})[1]["entries"]) == 2
+        assert len(handle_api_request(self.db, "GET", "/watchlist", {}, {})[1]["entries"]) == 2
+
+    @patch("api_server.get_multiple_anime", Mock(side_effect=lambda ids, db: {id: {"id": id} for id in ids}))
+    def test_concurrent_requests_served(self):
+        """Test that the server answers many concurrent requests from its worker pool over keep-alive connections"""
+        server = PooledHTTPServer(("127.0.0.1", 0), self.db_path, 4)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            report = run_load_test(f"http://127.0.0.1:{server.server_address[1]}/watchlist?limit=2", 200, 4)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert (report["requests"], report["errors"]) == (200, 0)
+        assert 0 < report["p50"] <= report["p99"]
+
+    @patch("api_server.get_multiple_anime", Mock(side_effect=lambda ids, db: {id: {"id": id} for id in ids}))
+    def test_idle_keep_alive_clients_dont_hold_workers(self):
+        """Test that a new client is answered right away while more keep-alive clients than workers sit idle"""
+        server = PooledHTTPServer(("127.0.0.1", 0), self.db_path, 2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        idle_clients = [http.client.HTTPConnection("127.0.0.1", server.server_address[1]) for _ in range(4)]
+
+        try:
+            for client in idle_clients:
+                client.request("GET", "/watchlist?limit=1")
+                client.getresponse().read()
+
+            start_time = time.perf_counter()
+            report = run_load_test(f"http://127.0.0.1:{server.server_address[1]}/watchlist?limit=1", 1, 1)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            for client in idle_clients:
+                client.close()
+
+            server.shutdown()
+            server.server_close()
+
+        assert (report["requests"], report["errors"]) == (1, 0)
+        assert elapsed < HTTP_KEEP_ALIVE_TIMEOUT / 2
+
+
+class TableRenderer(unittest.TestCase):
+    def test_rows_written_as_they_are_produced(self):
+        """Test that the table starts being written before every row has been produced"""
+        output = io.StringIO()
+        written_before_last_row = []
+
+        def records():
+            for index in range(TABLE_SAMPLE_ROWS + 5):
+                if index == TABLE_SAMPLE_ROWS + 4:
+                    written_before_last_row.append(output.getvalue().count("\n"))
+                yield [index + 1, f"Anime {index}"]
+
+        print_table(records(), ["", "Name"], output)
+
+        assert written_before_last_row[0] == TABLE_SAMPLE_ROWS + 4 + 1
+        assert output.getvalue().count("\n") == TABLE_SAMPLE_ROWS + 5 + 2
+
+    def test_matches_tabulate_layout(self):
+        """Test that the streamed table is laid out like tabulate's presto format"""
+        output = io.StringIO()
+        records = [[1, "Cowboy Bebop", "TV", 26], [2, "ERASED", "TV", None], [10, "Akira", "MOVIE", 1]]
+        headers = ["", "Name", "Type", "Episodes"]
+
+        print_table(records, headers, output)
+
+        assert output.getvalue() == tabulate(records, headers=headers, tablefmt="presto") + "\n"
+
+    def test_colored_cells_aligned(self):
+        """Test that color codes and emoji are measured by the space they take up in the terminal"""
+        output = io.StringIO()
+        records = [[1, formatted_status("COMPLETED"), formatted_score(86)],
+                   [2, formatted_status("PLAN TO WATCH"), formatted_score(None)]]
+
+        print_table(records, ["", "Status", "Score"], output)
+
+        lines = output.getvalue().splitlines()
+        assert len({display_width(line.split("|")[0] + line.split("|")[1]) for line in lines if "|" in line}) == 1
+        assert formatted_status("COMPLETED") is formatted_status("COMPLETED")
+
+    def test_long_values_past_sample_cut_to_fit(self):
+        """Test that a value longer than the measured column width is shortened instead of breaking the layout"""
+        output = io.StringIO()
+        records = [[1, "Short"]] * TABLE_SAMPLE_ROWS + [[2, "A much longer anime title"]]
+
+        print_table(records, ["", "Name"], output)
+
+        assert output.getvalue().splitlines()[-1] == "  2 | A muc…"
+
+
+class GetMultipleAnime(BaseWatchListTest):
+    @patch("helpers.post_query")
+    def test_ids_fetched_in_batches(self, mock_post):
+        """Test that media ids are resolved in batches of 50 instead of one request per id"""
+        mock_post.side_effect = [
+            {"data": {"Page": {"media": [{"id": id} for id in range(start, min(start + 50, 120))]}}}
+            for start in range(0, 120, 50)
+        ]
+
+        anime = get_multiple_anime(list(range(120)))
+
+        assert mock_post.call_count == 3
+        assert len(anime) == 120
+        assert mock_post.call_args_list[2].args[1]["id_in"] == list(range(100, 120))
+
+    @patch("helpers.post_query")
+    def test_duplicate_ids_requested_once(self, mock_post):
+        """Test that duplicate media ids are only requested once"""
+        mock_post.return_value = {"data": {"Page": {"media": [{"id": 10}]}}}
+
+        get_multiple_anime([10, 10, 10])
+
+        mock_post.assert_called_once()
+        assert mock_post.call_args.args[1]["id_in"] == [10]
+
+
+class AniListClient(unittest.TestCase):
+    def test_session_shared_between_calls(self):
+        """Test that every call reuses the same pooled session instead of opening new connections"""
+        assert get_session() is get_session()
+        assert get_session().get_adapter("https://graphql.anilist.co")._pool_maxsize >= 4
+        assert "gzip" in get_session().headers["Accept-Encoding"]
+
+    def mocked_response(self, status_code, payload=None, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(payload or {}).encode()
+        response.headers.update(headers or {})
+
+        return response
+
+    @patch("anilist_client.get_session")
+    def test_requests_sent_with_timeout(self, mock_session):
+        """Test that GraphQL requests go through the session with a timeout"""
+        mock_session.return_value.post.return_value = self.mocked_response(200, {"data": {}})
+
+        response = post_query("query", {"id": 10})
+
+        assert response == {"data": {}}
+        assert mock_session.return_value.post.call_args.kwargs["timeout"]
+        assert mock_session.return_value.post.call_args.kwargs["json"] == {
+            "query": "query", "variables": {"id": 10}}
+
+
+    @patch("anilist_client.random.uniform", Mock(return_value=0))
+    @patch("anilist_client.get_session")
+    def test_rate_limited_request_retried_after_delay(self, mock_session):
+        """Test that a 429 response is retried once the Retry-After delay has passed"""
+        clock = [1000.0]
+        mock_session.return_value.post.side_effect = [
+            self.mocked_response(429, {"errors": [{"message": "Too Many Requests."}]}, {"Retry-After": "3"}),
+            self.mocked_response(200, {"data": {"Media": {"id": 10}}})
+        ]
+
+        with patch("anilist_client.time.monotonic", side_effect=lambda: clock[0]), \
+                patch("anilist_client.time.sleep", side_effect=lambda seconds: clock.__setitem__(0, clock[0] + seconds)), \
+                patch("anilist_client.blocked_until", 0.0), \
+                patch("anilist_client.last_refill", 1000.0):
+            response = post_query("query", {"id": 10})
+
+        assert response == {"data": {"Media": {"id": 10}}}
+        assert mock_session.return_value.post.call_count == 2
+        assert clock[0] >= 1003
+
+    @patch("anilist_client.MAX_RETRIES", 2)
+    @patch("anilist_client.time.sleep")
+    @patch("anilist_client.get_session")
+    def test_server_errors_raise_once_retries_run_out(self, mock_session, mock_sleep):
+        """Test that repeated 5xx responses raise an error instead of returning the error payload"""
+        mock_session.return_value.post.return_value = self.mocked_response(
+            500, {"errors": [{"message": "Internal Server Error"}]})
+
+        with self.assertRaises(requests.HTTPError):
+            post_query("query", {"id": 10})
+
+        assert mock_session.return_value.post.call_count == 3
+
+    @patch("anilist_client.time.sleep")
+    @patch("anilist_client.get_session")
+    def test_missing_media_returned_to_caller(self, mock_session, mock_sleep):
+        """Test that a 404 that still contains data is returned rather than retried or raised"""
+        mock_session.return_value.post.return_value = self.mocked_response(
+            404, {"data": {"Media": None}, "errors": [{"message": "Not Found."}]})
+
+        response = post_query("query", {"id": 10})
+
+        assert response["data"] == {"Media": None}
+        mock_session.return_value.post.assert_called_once()
+
+    @patch("anilist_client.tokens", 0)
+    @patch("anilist_client.requests_per_minute", 90)
+    @patch("anilist_client.time.sleep")
+    def test_requests_paced_when_bucket_empty(self, mock_sleep):
+        """Test that a request waits for the bucket to refill instead of going over the rate limit"""
+        with patch("anilist_client.time.monotonic", side_effect=[100, 100 + 60 / 90]), \
+                patch("anilist_client.last_refill", 100):
+            wait_for_token()
+
+        mock_sleep.assert_called_once()
+        assert abs(mock_sleep.call_args.args[0] - 60 / 90) < 0.001
+
+
+class QueryRegistry(unittest.TestCase):
+    def test_only_used_fragments_included(self):
+        """Test that each query only contains the fragments it spreads"""
+        query = get_query("add_search")
+
+        assert "fragment SearchFields on Media" in query
+        assert "fragment PageInfoFields on PageInfo" in query
+        assert "DetailFields" not in query
+        assert "description" not in query
+
+    def test_nested_fragments_included(self):
+        """Test that fragments spread inside other fragments are included once"""
+        query = get_query("detail_card")
+
+        assert query.count("fragment DetailFields on Media") == 1
+        assert query.count("fragment ListFields on Media") == 1
+        assert "description" in query
+
+    def test_query_files_read_once(self):
+        """Test that queries are assembled once per process instead of re-reading the files on every call"""
+        get_query.cache_clear()
+
+        with patch("graphql_queries.read_query_file", wraps=read_query_file) as mock_read:
+            first_query = get_query("list_detail")
+            second_query = get_query("list_detail")
+
+        assert first_query is second_query
+        assert mock_read.call_args_list.count(call("media.graphql")) == 1
+
+
+class PaginatedResponse(BaseWatchListTest):
+    def mocked_post(self, last_page, pages_added_mid_crawl=0):
+        def post(query, variables):
+            page_num = variables["page"]
+            return {"data": {"Page": {
+                "pageInfo": {
+                    "lastPage": last_page,
+                    "hasNextPage": page_num < last_page + pages_added_mid_crawl
+                },
+                "media": [{"id": page_num}]
+            }}}
+
+        return post
+
+    @patch("helpers.post_query")
+    def test_pages_returned_in_order(self, mock_post):
+        """Test that pages fetched in parallel are still returned in page order"""
+        mock_post.side_effect = self.mocked_post(last_page=12)
+
+        response = paginated_response("query", {"search": "Naruto"}, concurrency=3)
+
+        assert [anime["id"] for anime in response] == list(range(1, 13))
+        assert mock_post.call_count == 12
+        assert all(
+            call.args[1]["search"] == "Naruto" for call in mock_post.call_args_list)
+
+    @patch("helpers.post_query")
+    def test_pages_added_mid_crawl_fetched(self, mock_post):
+        """Test that pages beyond the lastPage reported by the first response are still fetched"""
+        mock_post.side_effect = self.mocked_post(last_page=3, pages_added_mid_crawl=2)
+
+        response = paginated_response("query", {})
+
+        assert [anime["id"] for anime in response] == [1, 2, 3, 4, 5]
+
+    @patch("helpers.post_query")
+    def test_pages_fetched_without_concurrency(self, mock_post):
+        """Test that a concurrency below 1 still fetches every page, one at a time"""
+        mock_post.side_effect = self.mocked_post(last_page=3)
+
+        assert [anime["id"] for anime in paginated_response("query", {}, concurrency=0)] == [1, 2, 3]
+
+
+class MediaCache(BaseWatchListTest):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute(create_media_cache_table_query)
+
+    def tearDown(self):
+        self.db.close()
+
+    def mocked_page_response(self, anime):
+        return {"data": {"Page": {"media": anime}}}
+
+    @patch("helpers.post_query")
+    def test_cached_anime_served_without_network_calls(self, mock_post):
+        """Test that listing the same anime twice only hits the API on the first call"""
+        anime = [{**media, "status": "FINISHED"} for media in self.mocked_api_response()]
+        mock_post.return_value = self.mocked_page_response(anime)
+
+        first_result = get_multiple_anime([10, 20, 30], self.db)
+        second_result = get_multiple_anime([10, 20, 30], self.db)
+
+        mock_post.assert_called_once()
+        assert first_result == second_result
+
+    @patch("helpers.time.time")
+    @patch("helpers.post_query")
+    def test_releasing_anime_expire_before_finished_anime(self, mock_post, mock_time):
+        """Test that anime that are still releasing are fetched again once their shorter TTL has passed"""
+        finished, releasing, _ = self.mocked_api_response()
+        mock_time.return_value = 0
+        mock_post.return_value = self.mocked_page_response([
+            {**finished, "status": "FINISHED"},
+            {**releasing, "status": "RELEASING"}
+        ])
+
+        get_multiple_anime([10, 20], self.db)
+        mock_time.return_value = 24 * 60 * 60
+        get_multiple_anime([10, 20], self.db)
+
+        assert mock_post.call_args.args[1]["id_in"] == [20]
+
+    @patch("helpers.MEDIA_CACHE_MAX_ENTRIES", 2)
+    @patch("helpers.time.time")
+    @patch("helpers.post_query")
+    def test_least_recently_used_anime_evicted(self, mock_post, mock_time):
+        """Test that the least recently accessed entry is evicted once the cache is full"""
+        cowboy_bebop, erased, naruto = [
+            {**media, "status": "FINISHED"} for media in self.mocked_api_response()]
+        mock_post.side_effect = [
+            self.mocked_page_response([cowboy_bebop, erased]),
+            self.mocked_page_response([naruto])
+        ]
+
+        mock_time.return_value = 1
+        get_multiple_anime([10, 20], self.db)
+        mock_time.return_value = 2
+        get_multiple_anime([20], self.db)
+        mock_time.return_value = 3
+        get_multiple_anime([30], self.db)
+
+        cached_ids = [row[0] for row in self.db.execute("SELECT media_id FROM media_cache ORDER BY media_id")]
+        assert cached_ids == [20, 30]
+
+
+class Migrations(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_new_database_migrated_to_latest_version(self):
+        """Test that a new database gets every table and index, and that listing the watch list uses an index"""
+        migrate(self.db)
+
+        assert self.db.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        query_plan = " ".join(row[3] for row in self.db.execute(f"EXPLAIN QUERY PLAN {watch_list_query}"))
+        assert "COVERING INDEX watch_list_score" in query_plan
+
+    def test_duplicates_removed_before_unique_index(self):
+        """Test that an old watch list with the same anime twice keeps the newest entry and rejects new duplicates"""
+        self.db.execute(create_table_query)
+        self.db.executemany(add_anime_query, [(1, "Cowboy Bebop", 90, "COMPLETED"), (1, "Cowboy Bebop", None, "WATCHING"),
+                                              (2, "ERASED", None, "PLAN TO WATCH"), (3, "Mushishi", 70, "WATCHING"),
+                                              (3, "Mushishi", 85, "COMPLETED")])
+        self.db.commit()
+
+        with patch("builtins.print") as mock_print:
+            migrate(self.db)
+
+        assert list(self.db.execute("SELECT id, score, status FROM watch_list ORDER BY id")) == [
+            (2, 90, "WATCHING"), (3, None, "PLAN TO WATCH"), (5, 85, "COMPLETED")]
+        mock_print.assert_called_once_with(DUPLICATES_REMOVED_MSG.format(count=2))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.execute(add_anime_query, (2, "ERASED", None, "WATCHING"))
+
+    def test_current_schema_not_recreated(self):
+        """Test that nothing is run against a database that is already on the latest version"""
+        migrate(self.db)
+        db_mock = Mock()
+        db_mock.execute.return_value.fetchone.return_value = (len(MIGRATIONS),)
+
+        migrate(db_mock)
+
+        db_mock.execute.assert_called_once_with(user_version_query)
+
+    def test_failed_migration_rolled_back(self):
+        """Test that a migration that fails part way leaves the database on its previous version"""
+        with patch("migrations.MIGRATIONS", [MIGRATIONS[0], [create_watch_list_score_index_query, "NOT SQL"]]):
+            with self.assertRaises(sqlite3.OperationalError):
+                migrate(self.db)
+
+        assert self.db.execute("PRAGMA user_version").fetchone()[0] == 1
+        assert self.db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'watch_list_score'").fetchone()[0] == 0
+
+
+class ImportWatchList(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        migrate(self.db)
+        self.db.execute(add_anime_query, (1, "Cowboy Bebop", 90, "COMPLETED"))
+        self.db.commit()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def export_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+
+        with open(path, "w") as file:
+            file.write(content)
+
+        return path
+
+    def found_anime(self, query, ids, id_variable="id_in"):
+        # AniList ids are the MyAnimeList ids plus 1000 in these tests, and id 404 doesn't exist on either site
+        anime = [{"id": id + 1000, "idMal": id} for id in ids] if id_variable == "idMal_in" else [{"id": id, "idMal": id - 1000} for id in ids]
+
+        return [{**media, "title": {"english": f"Anime {media["id"]}", "userPreferred": None}}
+                for media in anime if 404 not in [media["id"], media["idMal"]]]
+
+    @patch("importer.get_anime_batches")
+    def test_mal_export_imported_in_one_transaction(self, mock_batches):
+        """Test that a MyAnimeList export is resolved in batches and added in one go, skipping duplicates"""
+        mock_batches.side_effect = self.found_anime
+        self.db.execute(add_anime_query, (1005, "Anime 1005", None, "WATCHING"))
+        self.db.commit()
+        path = self.export_file("animelist.xml", """<?xml version="1.0" encoding="UTF-8" ?>
+<myanimelist>
+  <myinfo><user_name>user</user_name></myinfo>
+  <anime><series_animedb_id>1</series_animedb_id><my_score>9</my_score><my_status>Completed</my_status></anime>
+  <anime><series_animedb_id>5</series_animedb_id><my_score>0</my_score><my_status>Plan to Watch</my_status></anime>
+  <anime><series_animedb_id>6</series_animedb_id><my_score>0</my_score><my_status>On-Hold</my_status></anime>
+  <anime><series_animedb_id>404</series_animedb_id><my_score>7</my_score><my_status>Dropped</my_status></anime>
+</myanimelist>""")
+
+        report = import_watch_list(self.db, path)
+
+        assert mock_batches.call_args.args[1:] == ([1, 5, 6, 404], "idMal_in")
+        assert self.db.execute("SELECT media_id, score, status FROM watch_list ORDER BY id").fetchall() == [
+            (1, 90, "COMPLETED"), (1005, None, "WATCHING"), (1001, 90, "COMPLETED"), (1006, None, "ON HOLD")
+        ]
+        assert (report["total"], report["added"], report["skipped"], report["not_found"]) == (4, 2, 1, 1)
+
+    @patch("importer.get_anime_batches")
+    def test_anilist_export_imported(self, mock_batches):
+        """Test that an AniList export has its ids verified and its statuses and scores converted"""
+        mock_batches.side_effect = self.found_anime
+        path = self.export_file("anilist.json", json.dumps({"data": {"MediaListCollection": {
+            "user": {"mediaListOptions": {"scoreFormat": "POINT_10_DECIMAL"}},
+            "lists": [
+                {"name": "Watching", "entries": [{"mediaId": 2000, "status": "CURRENT", "score": 0}]},
+                {"name": "Completed", "entries": [{"mediaId": 3000, "status": "COMPLETED", "score": 8.5},
+                                                  {"mediaId": 1, "status": "COMPLETED", "score": 7.5}]}
+            ]
+        }}}))
+
+        report = import_watch_list(self.db, path)
+
+        assert mock_batches.call_args_list[0].args[1] == [2000, 3000, 1]
+        assert self.db.execute("SELECT media_id, score, status FROM watch_list WHERE id > 1 ORDER BY id").fetchall() == [
+            (2000, None, "WATCHING"), (3000, 85, "COMPLETED")
+        ]
+        assert (report["added"], report["skipped"]) == (2, 1)
+
+    def test_anilist_scores_converted_from_score_format(self):
+        """Test that AniList scores are read in the export's score format, and that an export without one is rejected"""
+        def export(score_format, score):
+            media_list = {"lists": [{"entries": [{"mediaId": 2000, "status": "COMPLETED", "score": score}]}]}
+
+            if score_format:
+                media_list["user"] = {"mediaListOptions": {"scoreFormat": score_format}}
+
+            return {"data": {"MediaListCollection": media_list}}
+
+        assert parse_anilist_export(export("POINT_100", 8))[0]["score"] == 8
+        assert parse_anilist_export(export("POINT_10", 8))[0]["score"] == 80
+        assert parse_anilist_export(export("POINT_5", 4))[0]["score"] == 80
+        assert parse_anilist_export(export("POINT_3", 2))[0]["score"] == 67
+        assert import_watch_list(self.db, self.export_file("anilist.json", json.dumps(export(None, 8)))) is None
+
+    def test_unreadable_file(self):
+        """Test that a file that isn't an export is reported instead of importing anything"""
+        assert import_watch_list(self.db, self.export_file("notes.txt", "not an export")) is None
+        assert import_watch_list(self.db, os.path.join(self.directory.name, "missing.xml")) is None
+
+
+class BatchChanges(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        migrate(self.db)
+        self.db.executemany(add_anime_query, [(1, "Cowboy Bebop", 90, "COMPLETED"), (2, "Trigun", None, "WATCHING")])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def found_anime(self, query, ids, id_variable="id_in"):
+        # Id 404 doesn't exist on AniList in these tests
+        return [{"id": id, "idMal": None, "title": {"english": f"Anime {id}", "userPreferred": None}} for id in ids if id != 404]
+
+    def watch_list(self):
+        return self.db.execute("SELECT media_id, title, score, status FROM watch_list ORDER BY media_id").fetchall()
+
+    @patch("batch.get_anime_batches")
+    def test_csv_changes_applied_together(self, mock_batches):
+        """Test that adds, updates and deletes given as CSV are all applied, with titles fetched in one batch"""
+        mock_batches.side_effect = self.found_anime
+        rows = read_changes("action,media_id,status,score\nadd,3,watching,\nadd,404,,\nupdate,2,,80\ndelete,1,,\nadd,2,,\n")
+
+        changes, errors = validate_changes(rows)
+        report = apply_changes(self.db, changes)
+
+        assert errors == []
+        assert mock_batches.call_args.args[1] == [3, 404, 2]
+        assert self.watch_list() == [(2, "Trigun", 80, "WATCHING"), (3, "Anime 3", None, "WATCHING")]
+        assert report == {"added": 1, "skipped": 1, "updated": 1, "deleted": 1, "not_found": 1}
 
+    def test_json_formats_read(self):
+        """Test that changes can be given as a JSON array or as JSON Lines"""
+        changes = [{"action": "update", "media_id": 1, "status": "dropped"}, {"action": "delete", "media_id": 2}]
+
+        assert read_changes(json.dumps(changes)) == changes
+        assert read_changes("\n".join(json.dumps(change) for change in changes)) == changes
+        assert validate_changes(changes)[0] == [{"action": "update", "media_id": 1, "status": "DROPPED"}, {"action": "delete", "media_id": 2}]
+
+    @patch("builtins.print")
+    @patch("batch.get_anime_batches")
+    def test_invalid_entry_aborts_batch(self, mock_batches, mock_print):
+        """Test that one invalid change means none of the batch is applied"""
+        changes = [{"action": "delete", "media_id": 1}, {"action": "update", "media_id": 2, "score": 101},
+                   {"action": "rename", "media_id": 2}, {"action": "update", "media_id": 2}]
+
+        with patch("sys.stdin", io.StringIO(json.dumps(changes))):
+            handle_batch(self.db, get_args(["batch"]))
+
+        mock_batches.assert_not_called()
+        mock_print.assert_called_once_with("\n".join([
+            INVALID_BATCH_MSG, "Entry 2: invalid score 101", "Entry 3: unknown action 'rename'", "Entry 4: an update needs a status or a score"
+        ]))
+        assert len(self.watch_list()) == 2
+
+    def test_failed_batch_rolled_back(self):
+        """Test that an error partway through a batch leaves the watch list as it was"""
+        changes = validate_changes([{"action": "delete", "media_id": 1}, {"action": "update", "media_id": 2, "score": 50}])[0]
+
+        with patch("batch.batch_update_query", "UPDATE missing_table SET score = ?"):
+            with self.assertRaises(sqlite3.OperationalError):
+                apply_changes(self.db, changes)
+
+        assert len(self.watch_list()) == 2
+
+    @patch("builtins.print")
+    @patch("batch.get_anime_batches")
+    def test_watch_list_flags_without_prompts(self, mock_batches, mock_print):
+        """Test that -a, -u and -d with a media id change the watch list without any prompts"""
+        mock_batches.side_effect = self.found_anime
+
+        handle_watch_list(self.db, get_args(["watchlist", "-a", "-id", "5", "-ws", "completed", "-sc", "70"]))
+        handle_watch_list(self.db, get_args(["watchlist", "-u", "-id", "2", "-sc", "60"]))
+        handle_watch_list(self.db, get_args(["watchlist", "-d", "-id", "1"]))
+        handle_watch_list(self.db, get_args(["watchlist", "-l", "-id", "1"]))
+
+        assert self.watch_list() == [(2, "Trigun", 60, "WATCHING"), (5, "Anime 5", 70, "COMPLETED")]
+        assert mock_print.call_args_list[-1] == call(MEDIA_ID_FLAG_MSG)
+
+
+class Catalog(BaseWatchListTest):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+
+        # Full syncs start at 50 here, so every anime in these tests counts as updated after the first sync
+        for patcher in [patch("candidate_index.CANDIDATE_INDEX_DIR", index_dir.name), patch("candidate_index.loaded_index", None),
+                        patch("catalog.time", Mock(time=Mock(return_value=50)))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for query in [create_table_query, create_catalog_table_query, create_sync_state_table_query,
+                      create_similarity_table_query, create_similarity_bucket_index_query]:
+            self.db.execute(query)
+
+    def tearDown(self):
+        self.db.close()
+
+    def catalog_anime(self, id, updated_at, **fields):
+        return {
+            "id": id,
+            "title": {"english": f"Anime {id}", "userPreferred": f"Anime {id}"},
+            "averageScore": 75,
+            "popularity": id,
+            "episodes": 12,
+            "format": "TV",
+            "status": "FINISHED",
+            "genres": ["Action"],
+            "studios": {"edges": []},
+            "updatedAt": updated_at,
+            **fields
+        }
+
+    def mocked_page(self, anime, has_next_page):
+        return {"pageInfo": {"hasNextPage": has_next_page}, "media": anime}
+
+    @patch("catalog.get_page")
+    def test_interrupted_sync_resumes_from_checkpoint(self, mock_page):
+        """Test that a full sync that fails part way carries on from the last saved page, and keeps its start time"""
+        pages = {
+            1: self.mocked_page([self.catalog_anime(1, 100), self.catalog_anime(2, 300)], True),
+            2: self.mocked_page([self.catalog_anime(3, 200)], True),
+            3: self.mocked_page([self.catalog_anime(4, 150)], False)
+        }
+        mock_page.side_effect = [pages[1], pages[2], requests.ConnectionError]
+
+        with self.assertRaises(requests.ConnectionError):
+            sync_catalog(self.db)
+
+        mock_page.side_effect = lambda query, variables, page_num: pages[page_num]
+
+        with patch("catalog.time", Mock(time=Mock(return_value=5000))):
+            synced_count = sync_catalog(self.db)
+
+        assert synced_count == 1
+        assert mock_page.call_args_list[-1].args[2] == 3
+        assert self.db.execute("SELECT COUNT(*) FROM anime_catalog").fetchone()[0] == 4
+        # Anime 1 could have been updated after it was saved, so the next sync looks for changes from the crawl's start
+        assert self.db.execute("SELECT value FROM sync_state WHERE key = 'high_water_mark'").fetchone()[0] == "50"
+
+    @patch("catalog.get_page")
+    def test_incremental_sync_stops_at_high_water_mark(self, mock_page):
+        """Test that a later sync only saves anime updated since the last one"""
+        self.db.execute("INSERT INTO sync_state (key, value) VALUES ('high_water_mark', '500')")
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(7, 900, averageScore=90),
+            self.catalog_anime(8, 600),
+            self.catalog_anime(9, 400)
+        ], True)
+
+        synced_count = sync_catalog(self.db)
+
+        assert synced_count == 2
+        mock_page.assert_called_once()
+        assert mock_page.call_args.args[1] == {"sort": ["UPDATED_AT_DESC"]}
+        assert self.db.execute("SELECT value FROM sync_state WHERE key = 'high_water_mark'").fetchone()[0] == "900"
+
+    @patch("catalog.get_page")
+    def test_candidates_filtered_like_api(self, mock_page):
+        """Test that the recommend criteria are applied to the local catalog the same way AniList applies them"""
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(1, 1),
+            self.catalog_anime(2, 1, genres=["Comedy", "Romance"]),
+            self.catalog_anime(3, 1, averageScore=60),
+            self.catalog_anime(4, 1, episodes=64),
+            self.catalog_anime(5, 1, format="MOVIE"),
+            self.catalog_anime(6, 1, status="RELEASING"),
+            self.catalog_anime(7, 1, genres=["Romance", "Action", "Drama"]),
+            self.catalog_anime(8, 1, genres=["Drama"])
+        ], False)
+        sync_catalog(self.db)
+
+        index = get_candidate_index(self.db)
+        positions = filter_candidate_index(index, {
+            "genre_in": ["Action", "Drama"],
+            "averageScore_greater": 70,
+            "episodes_lesser": 26,
+            "format_in": ["TV", "ONA"],
+            "status": "FINISHED"
+        })
+
+        assert list(index["ids"][positions]) == [7]
+        assert list(index["ids"][filter_out_watched_positions(index, positions, {7})]) == []
+        # Anime with only one of the two genres (1 and 8) don't match, the same as with AniList's genre_in
+        assert list(index["ids"][filter_candidate_index(index, {"genre_in": ["Action", "Drama"]})]) == [7]
+        assert list(index["ids"][filter_candidate_index(index, {"genre_in": ["Action"]})]) == [1, 3, 4, 5, 6, 7]
+
+    @patch("catalog.get_page")
+    def test_sampled_from_catalog(self, mock_page):
+        """Test that --sample draws unwatched anime from the catalog without filtering out the whole watch list"""
+        mock_page.return_value = self.mocked_page([self.catalog_anime(id, 1) for id in range(1, 6)], False)
+        sync_catalog(self.db)
+
+        with patch("candidate_index.filter_out_watched_positions") as mock_filter:
+            candidates = get_catalog_candidates(self.db, {}, {1, 2}, count=2, sample=True)
+
+        mock_filter.assert_not_called()
+        assert len({candidate["id"] for candidate in candidates}) == 2
+        assert {candidate["id"] for candidate in candidates} <= {3, 4, 5}
+        # With every match watched, sampling gives up and the full filter reports that nothing is left
+        with patch("builtins.print") as mock_print:
+            assert get_catalog_candidates(self.db, {}, {1, 2, 3, 4, 5}, sample=True) is None
+
+        mock_print.assert_called_once_with(NO_UNIQUE_RECOMMENDATION_FOUND_MSG)
+
+    @patch("catalog.get_page")
+    def test_missing_scores_and_episodes_never_match(self, mock_page):
+        """Test that anime without a score or episode count are left out when filtering on them, like AniList does"""
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(1, 1, averageScore=None),
+            self.catalog_anime(2, 1, episodes=None),
+            self.catalog_anime(3, 1)
+        ], False)
+        sync_catalog(self.db)
+        index = get_candidate_index(self.db)
+
+        assert list(index["ids"][filter_candidate_index(index, {"averageScore_greater": 50})]) == [2, 3]
+        assert list(index["ids"][filter_candidate_index(index, {"episodes_lesser": 50})]) == [1, 3]
+
+    @patch("catalog.get_page")
+    def test_index_memory_mapped_and_rebuilt_after_sync(self, mock_page):
+        """Test that the saved index is memory mapped and rebuilt once the catalog has been synced again"""
+        mock_page.return_value = self.mocked_page([self.catalog_anime(1, 100)], False)
+        sync_catalog(self.db)
+        build_candidate_index(self.db)
+
+        with patch("candidate_index.build_candidate_index", wraps=build_candidate_index) as mock_build:
+            index = get_candidate_index(self.db)
+            mock_build.assert_not_called()
+            assert isinstance(index["ids"], np.memmap)
+
+            mock_page.return_value = self.mocked_page([self.catalog_anime(2, 200)], False)
+            sync_catalog(self.db)
+            index = get_candidate_index(self.db)
+
+        mock_build.assert_called_once()
+        assert list(index["ids"]) == [1, 2]
+
+    @patch("catalog.get_page")
+    def test_index_replaced_without_touching_mapped_files(self, mock_page):
+        """Test that a rebuild leaves the files already mapped intact, and that an unreadable index is rebuilt"""
+        mock_page.return_value = self.mocked_page([self.catalog_anime(1, 100)], False)
+        sync_catalog(self.db)
+        old_index = get_candidate_index(self.db)
+
+        mock_page.return_value = self.mocked_page([self.catalog_anime(2, 200)], False)
+        sync_catalog(self.db)
+        build_candidate_index(self.db)
+
+        assert list(old_index["ids"]) == [1]
+        assert [name for name in os.listdir(candidate_index.CANDIDATE_INDEX_DIR) if name.endswith(".tmp")] == []
+
+        with open(os.path.join(candidate_index.CANDIDATE_INDEX_DIR, "ids.npy"), "wb") as file:
+            file.write(b"\x93NUMPY")
+
+        assert load_candidate_index() is None
+        with patch("candidate_index.loaded_index", None):
+            assert list(get_candidate_index(self.db)["ids"]) == [1, 2]
+
+    @patch("catalog.get_page")
+    def test_search_served_from_catalog(self, mock_page):
+        """Test that searching the local catalog pages through titles that contain the name"""
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(id, 1, title={"english": f"Love {id}", "userPreferred": f"Koi {id}"})
+            for id in range(1, 61)
+        ] + [self.catalog_anime(61, 1)], False)
+        sync_catalog(self.db)
+
+        pages = list(iter_catalog_pages(self.db, "love"))
+
+        assert [len(page) for page in pages] == [50, 10]
+        assert pages[0][0]["id"] == 60
+
+    @patch("project.get_anime_details")
+    @patch("helpers.post_query")
+    @patch("catalog.get_page")
+    @patch("tabulate.tabulate")
+    @patch("builtins.input", Mock(return_value="1"))
+    @patch("builtins.print", Mock())
+    def test_similar_anime_found_without_network_calls(self, mock_tabulate, mock_page, mock_post, mock_details):
+        """Test that the anime most like a watch list entry are listed from the local similarity index"""
+        studios = lambda name: {"edges": [{"node": {"name": name}}]}
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(1, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise")),
+            self.catalog_anime(2, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise")),
+            self.catalog_anime(3, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise"), episodes=24),
+            self.catalog_anime(4, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise")),
+            self.catalog_anime(5, 1, genres=["Romance", "Slice of Life"], studios=studios("Kyoto Animation"),
+                               format="MOVIE", episodes=1)
+        ], False)
+        sync_catalog(self.db)
+        self.db.executemany(add_anime_query, [(1, "Anime 1", 90, "COMPLETED"), (4, "Anime 4", None, "PLAN TO WATCH")])
+
+        find_similar_anime(self.db)
+
+        mock_post.assert_not_called()
+        mock_details.assert_not_called()
+        assert [record[1] for record in mock_tabulate.call_args.args[0]][:2] == ["Anime 2", "Anime 3"]
+
+    @patch("catalog.get_page")
+    def test_similarity_index_only_rehashes_changed_anime(self, mock_page):
+        """Test that updating the similarity index only hashes anime changed since it was last updated"""
+        mock_page.return_value = self.mocked_page([self.catalog_anime(1, 100), self.catalog_anime(2, 200)], False)
+        sync_catalog(self.db)
+        update_similarity_index(self.db)
+        self.db.execute("DELETE FROM similarity_buckets WHERE media_id = 1")
+
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(2, 300, genres=["Romance"], format="MOVIE", episodes=1, averageScore=20),
+            self.catalog_anime(1, 100)
+        ], True)
+        sync_catalog(self.db)
+        update_similarity_index(self.db)
+
+        assert self.db.execute("SELECT COUNT(*) FROM similarity_buckets WHERE media_id = 1").fetchone()[0] == 0
+        assert self.db.execute("SELECT COUNT(*) FROM similarity_buckets WHERE media_id = 2").fetchone()[0] == LSH_TABLES
+        assert get_similar_anime(self.db, self.catalog_anime(9, 0, genres=["Romance"], format="MOVIE",
+                                                             episodes=1, averageScore=20), set(), 5)[0][0]["id"] == 2
+
+    @patch("helpers.post_query")
+    @patch("catalog.get_page")
+    @patch("tabulate.tabulate")
+    @patch("builtins.print", Mock())
+    def test_ranked_from_catalog_without_network_calls(self, mock_tabulate, mock_page, mock_post):
+        """Test that ranking uses the local catalog's index once it has been synced"""
+        studios = lambda name: {"edges": [{"node": {"name": name}}]}
+        mock_page.return_value = self.mocked_page([
+            self.catalog_anime(1, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise")),
+            self.catalog_anime(2, 1, genres=["Romance"], studios=studios("Kyoto Animation")),
+            self.catalog_anime(3, 1, genres=["Romance", "Drama"], studios=studios("Kyoto Animation")),
+            self.catalog_anime(4, 1, genres=["Action", "Sci-Fi"], studios=studios("Sunrise")),
+            self.catalog_anime(5, 1, genres=["Action"], studios=studios("Sunrise"), format="MOVIE")
+        ], False)
+        sync_catalog(self.db)
+        self.db.executemany(add_anime_query, [(1, "Anime 1", 90, "COMPLETED"), (2, "Anime 2", 30, "DROPPED")])
+
+        get_ranked_anime(db=self.db, genres=[], min_score=None, max_episodes=None, formats=[], status="")
+
+        mock_post.assert_not_called()
+        assert [record[1] for record in mock_tabulate.call_args.args[0]] == ["Anime 4", "Anime 3"]
+
+    @patch("project.get_anime_details")
+    @patch("helpers.post_query")
+    @patch("catalog.get_page")
+    @patch("builtins.input", Mock(return_value="n"))
+    @patch("builtins.print", Mock())
+    def test_recommendation_made_without_network_calls(self, mock_page, mock_post, mock_details):
+        """Test that a recommendation is made from the local catalog once it has been synced"""
+        mock_page.return_value = self.mocked_page([
+            {**self.mocked_api_response()[0], **self.catalog_anime(10, 1),
+             "title": {"english": "Cowboy Bebop", "userPreferred": "Cowboy Bebop"}}
+        ], False)
+        sync_catalog(self.db)
+        mock_page.reset_mock()
+
+        with patch("project.formatted_recommended_anime", return_value="Formatted Anime Response") as mock_formatted:
+            get_recommended_anime(db=self.db, genres=["Action"], min_score=None,
+                                  max_episodes=None, formats=[], status="")
+
+        mock_page.assert_not_called()
+        mock_post.assert_not_called()
+        mock_details.assert_not_called()
+        assert mock_formatted.call_args.args[0]["title"]["english"] == "Cowboy Bebop"
+
+
+@patch("project.is_catalog_synced", Mock(return_value=False))
 class AddToWatchList(BaseWatchListTest):
-    @patch("project.tabulate")
+    @patch("tabulate.tabulate", Mock())
+    @patch("project.iter_pages")
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_anime_already_in_watch_list(self, mock_input, mock_print, mock_iter_pages):
+        """Test that adding an anime that is already in the watch list is reported instead of crashing"""
+        db = sqlite3.connect(":memory:")
+        migrate(db)
+        db.execute(add_anime_query, (10, "Cowboy Bebop", None, "PLAN TO WATCH"))
+        mock_input.side_effect = ["Cowboy Bebop", "1", "completed", "86"]
+        mock_iter_pages.return_value = iter([self.mocked_api_response()])
+
+        add_anime_to_watch_list(db)
+
+        mock_print.assert_called_with("Cowboy Bebop is already in your watch list")
+        assert db.execute("SELECT score, status FROM watch_list").fetchall() == [(None, "PLAN TO WATCH")]
+        db.close()
+
+    @patch("tabulate.tabulate")
     @patch("project.format_response_for_add")
-    @patch("project.paginated_response")
+    @patch("project.iter_pages")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_happy_path(self, mock_input, mock_print, mock_paginated_response, mock_formatted_response, mock_tabulate):
+    def test_happy_path(self, mock_input, mock_print, mock_iter_pages, mock_formatted_response, mock_tabulate):
         """Testing the path where api responses are received and the expected input is given"""
         db_mock = self.mocked_db(())
         mock_formatted_records = [f"Formatted record for {
             record["title"]}" for record in self.mocked_api_response()]
 
         mock_input.side_effect = ["Cowboy Bebop", "1", "completed", "86"]
-        mock_paginated_response.return_value = self.mocked_api_response()
+        mock_iter_pages.return_value = iter([self.mocked_api_response()])
         mock_formatted_response.side_effect = mock_formatted_records
 
         add_anime_to_watch_list(db_mock)
@@ -284,12 +1877,12 @@ class AddToWatchList(BaseWatchListTest):
             add_anime_query, (10, "Cowboy Bebop", 86, "COMPLETED"))
         db_mock.commit.assert_called_once()
 
-    @patch("project.tabulate")
+    @patch("tabulate.tabulate")
     @patch("project.format_response_for_add")
-    @patch("project.paginated_response")
+    @patch("project.iter_pages")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_dreaded_path(self, mock_input, mock_print, mock_paginated_response, mock_formatted_response, mock_tabulate):
+    def test_dreaded_path(self, mock_input, mock_print, mock_iter_pages, mock_formatted_response, mock_tabulate):
         """
         Testing the path where multiple api requests are required 
         and all instances of unexpected input are caught and handled
@@ -311,7 +1904,7 @@ class AddToWatchList(BaseWatchListTest):
             "101",
             EOFError,
         ]
-        mock_paginated_response.side_effect = [[], self.mocked_api_response()]
+        mock_iter_pages.side_effect = [iter([[]]), iter([self.mocked_api_response()])]
         mock_formatted_response.side_effect = mock_formatted_records
 
         add_anime_to_watch_list(db_mock)
@@ -333,13 +1926,56 @@ class AddToWatchList(BaseWatchListTest):
             add_anime_query, (10, "Cowboy Bebop", None, "PLAN TO WATCH"))
         db_mock.commit.assert_called_once()
 
+    @patch("project.PAGE_SIZE", 3)
+    @patch("tabulate.tabulate")
+    @patch("project.format_response_for_add")
+    @patch("project.iter_pages")
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_more_results_loaded_on_request(self, mock_input, mock_print, mock_iter_pages, mock_formatted_response, mock_tabulate):
+        """Test that the first page is shown straight away and the next page is only fetched when asked for"""
+        db_mock = self.mocked_db(())
+        pages_fetched = []
+        more_anime = {**self.mocked_api_response()[0], "id": 40, "title": {"english": "Trigun", "userPreferred": "Trigun"}}
+
+        def pages(query, variables):
+            for page in [self.mocked_api_response(), [more_anime]]:
+                pages_fetched.append(page)
+                yield page
+
+        mock_iter_pages.side_effect = pages
+        mock_input.side_effect = ["Cowboy", "m", "m", "4", "watching", EOFError]
+
+        add_anime_to_watch_list(db_mock)
+
+        assert len(pages_fetched) == 2
+        assert "(m for more results)" in mock_input.call_args_list[1].args[0]
+        assert [call.args[0] for call in mock_formatted_response.call_args_list] == [0, 1, 2, 3]
+        mock_print.assert_any_call(NO_MORE_RESULTS_MSG)
+        db_mock.execute.assert_called_with(
+            add_anime_query, (40, "Trigun", None, "WATCHING"))
+
+    @patch("tabulate.tabulate", Mock())
+    @patch("project.format_response_for_add", Mock())
+    @patch("helpers.get_page")
+    @patch("builtins.print", Mock())
+    @patch("builtins.input")
+    def test_only_first_page_fetched_when_match_found(self, mock_input, mock_page):
+        """Test that later pages aren't downloaded when the anime is on the first page"""
+        mock_page.return_value = {"pageInfo": {"hasNextPage": True}, "media": self.mocked_api_response()}
+        mock_input.side_effect = ["Cowboy Bebop", "1", "completed", "86"]
+
+        add_anime_to_watch_list(self.mocked_db(()))
+
+        mock_page.assert_called_once()
+
 
 class UpdateEntryInWatchList(BaseWatchListTest):
     @patch("helpers.table_record_for_viewing")
-    @patch("helpers.tabulate")
+    @patch("helpers.print_table")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_happy_path(self, mock_input, mock_print, mock_tabulate, mock_table_record):
+    def test_happy_path(self, mock_input, mock_print, mock_print_table, mock_table_record):
         """
         Testing the path where the expected input is given,
         resulting in the entry in the watch list being updated
@@ -358,23 +1994,22 @@ class UpdateEntryInWatchList(BaseWatchListTest):
 
         update_anime_in_watch_list(db_mock)
 
-        assert mocked_db_anime in mock_tabulate.call_args.args
+        assert list(mock_print_table.call_args.args[0]) == mocked_db_anime
         db_mock.commit.assert_called_once()
-        db_mock.execute.assert_called_with(
+        db_mock.executemany.assert_called_once_with(
             update_query.format(column="score"),
-            (70, 2)
+            [(70, 2)]
         )
         mock_print.assert_has_calls([
-            call(mock_tabulate(), end='\n\n'),
             call(),
             call("Successfully updated ERASED's score to 70")
         ])
 
     @patch("helpers.table_record_for_viewing")
-    @patch("helpers.tabulate")
+    @patch("helpers.print_table")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_dreaded_path(self, mock_input, mock_print, mock_tabulate, mock_table_record):
+    def test_dreaded_path(self, mock_input, mock_print, mock_print_table, mock_table_record):
         """
         Testing the path where unexpected input is provided,
         but the entry is ultimately updated
@@ -402,14 +2037,13 @@ class UpdateEntryInWatchList(BaseWatchListTest):
         update_anime_in_watch_list(db_mock)
 
         assert mock_input.call_count == 7
-        assert mocked_db_anime in mock_tabulate.call_args.args
+        assert list(mock_print_table.call_args.args[0]) == mocked_db_anime
         db_mock.commit.assert_called_once()
-        db_mock.execute.assert_called_with(
+        db_mock.executemany.assert_called_once_with(
             update_query.format(column="status"),
-            ("COMPLETED", 1)
+            [("COMPLETED", 1)]
         )
         mock_print.assert_has_calls([
-            call(mock_tabulate(), end='\n\n'),
             call(INVALID_OPTION_MSG),
             call(INVALID_OPTION_MSG),
             call(INVALID_PROPERTIES_MSG),
@@ -418,6 +2052,53 @@ class UpdateEntryInWatchList(BaseWatchListTest):
             call("Successfully updated Cowboy Bebop's status to COMPLETED")
         ])
 
+    @patch("helpers.table_record_for_viewing")
+    @patch("helpers.print_table")
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_multiple_entries_updated(self, mock_input, mock_print, mock_print_table, mock_table_record):
+        """
+        Test that a list of entries and ranges are all updated after a single confirmation,
+        with one statement and one commit
+        """
+        mocked_db_anime = [(id, f"Anime {id}", id * 10, None, "WATCHING") for id in range(1, 11)]
+
+        mock_table_record.side_effect = mocked_db_anime
+        mock_input.side_effect = ["0", "", "1,4,7-9,4", "status", "dropped", "y"]
+        db_mock = self.mocked_db(mocked_db_anime)
+
+        update_anime_in_watch_list(db_mock)
+
+        db_mock.executemany.assert_called_once_with(
+            update_query.format(column="status"),
+            [("DROPPED", 1), ("DROPPED", 4), ("DROPPED", 7), ("DROPPED", 8), ("DROPPED", 9)]
+        )
+        db_mock.commit.assert_called_once()
+        mock_print.assert_has_calls([
+            call(INVALID_OPTION_MSG),
+            call(INVALID_OPTION_MSG),
+            call(),
+            call("Successfully updated the status of 5 entries to DROPPED")
+        ])
+
+    @patch("helpers.table_record_for_viewing")
+    @patch("helpers.print_table")
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_multiple_entries_update_cancelled(self, mock_input, mock_print, mock_print_table, mock_table_record):
+        """Test that nothing is updated when a change to several entries isn't confirmed"""
+        mocked_db_anime = [(1, "Naruto", 30, None, 'PLAN TO WATCH'), (2, "Demon Slayer", 40, None, 'PLAN TO WATCH')]
+
+        mock_table_record.side_effect = mocked_db_anime
+        mock_input.side_effect = ["all", "score", "fifty", "50", "n"]
+        db_mock = self.mocked_db(mocked_db_anime)
+
+        update_anime_in_watch_list(db_mock)
+
+        db_mock.executemany.assert_not_called()
+        db_mock.commit.assert_not_called()
+        mock_print.assert_has_calls([call(INVALID_SCORE_MSG), call(), call(CANCEL_UPDATE_MSG)])
+
     @patch("builtins.print")
     def test_no_entries_to_update(self, mock_print):
         """
@@ -435,10 +2116,10 @@ class UpdateEntryInWatchList(BaseWatchListTest):
 
 class DeleteEntryInWatchList(BaseWatchListTest):
     @patch("helpers.table_record_for_viewing")
-    @patch("helpers.tabulate")
+    @patch("helpers.print_table")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_happy_path(self, mock_input, mock_print, mock_tabulate, mock_table_record):
+    def test_happy_path(self, mock_input, mock_print, mock_print_table, mock_table_record):
         """
         Test when the expected input is given for each step,
         resulting in the entry being deleted from the watch lists
@@ -454,22 +2135,19 @@ class DeleteEntryInWatchList(BaseWatchListTest):
 
         delete_anime_in_watch_list(db_mock)
 
-        assert mocked_db_anime in mock_tabulate.call_args.args
-        db_mock.execute.assert_has_calls([
-            call(watch_list_query),
-            call(delete_query, (2,))
-        ])
+        assert list(mock_print_table.call_args.args[0]) == mocked_db_anime
+        db_mock.execute.assert_called_once_with(watch_list_query)
+        db_mock.executemany.assert_called_once_with(delete_query, [(2,)])
         db_mock.commit.assert_called_once()
         mock_print.assert_has_calls([
-            call(mock_tabulate(), end="\n\n"),
             call("Successfully deleted Demon Slayer from your watch list")
         ])
 
     @patch("helpers.table_record_for_viewing")
-    @patch("helpers.tabulate")
+    @patch("helpers.print_table")
     @patch("builtins.print")
     @patch("builtins.input")
-    def test_dreaded_path(self, mock_input, mock_print, mock_tabulate, mock_table_record):
+    def test_dreaded_path(self, mock_input, mock_print, mock_print_table, mock_table_record):
         """
         Test when invalid input is given when trying to delete a record in the user's watch list,
         and when the user ultimately decides not to delete the entry
@@ -491,18 +2169,41 @@ class DeleteEntryInWatchList(BaseWatchListTest):
 
         delete_anime_in_watch_list(db_mock)
 
-        assert mocked_db_anime in mock_tabulate.call_args.args
+        assert list(mock_print_table.call_args.args[0]) == mocked_db_anime
         assert mock_input.call_count == 5
         db_mock.execute.assert_called_once_with(watch_list_query)
+        db_mock.executemany.assert_not_called()
         db_mock.commit.assert_not_called()
         mock_print.assert_has_calls([
-            call(mock_tabulate(), end="\n\n"),
             call(INVALID_OPTION_MSG),
             call(INVALID_OPTION_MSG),
             call(INVALID_CONFIRMATION_MSG),
             call(CANCEL_DELETE_MSG)
         ])
 
+    @patch("helpers.table_record_for_viewing")
+    @patch("helpers.print_table")
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_multiple_entries_deleted(self, mock_input, mock_print, mock_print_table, mock_table_record):
+        """Test that a range of entries is deleted after a single confirmation, and that a reversed range is rejected"""
+        mocked_db_anime = [(1, "Naruto", 30, None, 'DROPPED'), (2, "Demon Slayer", 40, None, 'DROPPED'),
+                           (3, "ERASED", 20, None, 'COMPLETED')]
+        db_mock = self.mocked_db(mocked_db_anime)
+
+        mock_input.side_effect = ["1,2-1", "1-2", "y"]
+        mock_table_record.side_effect = mocked_db_anime
+
+        delete_anime_in_watch_list(db_mock)
+
+        assert mock_input.call_args.args[0] == "Are you sure you want to delete your entries for these 2 anime (Naruto, Demon Slayer)? "
+        db_mock.executemany.assert_called_once_with(delete_query, [(1,), (2,)])
+        db_mock.commit.assert_called_once()
+        mock_print.assert_has_calls([
+            call(INVALID_OPTION_MSG),
+            call("Successfully deleted these 2 anime (Naruto, Demon Slayer) from your watch list")
+        ])
+
     @patch("builtins.print")
     def test_no_entries_to_delete(self, mock_print):
         """
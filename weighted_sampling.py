@@ -0,0 +1,106 @@
+import random
+import json
+import time
+
+from constants import SAMPLE_ATTEMPTS, CANDIDATE_POOL_TTL
+from helpers import paginated_response
+from sql_queries import candidate_pool_query, upsert_candidate_pool_query, delete_expired_candidate_pools_query
+
+# Candidate pools (with the time they expire) and their alias tables, kept in memory once they have been loaded
+candidate_pools = {}
+alias_tables = {}
+
+
+def get_candidate_pool(db, query, variables):
+    pool_key = json.dumps(variables, sort_keys=True)
+    now = time.time()
+
+    if pool_key in candidate_pools and candidate_pools[pool_key][1] > now:
+        return candidate_pools[pool_key][0]
+
+    row = db.execute(candidate_pool_query, (pool_key, now)).fetchone()
+
+    if row:
+        pool, expires_at = json.loads(row[0]), row[1]
+    else:
+        # Only what sampling needs is kept, so a pool of every matching anime stays small on disk
+        pool = [
+            {"id": anime["id"], "averageScore": anime["averageScore"], "popularity": anime["popularity"]}
+            for anime in paginated_response(query, variables)
+        ]
+        expires_at = now + CANDIDATE_POOL_TTL
+        db.execute(delete_expired_candidate_pools_query, (now,))
+        db.execute(upsert_candidate_pool_query, (pool_key, json.dumps(pool), expires_at))
+        db.commit()
+
+    # A process that runs for longer than the TTL (such as the serve mode) needs the alias tables of a pool it
+    # replaces to be built again as well
+    for alias_key in [key for key in list(alias_tables) if key[0] == pool_key]:
+        alias_tables.pop(alias_key, None)
+
+    candidate_pools[pool_key] = (pool, expires_at)
+
+    return pool
+
+
+def candidate_weights(scores, popularity, weighted_by):
+    weights = [1] * len(scores)
+
+    # Anime without a score or popularity still get the smallest weight, so they can be picked now and then
+    if "score" in weighted_by:
+        weights = [weight * max(score or 1, 1) for weight, score in zip(weights, scores)]
+    if "popularity" in weighted_by:
+        weights = [weight * max(count or 1, 1) for weight, count in zip(weights, popularity)]
+
+    return weights
+
+
+def pick_weighted(pool_key, ids, weights, watched_ids, attempts=SAMPLE_ATTEMPTS):
+    if pool_key not in alias_tables:
+        alias_tables[pool_key] = build_alias_table(weights)
+
+    # Drawing again whenever a watched anime comes up keeps every unwatched anime at its weighted chance
+    for _ in range(attempts):
+        position = draw_from_alias_table(alias_tables[pool_key])
+
+        if int(ids[position]) not in watched_ids:
+            return position
+
+    unwatched_positions = [position for position, id in enumerate(ids) if int(id) not in watched_ids]
+
+    if len(unwatched_positions) == 0:
+        return None
+
+    unwatched_table = build_alias_table([weights[position] for position in unwatched_positions])
+
+    return unwatched_positions[draw_from_alias_table(unwatched_table)]
+
+
+def build_alias_table(weights):
+    # Vose's alias method: every slot holds part of one anime's chance, topped up with a share of another's
+    count = len(weights)
+    total = sum(weights)
+    probabilities = [weight * count / total for weight in weights]
+    aliases = [0] * count
+    small = [index for index, probability in enumerate(probabilities) if probability < 1]
+    large = [index for index, probability in enumerate(probabilities) if probability >= 1]
+
+    while small and large:
+        less, more = small.pop(), large.pop()
+        aliases[less] = more
+        probabilities[more] -= 1 - probabilities[less]
+
+        (small if probabilities[more] < 1 else large).append(more)
+
+    # Whatever is left over is only off from 1 by rounding errors
+    for index in small + large:
+        probabilities[index] = 1
+
+    return probabilities, aliases
+
+
+def draw_from_alias_table(table):
+    probabilities, aliases = table
+    index = random.randrange(len(probabilities))
+
+    return index if random.random() < probabilities[index] else aliases[index]